@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+import getopt
+import glob
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from workflow import Workflow
+from deduper import Deduper
+from checkpoint import Checkpoint
+from venuemap import VenueMap
+
+
+#batch.py runs a workflow (see workflow.py: the deduper, coreffer and refsplitter stages) over every vivo-additions file
+#in a directory, e.g. one per department, on a pool of processes, one per core by default.
+#The workers share one Vivo lookup cache, the lookups of a Checkpoint and the ISSNs of a VenueMap kept in dicts of a
+#multiprocessing Manager, so that a PubMed ID, uri or ISSN is looked up once for the whole batch.  (Two workers that need
+#the same value at the same time may still both ask Vivo for it.)  The venue map can be kept across runs with -v.
+#Nobody is there to answer a prompt, so venues are picked by the 'most' or 'queue' policy (see Deduper._pickVivoVenue()),
+#and every file leaves its review file next to its output.
+#When all files are done, a summary of each (stages run, triples, publications, lookups, venues left for review, and the
+#output or the error) is written to a tab-separated report, with the totals.
+
+class BatchException(Exception):
+    def __init__(self, message):
+        logging.error(message)
+
+
+#the columns of the report, and the numeric ones that get a total
+REPORT = ['input', 'status', 'seconds', 'stages_run', 'stages_cached', 'triples_in', 'triples_out', 'pubs_in', 'pubs_out', 'lookups', 'issns', 'review', 'output']
+TOTALS = ['seconds', 'stages_run', 'stages_cached', 'triples_in', 'triples_out', 'pubs_in', 'pubs_out', 'lookups', 'issns', 'review']
+
+
+#run the workflow on one input file, in a worker process, and return its line of the report as a dict
+def _run_file(job):
+    (workflowfile, inputfile, force, lookups, issns, venuepolicy, venuechoices) = job
+    resume = Checkpoint()
+    resume.lookups = lookups
+    venuemap = VenueMap()
+    venuemap.issns = issns
+    result = {'input': inputfile, 'status': 'ok'}
+    started = time.time()
+    try:
+        workflow = Workflow(workflowfile, resume=resume, venues=dict(venuemap=venuemap, venuepolicy=venuepolicy, venuechoices=venuechoices))
+        workflow.run(inputfile, force)
+        result.update(workflow.report)
+    except Exception as e:
+        logging.exception("%s failed", inputfile)
+        result.update(status='failed', output=str(e))
+    result.update(seconds=round(time.time() - started, 1), lookups=resume.fetched, issns=venuemap.fetched)
+    return result
+
+#the input files in inputdir matching pattern, leaving out the output of earlier runs, whose names start with a stage code
+def find_inputs(workflowfile, inputdir, pattern):
+    codes = set(stage['code'] for stage in Workflow(workflowfile)._stages)
+    inputs = []
+    for filename in sorted(glob.glob(os.path.join(inputdir, pattern))):
+        if os.path.basename(filename).split('-', 1)[0] not in codes:
+            inputs.append(filename)
+    return inputs
+
+#Run workflowfile on every input file of inputdir, with processes workers (default: one per core), and write the summary
+#to reportfile (default: batch-report.tsv in inputdir).  venuemapfile, venuepolicy and venuechoicefile are as for deduper.py.
+#Returns the report, a list of dicts.
+def run_batch(workflowfile, inputdir, pattern="*vivo-additions.rdf.xml", processes=None, force=False, venuemapfile=None,
+        venuepolicy='queue', venuechoicefile=None, reportfile=None):
+    if venuepolicy not in Deduper.VENUE_POLICIES or venuepolicy == 'prompt':
+        raise BatchException("a batch can't prompt for venues, use the venue policy 'most' or 'queue'")
+    inputs = find_inputs(workflowfile, inputdir, pattern)
+    if not inputs:
+        raise BatchException("no input files matching "+pattern+" in "+inputdir)
+    processes = min(processes or multiprocessing.cpu_count(), len(inputs))
+    logging.info("running %s on %d files with %d processes", workflowfile, len(inputs), processes)
+
+    venuemap = VenueMap(venuemapfile)
+    choices = VenueMap.read_choices(venuechoicefile) if venuechoicefile is not None else {}
+    manager = multiprocessing.Manager()
+    lookups = manager.dict()
+    issns = manager.dict(venuemap.issns)
+    pool = multiprocessing.Pool(processes)
+    try:
+        #map_async().get() with a timeout, rather than map(), so that Ctrl-C reaches the pool
+        results = pool.map_async(_run_file, [(workflowfile, inputfile, force, lookups, issns, venuepolicy, choices) for inputfile in inputs], chunksize=1).get(365*24*3600)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    venuemap.merge(dict(issns.items()))
+    venuemap.save()
+
+    if reportfile is None:
+        reportfile = os.path.join(inputdir, "batch-report.tsv")
+    write_report(reportfile, results)
+    logging.info("%d distinct Vivo lookups and %d ISSNs shared by %d files", len(lookups), len(issns), len(inputs))
+    return results
+
+def write_report(reportfile, results):
+    total = dict((column, 0) for column in TOTALS)
+    for result in results:
+        for column in TOTALS:
+            total[column] += result.get(column) or 0
+    total.update(input='total', status="%d ok, %d failed" % (len([r for r in results if r['status'] == 'ok']), len([r for r in results if r['status'] != 'ok'])), output='')
+    with open(reportfile, "wb") as f:
+        f.write("\t".join(REPORT)+"\n")
+        for result in results + [total]:
+            f.write("\t".join(unicode(result.get(column, '')).encode('utf-8') for column in REPORT)+"\n")
+    logging.info("batch report written to %s", reportfile)
+    print "%d files: %s, %d publications in, %d out, %d Vivo lookups, %d ISSNs looked up, %d publications left for venue review.  See %s" % (
+        len(results), total['status'], total['pubs_in'], total['pubs_out'], total['lookups'], total['issns'], total['review'], reportfile)
+
+
+def main():
+
+    logging.basicConfig(format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s', filename='../../logs/batch.log', filemode='w', level=logging.INFO)
+
+    workflowfile='./workflow.json'
+    inputdir=None
+    pattern="*vivo-additions.rdf.xml"
+    processes=None
+    force=False
+    venuemapfile=None
+    venuepolicy='queue'
+    venuechoicefile=None
+    reportfile=None
+
+    try:
+        (options, arguments) = getopt.getopt(sys.argv[1:],'w:d:g:j:v:P:m:o:f')
+    except getopt.GetoptError as err:
+        print str(err)
+        print "\n\nThere was an error in your options.\n\nusage: batch.py -w <workflowfile> -d <inputdir> -g <pattern> -j <processes> -v <venuemapfile> -P {\"most\"|\"queue\"} -m <venuechoicefile> -o <reportfile> -f\n\n\t-> runs <workflowfile> (default ./workflow.json) on every file in <inputdir> matching <pattern> (default *vivo-additions.rdf.xml), on <processes> processes (default: one per core).\n\t-> -v, -P and -m are as for deduper.py; the venue policy defaults to queue.\n\t-> the summary is written to <reportfile>, by default batch-report.tsv in <inputdir>.\n\t-> use the -f option to run every stage even if its output is cached.\n\n"
+        sys.exit(2)
+    for (opt, arg) in options:
+        if opt in ("-w"):
+            workflowfile=arg
+        elif opt in ("-d"):
+            inputdir=arg
+        elif opt in ("-g"):
+            pattern=arg
+        elif opt in ("-j"):
+            processes=int(arg)
+        elif opt in ("-v"):
+            venuemapfile=arg
+        elif opt in ("-P"):
+            venuepolicy=arg
+        elif opt in ("-m"):
+            venuechoicefile=arg
+        elif opt in ("-o"):
+            reportfile=arg
+        elif opt in ("-f"):
+            force=True
+    if inputdir is None:
+        print "\n\nyou must specify a directory of input files with the -d option.\n\n"
+        sys.exit(2)
+
+    run_batch(workflowfile, inputdir, pattern, processes, force, venuemapfile, venuepolicy, venuechoicefile, reportfile)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+import json
+import logging
+from vivodata import DataSource
+
+
+#A ChangePlan is the list of graph changes a Deduper stage decided on, kept apart from the graph until the stage has made
+#all its decisions.  It can be dumped as JSON, reviewed (and edited) by a person, loaded again and applied.
+#Each change is a dict with an "op", the "pub" it concerns, the "stage" (Deduper method) that planned it, and the uris below:
+#    remove_publication    pub                       the pub, its authorships and collaborations (see DataSource.removePublication())
+#    remove_authorship     authorship [, author]     the authorship; author, if given, is unlinked first and kept
+#    remove_collaboration  collaboration [, collaborator]
+#    remove_author         authorship, author        unlink author from the authorship, and remove author if nothing else refers to it
+#    remove_collaborator   collaboration, collaborator
+#    change_venue          venue, new_venue          link the pub to new_venue instead of venue
+#apply() removes runs of publications, authorships or collaborations in bulk; apply_change() makes one change with the
+#DataSource methods the dedupe stages have always used.
+
+class ChangePlanException(Exception):
+    def __init__(self, message):
+        logging.error(message)
+
+
+class ChangePlan:
+
+    OPS = {
+        'remove_publication': ('pub',),
+        'remove_authorship': ('pub', 'authorship'),
+        'remove_collaboration': ('pub', 'collaboration'),
+        'remove_author': ('pub', 'authorship', 'author'),
+        'remove_collaborator': ('pub', 'collaboration', 'collaborator'),
+        'change_venue': ('pub', 'venue', 'new_venue'),
+    }
+
+    def __init__(self, changes=None):
+        self.changes = []
+        self._seen = set()
+        for change in changes or []:
+            self.add(change)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    #add a change, unless the same change is already planned
+    def add(self, change):
+        ChangePlan._check(change)
+        change = dict((field, unicode(value)) for (field, value) in change.items())
+        key = tuple(sorted((field, value) for (field, value) in change.items() if field != 'stage'))
+        if key in self._seen:
+            return
+        self._seen.add(key)
+        self.changes.append(change)
+
+    def extend(self, plan):
+        for change in plan:
+            self.add(change)
+
+    def clear(self):
+        self.changes = []
+        self._seen = set()
+
+    @staticmethod
+    def _check(change):
+        fields = ChangePlan.OPS.get(change.get('op'))
+        if fields is None:
+            raise ChangePlanException("unknown change "+json.dumps(change))
+        for field in fields:
+            if not change.get(field):
+                raise ChangePlanException("change "+json.dumps(change)+" has no "+field)
+
+    #the number of changes per op and stage, for a quick look at a plan
+    def summary(self):
+        counts = {}
+        for change in self.changes:
+            key = (change.get('stage', ''), change['op'])
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def dump(self, filename):
+        with open(filename, "wb") as planfile:
+            json.dump(self.changes, planfile, indent=1, sort_keys=True)
+        logging.info("%d changes written to %s", len(self.changes), filename)
+
+    @staticmethod
+    def load(filename):
+        try:
+            with open(filename, "rb") as planfile:
+                return ChangePlan(json.load(planfile))
+        except (IOError, ValueError) as e:
+            raise ChangePlanException("there was a problem reading "+filename+" as a change plan: "+str(e))
+
+    @staticmethod
+    def apply_change(datasource, change):
+        ref = DataSource.uri_literal_as_ref
+        op = change['op']
+        if op == 'remove_publication':
+            datasource.removePublication(ref(change['pub']))
+        elif op == 'remove_authorship':
+            if change.get('author'):
+                datasource.removeAuthorFromAuthorship(ref(change['authorship']), ref(change['author']))
+            datasource.removeAuthorship(ref(change['authorship']))
+        elif op == 'remove_collaboration':
+            if change.get('collaborator'):
+                datasource.removeCollaboratorFromCollaboration(ref(change['collaboration']), ref(change['collaborator']))
+            datasource.removeCollaboration(ref(change['collaboration']))
+        elif op == 'remove_author':
+            datasource.removeAuthorFromAuthorship(ref(change['authorship']), ref(change['author']))
+            datasource.removeAuthor(ref(change['author']))
+        elif op == 'remove_collaborator':
+            datasource.removeCollaboratorFromCollaboration(ref(change['collaboration']), ref(change['collaborator']))
+            datasource.removeCollaborator(ref(change['collaborator']))
+        elif op == 'change_venue':
+            datasource.changePublicationVenue(ref(change['pub']), ref(change['venue']), ref(change['new_venue']))
+
+    #apply the changes in order, each run of changes with the same op at once
+    def apply(self, datasource):
+        run = []
+        for change in self.changes:
+            if run and change['op'] != run[0]['op']:
+                ChangePlan._apply_run(datasource, run)
+                run = []
+            run.append(change)
+        if run:
+            ChangePlan._apply_run(datasource, run)
+        logging.info("applied %d changes", len(self.changes))
+
+    @staticmethod
+    def _apply_run(datasource, run):
+        ref = DataSource.uri_literal_as_ref
+        op = run[0]['op']
+        if op == 'remove_publication':
+            datasource.remove_publications([ref(change['pub']) for change in run])
+        elif op == 'remove_authorship':
+            for change in run:
+                if change.get('author'):
+                    datasource.removeAuthorFromAuthorship(ref(change['authorship']), ref(change['author']))
+            datasource.remove_authorships([ref(change['authorship']) for change in run])
+        elif op == 'remove_collaboration':
+            for change in run:
+                if change.get('collaborator'):
+                    datasource.removeCollaboratorFromCollaboration(ref(change['collaboration']), ref(change['collaborator']))
+            datasource.remove_collaborations([ref(change['collaboration']) for change in run])
+        else:
+            for change in run:
+                ChangePlan.apply_change(datasource, change)
@@ -9,6 +9,7 @@ import sys
 from vivodata import DataSource
 from vivouri import VivoUri
 from vivoquery import VIVOAuthorName, VIVOAuthorNameQuery, VIVOIndividualPresentQuery
+from tracer import Tracer
 
 class CorefferException(Exception):
     def __init__(self, message):
@@ -23,16 +24,22 @@ class CorefferException(Exception):
 
 class Coreffer:
 
-    def __init__(self, filename, keyidentifier, workflowcode='pn0'):
-        try:
-            self._datasource = DataSource(filename)
-        except:
-            raise CorefferException("error: there was a problem opening "+filename+" as a data source")
+    #as for Deduper, an already loaded datasource can be passed in, and checkpoint=False leaves serializing to the caller
+    def __init__(self, filename, keyidentifier, workflowcode='pn0', datasource=None, checkpoint=True):
+        if datasource is not None:
+            self._datasource = datasource
+        else:
+            try:
+                self._datasource = DataSource(filename)
+            except:
+                raise CorefferException("error: there was a problem opening "+filename+" as a data source")
+        self._checkpointing = checkpoint
         self._inputfilename = filename
         self._blackfilename = "./BLACKLIST-coreffer.txt"
         self._outputfilename = VivoUri.createOutputFileName(filename, workflowcode)
         print "output will be written to "+self._outputfilename+"\n"
         self._keyidentifier=keyidentifier
+        self._tracer = Tracer("coreffer")
         #cache each (person) author URI for which a name template is already made. 
         self._cachedPersonURIs={}
         #cache URIs to mentions which are blacklisted
@@ -67,7 +74,7 @@ class Coreffer:
                 
         
     def _isBlacklisted(self, authorUri, nameString):
-        logging.debug("nameString: "+strings.to_lower(nameString)+" authorUri: "+DataSource.uri_literal_as_ref(authorUri))
+        self._tracer.trace('_isBlacklisted', 'nameString: %s authorUri: %s', nameString, authorUri)
         if DataSource.uri_literal_as_ref(authorUri) in self._blacklist:
             if strings.to_lower(nameString) in self._blacklist[DataSource.uri_literal_as_ref(authorUri)]:
                 return True
@@ -191,18 +198,18 @@ class Coreffer:
                     nameTemplate = Coreffer.makeNameTemplateFromDataSource(parts)
                     self._cachedPersonURIs[authUri]=nameTemplate
                 else:
-                    logging.debug("retrieving cached name for author "+authUri)
+                    self._tracer.trace('applyRule.cached', 'retrieving cached name for author %s', authUri)
                     #print "retrieving cached name for author "+authUri
                     nameTemplate = self._cachedPersonURIs[authUri]
                 
                 nameString=Coreffer.getNameTemplateAsString(nameTemplate)
                 
                 if (nameTemplate is None) or (len(nameTemplate)!=3) or (nameString==""):
-                    logging.debug("couldn't include name for author: "+authUri)
+                    logging.debug("couldn't include name for author: %s", authUri)
                     logging.debug("an associative array of three name parts must be stored in nameTemplate")
                     continue
                 
-                logging.debug("found authorship name mention: "+nameString)                
+                self._tracer.trace('applyRule', 'found authorship name mention: %s', nameString)
                  
                 if (ruleName=="SameLastSameFirstInit"):
                     keyvalue=Coreffer.ruleSameLastSameFirstInit(nameTemplate['lname'],nameTemplate['fname'],nameTemplate['mname'])
@@ -254,6 +261,9 @@ class Coreffer:
     
     
     def updatePersonURIs(self, UrisToMentions, uniqueUri):
+        #the authorships and collaborations of the whole cluster are relinked in one batch
+        authorshipChanges = []
+        collaborationChanges = []
         for person in UrisToMentions:
             if len(UrisToMentions[person].keys())!=1:
                 raise CorefferException("error: person uri "+person+" should have a unique name mention associated with it.  Found instead: "+str(UrisToMentions[person].keys()))
@@ -278,10 +288,34 @@ class Coreffer:
                 authNameString = authNameString + " " + nameTemplate['mname']
                 collNameString = collNameString + " " + nameTemplate['mname']
             for authorship in authorships:
-                self._datasource.changeAuthorship(DataSource.uri_literal_as_ref(authorship),DataSource.uri_literal_as_ref(uniqueUri), DataSource.string_as_literal(authNameString))
+                authorshipChanges.append((DataSource.uri_literal_as_ref(authorship), DataSource.uri_literal_as_ref(uniqueUri), DataSource.string_as_literal(authNameString)))
             for collaboration in collaborations:
-                self._datasource.changeCollaboration(DataSource.uri_literal_as_ref(collaboration),DataSource.uri_literal_as_ref(uniqueUri), DataSource.string_as_literal(collNameString))
-        self._datasource.serialize(self._outputfilename)    
+                collaborationChanges.append((DataSource.uri_literal_as_ref(collaboration), DataSource.uri_literal_as_ref(uniqueUri), DataSource.string_as_literal(collNameString)))
+        self._datasource.change_authorships(authorshipChanges)
+        self._datasource.change_collaborations(collaborationChanges)
+        self._checkpoint()
+
+    def _checkpoint(self):
+        if self._checkpointing:
+            self._datasource.serialize(self._outputfilename)
+        self._datasource.log_query_stats(reset=True)
+        self._tracer.report(reset=True)
+        self._datasource._tracer.report(reset=True)
+
+    #collide persons by ruleName, and merge each collision onto the URI picked by strategy (see mapMentionsToUniqueURI())
+    def corefer(self, ruleName="SameLastSameFirstInit", strategy="pickLongestMention"):
+        collisions = self.collidePersons(ruleName)
+        for item in collisions:
+            logging.info("collided person name mentions on this key: %s", item)
+            for uri in collisions[item]:
+                logging.info("uri: %s", uri)
+                logging.info(str(collisions[item][uri]))
+            uniqueUri = Coreffer.mapMentionsToUniqueURI(collisions[item], keyval=item, strategy=strategy)
+            logging.info("uniqueUri: %s", uniqueUri)
+            logging.info("")
+            self.updatePersonURIs(collisions[item], uniqueUri)
+        logging.info("-"*65)
+        return collisions
     
     
 
@@ -307,7 +341,7 @@ class Coreffer:
                     raise CorefferException("error: uri "+uri+" should have a unique name mention associated with it.  Found instead: "+str(UrisToMentions[uri].keys()))
                 #return the (unique) nameString mention for that candidate uri   
                 mention=Coreffer.normalize(UrisToMentions[uri].keys()[0])
-                logging.debug("mapMentionsToUniqueURI(): comparing mention "+str(mention)+ " to keyval "+keyval)
+                logging.debug("mapMentionsToUniqueURI(): comparing mention %s to keyval %s", mention, keyval)
                 if mention==keyval:
                     foundKeyVal=True
                     uriToReturn = uri
@@ -354,18 +388,7 @@ def main():
         else:
             n = Coreffer(inputfile, keyidentifier, 'pn0')
             outfile = n._outputfilename
-            collisions = n.collidePersons()
-            for item in collisions:
-                logging.info("collided person name mentions on this key: "+unicode(item))
-                for uri in collisions[item]:
-                    logging.info("uri: "),
-                    logging.info(uri)
-                    logging.info(str(collisions[item][uri]))
-                uniqueUri = Coreffer.mapMentionsToUniqueURI(collisions[item],keyval=item, strategy="pickLongestMention")
-                logging.info("uniqueUri: "+str(uniqueUri))   
-                logging.info("")
-                n.updatePersonURIs(collisions[item], uniqueUri)
-            logging.info("-"*65)
+            n.corefer("SameLastSameFirstInit", "pickLongestMention")
             
             # collisions = n.collidePersons("ForLastNameChange")
             # for item in collisions:
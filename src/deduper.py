@@ -2,12 +2,22 @@
 
 import getopt
 import logging
+import multiprocessing
+import os
 import sys
+import traceback
 from vivodata import DataSource
 from vivouri import VivoUri
-from vivoquery import VIVOIndividualPresentQuery, VIVOIssnQuery, VIVOPMIDPresentQuery, VIVODOIPresentQuery
+from vivoquery import VIVOIndividualPresentQuery, VIVOPMIDPresentQuery, VIVODOIPresentQuery, VIVOQueryException
 import string
+import numpy
 from testme import TestMe
+from tracer import Tracer
+from checkpoint import Checkpoint
+from venuemap import VenueMap
+from changeplan import ChangePlan
+from columntable import ColumnTable
+from extsort import ExternalSorter
 
 
 #Deduper.py removes duplicate uris from a DataSource; 
@@ -50,16 +60,123 @@ class Deduper:
 
 
         
-    def __init__(self, filename, keyidentifier, workflowcode='pd0'):
-        try:
-            self._datasource = DataSource(filename)
-        except Exception as e:
-            raise DeduperException("there was a problem opening "+filename+" as a datasource")
+    #filename names the input (and, prefixed with workflowcode, the output).  An already loaded datasource can be passed in
+    #instead of parsing filename again.  With checkpoint=False, the dedupe methods don't write their output file: the caller
+    #serializes the datasource when it's done (see run_pipeline()).
+    #resume is a Checkpoint that remembers Vivo lookups and decisions across runs; by default they are only cached in memory.
+    #Each dedupe method collects its changes in a ChangePlan and applies them all at the end of the stage.  Given a plan
+    #(plan-then-apply mode, see plan_pipeline()), Vivo lookups are also resolved in batches before the decisions are made,
+    #and every stage's changes are added to the plan, so that they can be reviewed before they are applied to the input.
+    #venuemap is the VenueMap of ISSN -> Vivo venues used by dedupeVenuesPerPub(); by default it is only kept in memory.
+    #venuepolicy says how dedupeVenuesPerPub() picks among several venues already in Vivo (see _pickVivoVenue()), after the
+    #venuechoices (a dict read by VenueMap.read_choices()); pubs it can't decide are written to reviewfile.
+    VENUE_POLICIES = ('prompt', 'most', 'queue')
+
+    def __init__(self, filename, keyidentifier, workflowcode='pd0', datasource=None, checkpoint=True, resume=None, plan=None, venuemap=None,
+            venuepolicy='prompt', venuechoices=None, reviewfile=None):
+        if venuepolicy not in Deduper.VENUE_POLICIES:
+            raise DeduperException("unknown venue policy "+str(venuepolicy)+", use one of "+", ".join(Deduper.VENUE_POLICIES))
+        if datasource is not None:
+            self._datasource = datasource
+        else:
+            try:
+                self._datasource = DataSource(filename)
+            except Exception as e:
+                raise DeduperException("there was a problem opening "+filename+" as a datasource")
         self._outputfilename = VivoUri.createOutputFileName(filename, workflowcode)
         self._keyidentifier=keyidentifier
+        self._checkpointing = checkpoint
+        self._resume = resume if resume is not None else Checkpoint()
+        self._venuemap = venuemap if venuemap is not None else VenueMap()
+        self._venuepolicy = venuepolicy
+        self._venuechoices = venuechoices if venuechoices is not None else {}
+        self._reviewfile = reviewfile
+        self._venuereview = []
+        self._changes = ChangePlan()
+        self._plan = plan
+        self._tracer = Tracer("deduper")
         pubs = self._datasource.getPublicationURIs(self._keyidentifier)
-        Deduper._namespace=VivoUri.extractNamespace(pubs[0])
+        if pubs:
+            Deduper._namespace=VivoUri.extractNamespace(pubs[0])
         logging.info("output will be written to "+self._outputfilename+"\n")
+
+    #the deduper workflow, in order: the stage's workflow code, what it does, and the methods (with arguments) it calls.
+    #Deduplication order is important!  There was a case with a co-collaborator who had both
+    #duplicate collaborations and duplicate collaborators per collaboration.
+    #removeCollaborationIfExistingAuthorship() would throw a exception because the collaboration was not unique for that person/pub pair.
+    #Deduping collaborators per collaboration *before* deduping collaborations removed the error.
+    STAGES = [
+        ('pd0', "Dedupe Publications per Authorship",
+            [('dedupePubsPerAuthorship', ())]),
+        ('pd1', "Dedupe Authors per Authorship (and deal with Collaborators in parallel)",
+            [('dedupeAuthorsPerAuthorship', ()), ('removeAllOtherCollaborations', ("http://vivo.health.unm.edu/individual/n0",)), ('dedupeCollaboratorsPerCollaboration', ())]),
+        ('pd2', "Dedupe Authorships (and Collaborations)",
+            [('dedupeAuthorships', ()), ('dedupeCollaborations', ())]),
+        ('pd3', "Dedupe Venues per Publication",
+            [('dedupeVenuesPerPub', ())]),
+        ('pd4', "Remove Collaboration if there is an Authorship",
+            [('removeCollaborationIfExistingAuthorship', ())]),
+        #removes a Publication (and its Authorships) from the additions file if they are already in Vivo
+        #but weren't the time the additions file was created, so there is nothing to dedupe.
+        ('pd5', "Remove Publication and Authorships if they got added to Vivo after vivo-additions.rdf.xml got created.",
+            [('removePubFoundInVivo', ())]),
+    ]
+
+    #the dedupe methods call this at the end of a stage: the stage's changes are applied, and its output is written
+    def _checkpoint(self):
+        if len(self._changes):
+            self._changes.apply(self._datasource)
+            if self._plan is not None:
+                self._plan.extend(self._changes)
+            self._changes.clear()
+        if self._checkpointing:
+            self._datasource.serialize(self._outputfilename)
+        self._resume.save()
+        self._datasource.log_query_stats(reset=True)
+        self._tracer.report(reset=True)
+        self._datasource._tracer.report(reset=True)
+
+    #plan a change to the graph (see changeplan.py), made when the stage calls _checkpoint()
+    def _change(self, stage, op, **uris):
+        uris['op'] = op
+        uris['stage'] = stage
+        self._changes.add(uris)
+
+    #the Vivo query for the keyidentifier of publications
+    def _uidQuery(self):
+        if self._keyidentifier=="bibo:doi":
+            return VIVODOIPresentQuery
+        return VIVOPMIDPresentQuery
+
+    #in plan-then-apply mode, look values up in Vivo in batches, before the stage asks _isPresent() about them one by one
+    def _prefetch(self, query, values):
+        if self._plan is None:
+            return
+        try:
+            self._resume.prefetch(query, values)
+        except VIVOQueryException as e:
+            self._resume.save()
+            logging.error("batched %s failed: %s", query.__name__, e)
+            raise
+
+    #every Vivo lookup goes through the checkpoint, so it is asked only once, even across runs.
+    #If Vivo can't be reached, what we've learned so far is saved before giving up.
+    def _isPresent(self, query, value):
+        try:
+            return self._resume.lookup(query, value)
+        except VIVOQueryException as e:
+            self._resume.save()
+            if self._resume.filename is not None:
+                logging.error("%s failed on %s: %s.  Lookups and decisions so far are saved in %s, run again with it to resume.", query.__name__, value, e, self._resume.filename)
+            raise
+
+    #move on to the next stage of the workflow, on the same datasource: output is now named after the previous output
+    def next_stage(self, workflowcode):
+        self._outputfilename = VivoUri.createOutputFileName(self._outputfilename, workflowcode)
+
+    def run_stage(self, calls):
+        for method, args in calls:
+            getattr(self, method)(*args)
     
 
     
@@ -70,70 +187,50 @@ class Deduper:
     
         pubs = self._datasource.getPublicationURIs(self._keyidentifier)
     
-        #theData lets us dedupe the authorships against author-pub pairs, but it uses string uris rather than the graph nodes managed by rdflib.  That is, you must then use DataSource.uri_literal_as_ref(string) to add, change or remove a uri from the graph...
-        theData={}
-    
-        for pub in pubs: 
-            
-        
-            #get distinct authorships.  We can now either check for non-unique linkedInformationResource, or non-unique linkedAuthor, or (for this function) a redundant authorship connecting author and pub. 
-            authorships = self._datasource.getPublicationAuthorshipURIs(pub)
-
-           
-            for authorship in authorships:
-            
-                author = self._datasource.getAuthorURIFromAuthorship(authorship)
-                keyvalue = Deduper._mux_UriPair(author,pub)
-                
-                if keyvalue not in theData:
-                    theData[keyvalue] = []
-                
-                
-                theData[keyvalue].append(authorship)
-                logging.debug("dedupeAuthorships(): " + keyvalue + " has "+str(len(theData[keyvalue]))+" members")
+        #theData groups the authorships by (author, pub) pair, in one scan of the authorship links
+        theData, authors = self._datasource.group_authorships(pubs)
+        for (author, pub) in theData:
+            if author == '':
+                raise DeduperException("SEVERE, Empty URI: authorship(s) "+", ".join(theData[(author, pub)])+" of pub "+pub+" have no author")
+        self._tracer.count('dedupeAuthorships.groups', len(theData))
 
         exclusion_list = {}
+        duplicates = [(pair, theData[pair]) for pair in theData if len(theData[pair])>1]
+        self._prefetch(VIVOIndividualPresentQuery, [ship for (pair, authorships) in duplicates for ship in authorships])
         
-        for keyvalue in theData:        
-        
-            if len(theData[keyvalue])>1:
+        for (pair, authorships) in duplicates:
             
-                authorships = theData[keyvalue]
-                
-                for ship in authorships:
-                
-                    if not VIVOIndividualPresentQuery.isPresent(ship):
-                        parts = Deduper._demux_UriPair(keyvalue)
-                        logging.debug("duplicate authorship "+ship+" not found in vivo, will delete. will not delete the author uri.")
-                        exclusion_list[ship] = VivoUri.encodeNasUri(Deduper._namespace, parts[0]) 
-                 
-                    else:
-                        logging.debug("duplicate authorship "+ship+" was found in vivo.  I won't exclude this uri from the input model.")
+            for ship in authorships:
+            
+                if not self._isPresent(VIVOIndividualPresentQuery, ship):
+                    logging.debug("duplicate authorship %s not found in vivo, will delete. will not delete the author uri, unless it has no other authorship.", ship)
+                    exclusion_list[ship] = pair
+             
+                else:
+                    logging.debug("duplicate authorship %s was found in vivo.  I won't exclude this uri from the input model.", ship)
         
         
+        #the author isn't unlinked first, so that removing the authorship also removes an author left with no other authorship
         for ship in exclusion_list:
-            self._datasource.removeAuthorFromAuthorship(DataSource.uri_literal_as_ref(ship), DataSource.uri_literal_as_ref(exclusion_list[ship]))
-            self._datasource.removeAuthorship(DataSource.uri_literal_as_ref(ship))
+            (author, pub) = exclusion_list[ship]
+            self._change('dedupeAuthorships', 'remove_authorship', pub=pub, authorship=ship)
            
         
         
-        self._datasource.serialize(self._outputfilename)
+        self._checkpoint()
     
 
-    #The * notation implies that a list (or dictionary) passed in will be treated as a tuple (pg. 103 Harms/McDonald, _Quick Python_),
-    #but we're not using it, so the list (or dictionary) will be treated like what it is... 
-    def findMinimumRankUri(self, field, collaborationUriStrings):
-        minimumRank = 1000000
-        resultUriString=""
-        if len(collaborationUriStrings)==0:
-            return resultUriString
-        for uriString in list(collaborationUriStrings):
-            if (self._datasource.getRank(uriString, field) < minimumRank):
-                #note how field is the second parameter in this function call (it is optional)
-                minimumRank = self._datasource.getRank(uriString,field)
-                resultUriString = uriString
-        logging.debug(resultUriString+" has coll rank "+str(minimumRank))        
-        return resultUriString
+    #the minimum rank uri of every group in groups (a list of non-empty lists of authorship or collaboration uris), in group order.
+    #The ranks (field is collaboratorRank or authorRank) are read and made ints once, and all groups are decided in one argmin.
+    #A missing or non-numeric rank loses to any number; ties go to the uri listed first.
+    def findMinimumRankUris(self, field, groups):
+        ranks = self._datasource.ranks(field)
+        uris = [uri for group in groups for uri in group]
+        group_ids = numpy.repeat(numpy.arange(len(groups)), [len(group) for group in groups])
+        values = numpy.array([ColumnTable.MISSING_INT if ranks.get(uri) is None else ranks[uri] for uri in uris], dtype=numpy.int64)
+        keepers = [uris[row] for row in ColumnTable.argmin_by_group(group_ids, values)]
+        self._tracer.count('findMinimumRankUris.groups', len(keepers))
+        return keepers
     
     
     
@@ -142,162 +239,97 @@ class Deduper:
    
         pubs = self._datasource.getPublicationURIs(self._keyidentifier)
     
-        #TODO: Explain what the following means or come up with something that doesn't need explanation -- the dictionary (theData) dedupes the collaborations against collaborator-pub pairs, but it uses string uris rather than the graph nodes managed by rdflib.  That is, you must then use DataSource.uri_literal_as_ref(string) to add, change or remove a uri from the graph...
-        theData={}
-    
-        for pub in pubs: 
-       
-            #get distinct collaborations.  We can now check for a redundant collaboration connecting collaborator and pub. 
-            collaborations = self._datasource.getPublicationCollaborationURIs(pub)
-            logging.debug("dedupeCollaborations(): pub "+pub+" has "+str(len(collaborations))
-            +" collaborations")
-           
-            for collaboration in collaborations:
-                if len(self._datasource.getAllCollaboratorURIFromCollaboration(collaboration)) > 1:
+        #theData groups the collaborations by (collaborator, pub) pair, in one scan of the collaboration links
+        theData, collaborators = self._datasource.group_collaborations(pubs)
+        for (collaborator, pub) in theData:
+            for collaboration in theData[(collaborator, pub)]:
+                if len(collaborators.get(collaboration, [])) > 1:
                     logging.error("dedupeCollaborations():  found more than one collaborator for collaboration "+collaboration+".  It's a good idea to run dedupeCollaboratorsPerCollaboration() first.")
                     raise DeduperException("dedupeCollaborations():  found more than one collaborator for collaboration "+collaboration+".  It's a good idea to run dedupeCollaboratorsPerCollaboration() first.")
-                elif len(self._datasource.getAllCollaboratorURIFromCollaboration(collaboration)) == 0:
+                elif collaborator == '':
                     raise DeduperException("dedupecollaborations(): found no collaborator for collaboration "+collaboration)
-                collaborator = self._datasource.getCollaboratorURIFromCollaboration(collaboration)    
-                keyvalue = Deduper._mux_UriPair(collaborator,pub)
-                
-                if keyvalue not in theData:
-                    theData[keyvalue] = []
-                
-                theData[keyvalue].append(collaboration)
-                logging.debug("dedupeCollaborations(): "+keyvalue + " has "+str(len(theData[keyvalue]))+" members: ")
-                for member in theData[keyvalue]:
-                    logging.debug("\t"+member)
+        self._tracer.count('dedupeCollaborations.groups', len(theData))
 
         exclude_by_uri = {}
         foundInVivo={}
+        duplicates = [(pair, theData[pair]) for pair in theData if len(theData[pair])>1]
+        self._prefetch(VIVOIndividualPresentQuery, [tion for (pair, collaborations) in duplicates for tion in collaborations])
         
-        for keyvalue in theData:        
-        
-            if len(theData[keyvalue])>1:
+        for (pair, collaborations) in duplicates:
             
-                collaborations = theData[keyvalue]
-                
-                for tion in collaborations:
-                
-                    if not VIVOIndividualPresentQuery.isPresent(tion):
-
-                        parts = Deduper._demux_UriPair(keyvalue) 
-                        logging.debug("This duplicate "+tion+" collaboration wasn't found in vivo. Will delete all collaborations except for the highest-ranked one, but will not delete the collaborator uri.")
-                        #(Keyed on the collaboration URI, the first part is the collaborator URI
-                        #and the second part is the pub URI -- currently not used.)
-                        if tion not in exclude_by_uri:
-                            exclude_by_uri[tion]=[]
-                        exclude_by_uri[tion].append(VivoUri.encodeNasUri(Deduper._namespace, parts[0]))
-                        exclude_by_uri[tion].append(VivoUri.encodeNasUri(Deduper._namespace, parts[1]))
-                        
-                    else:
-                        logging.debug("This duplicate "+tion+" collaboration was found in vivo. Will remove any other collaborations.")
-                        foundInVivo[keyvalue]=1
+            for tion in collaborations:
+            
+                if not self._isPresent(VIVOIndividualPresentQuery, tion):
+
+                    logging.debug("This duplicate %s collaboration wasn't found in vivo. Will delete all collaborations except for the highest-ranked one, but will not delete the collaborator uri.", tion)
+                    #(Keyed on the collaboration URI, the (collaborator, pub) pair.)
+                    exclude_by_uri[tion] = pair
+                    
+                else:
+                    logging.debug("This duplicate %s collaboration was found in vivo. Will remove any other collaborations.", tion)
+                    foundInVivo[pair]=1
         
         #The logic from this point is different from redundantAuthorships().  It's because we expect duplicate collaborations from bad PubMed source, not only because a collaboration is already in Vivo (although it may be!)
        
-        for keyvalue in theData:        
-        
-            if len(theData[keyvalue])>1:
-            
-                collaborations = theData[keyvalue]
+        ranked = []
+        for (pair, collaborations) in duplicates:
+                                
+            if (pair in foundInVivo):
                                     
-                if (keyvalue in foundInVivo):
-                                        
-                    for tion in exclude_by_uri:
-                        self._datasource.removeCollaboratorFromCollaboration(DataSource.uri_literal_as_ref(tion), DataSource.uri_literal_as_ref(exclude_by_uri[tion][0]))
-                        self._datasource.removeCollaboration(DataSource.uri_literal_as_ref(tion))
-                    
+                for tion in [collab for collab in collaborations if collab in exclude_by_uri]:
+                    (collaborator, pub) = exclude_by_uri[tion]
+                    self._change('dedupeCollaborations', 'remove_collaboration', pub=pub, collaboration=tion, collaborator=collaborator)
+                
+            else:
+                #get the excluded collaboration URIs into a list form so I can iterate over them
+                newCollabs = [collab for collab in collaborations if collab in exclude_by_uri]
+                if newCollabs:
+                    ranked.append(newCollabs)
+        
+        #keep the minimum rank collaboration of each group, all groups at once
+        for (newCollabs, minRankCollab) in zip(ranked, self.findMinimumRankUris('collaboratorRank', ranked)):
+            for collab in newCollabs:
+                self._tracer.trace('dedupeCollaborations.rank', 'comparing minimum rank collaboration: %s to %s', minRankCollab, collab)
+                if (collab==minRankCollab):
+                    logging.debug("***found minimum rank collaboration!")
+                    continue
                 else:
-                    #get the excluded collaboration URIs into a list form so I can iterate over them
-                    newCollabs = []
-                    for collab in collaborations:
-                        if collab in exclude_by_uri:
-                            newCollabs.append(collab)
-                    
-                    
-                    minRankCollab = self.findMinimumRankUri('collaboratorRank', newCollabs) 
-        
-                    for collab in newCollabs:
-                        logging.debug("comparing minimum rank collaboration: "+minRankCollab+" to "+collab)
-                        if (collab==minRankCollab):
-                            logging.debug("***found minimum rank collaboration!")
-                            continue
-                        else:
-                            self._datasource.removeCollaboratorFromCollaboration(DataSource.uri_literal_as_ref(collab), DataSource.uri_literal_as_ref(exclude_by_uri[collab][0]))
-                            self._datasource.removeCollaboration(DataSource.uri_literal_as_ref(collab))
+                    (collaborator, pub) = exclude_by_uri[collab]
+                    self._change('dedupeCollaborations', 'remove_collaboration', pub=pub, collaboration=collab, collaborator=collaborator)
        
-        self._datasource.serialize(self._outputfilename)
+        self._checkpoint()
     
     
-    #removes a collaboration if a person and publication are already linked by an authorship.  It uses strings rather than uri's, therefore you must use DataSource.uri_literal_as_ref(string) to add, change or remove a uri from the graph.
+    #removes a collaboration if a person and publication are already linked by an authorship.
+    #The (person, pub) pairs of the collaborations are joined against those of the authorships (one scan of each kind of link, see
+    #DataSource.group_authorships()), and the collaborations in the intersection are removed together.
     #5/7/2014:  Won't do coreference if an author and collaborator have separate URIs, but whose names match
     def removeCollaborationIfExistingAuthorship(self):
         pubs = self._datasource.getPublicationURIs(self._keyidentifier)
 
-        theAuthorships={}
-        theCollaborations={}
-        exclusion_list = {}
-    
-        for pub in pubs: 
-
-            #get distinct collaborations.  In general, we do this to check for non-unique linkedInformationResource, or non-unique linkedCollaborator, or (in this particular function) a redundant collaboration connecting collaborator and pub. 
-            collaborations = self._datasource.getPublicationCollaborationURIs(pub)
-            authorships = self._datasource.getPublicationAuthorshipURIs(pub)
-            logging.debug("removeCollaborationIfExistingAuthorship(): pub "+VivoUri.extractNfromUri(pub)+" has "+str(len(collaborations))
-            +" collaborations")
-           
-            for collaboration in collaborations:
-                collaborator = self._datasource.getCollaboratorURIFromCollaboration(collaboration)
-                keyvalue = Deduper._mux_UriPair(collaborator,pub)
-            
-                if keyvalue not in theCollaborations:
-                    theCollaborations[keyvalue] = []
-                else:
-                    logging.error("removeCollaborationIfExistingAuthorship() on key-value "+keyvalue+": please call the dedupeCollaborations() method first so there's exactly one collaboration for the person/pub pair")
-                    raise Exception("removeCollaborationIfExistingAuthorship(): please call the dedupeCollaborations() method first so there's exactly one collaboration for the person/pub pair")                
-                theCollaborations[keyvalue].append(collaboration)
-                logging.debug("removeCollaborationIfExistingAuthorship(): " + keyvalue + " has "+str(len(theCollaborations[keyvalue]))+" members: ")
-                for member in theCollaborations[keyvalue]:
-                    logging.debug("\t"+VivoUri.extractNfromUri(member))
-            
-            for authorship in authorships:
-                author = self._datasource.getAuthorURIFromAuthorship(authorship)
-                keyvalue =  Deduper._mux_UriPair(author,pub)
-                
-                if keyvalue not in theAuthorships:
-                    theAuthorships[keyvalue] = []
-                theAuthorships[keyvalue].append(authorship)
-            
-                
-        for keyvalue in theCollaborations:        
-            if len(theCollaborations[keyvalue])!=1:
-                logging.error("removeCollaborationIfExistingAuthorship() on key-value "+keyvalue+": please call the dedupeCollaborations() method first so there's exactly one collaboration for the person/pub pair")
+        theAuthorships, authors = self._datasource.group_authorships(pubs)
+        theCollaborations, collaborators = self._datasource.group_collaborations(pubs)
+        
+        for (collaborator, pub) in theCollaborations:
+            if collaborator == '':
+                raise DeduperException("SEVERE, Empty URI: collaboration(s) "+", ".join(theCollaborations[(collaborator, pub)])+" of pub "+pub+" have no collaborator")
+            if len(theCollaborations[(collaborator, pub)])!=1:
+                logging.error("removeCollaborationIfExistingAuthorship() on person/pub pair "+collaborator+", "+pub+": please call the dedupeCollaborations() method first so there's exactly one collaboration for the person/pub pair")
                 raise Exception("removeCollaborationIfExistingAuthorship(): please call the dedupeCollaborations() method first so there's exactly one collaboration for the person/pub pair")
-            else:
-                tion = theCollaborations[keyvalue][0]
-                if keyvalue in theAuthorships:
-                        parts = Deduper._demux_UriPair(keyvalue)
-                        logging.debug("muxed URI: "+keyvalue )
-                        logging.debug("demux URI, part 1: "+VivoUri.extractNfromUri(parts[0]))
-                        logging.debug("demux URI, part 2: " +VivoUri.extractNfromUri(parts[1]))
-                        logging.debug("a collaboration "+VivoUri.extractNfromUri(tion)+" was found that duplicates the authorship uri for the person pub pair "+keyvalue+".  Keeping authorship uri, removing collaboration uri.")
-                        logging.debug("namespace:"+Deduper._namespace)
-                        exclusion_list[tion] = VivoUri.encodeNasUri(Deduper._namespace, parts[0]) 
-  
+        
         #The logic from this point is different from dedupeAuthorships or dedupeCollaborations, because we expect a person to be duplicated as author and collaborator on a publication in PubMed
-               
-        #for ex in exclusion_list.iterkeys():
-        #    print "exclude: "+ex
+        redundant = set(theCollaborations).intersection(theAuthorships)
+        self._tracer.count('removeCollaborationIfExistingAuthorship.pairs', len(theCollaborations))
+        logging.info("%d of %d collaborations duplicate an authorship for the same person and pub", len(redundant), len(theCollaborations))
        
-        for uri in exclusion_list:
-            self._datasource.removeCollaboratorFromCollaboration(DataSource.uri_literal_as_ref(uri), DataSource.uri_literal_as_ref(exclusion_list[uri]))
-            #why don't we need to remove the pub from the collaboration too??
-            self._datasource.removeCollaboration(DataSource.uri_literal_as_ref(uri))
+        for (collaborator, pub) in redundant:
+            tion = theCollaborations[(collaborator, pub)][0]
+            self._tracer.trace('removeCollaborationIfExistingAuthorship.duplicate', 'a collaboration %s was found that duplicates the authorship for the person pub pair (%s, %s).  Keeping authorship uri, removing collaboration uri.', tion, collaborator, pub)
+            #removeCollaboration() takes the pub out of the collaboration too
+            self._change('removeCollaborationIfExistingAuthorship', 'remove_collaboration', pub=pub, collaboration=tion, collaborator=collaborator)
        
         
-        self._datasource.serialize(self._outputfilename)    
+        self._checkpoint()    
  
         
        
@@ -307,42 +339,40 @@ class Deduper:
     def dedupeAuthorsPerAuthorship(self):
         pubUris = self._datasource.getPublicationURIs(self._keyidentifier) 
         
-        keepUri=""
-        exclusion_list=[]
-        keeperFound = False
-        
+        #scan: the authorships with more than one linked author
+        multiples = []
         for uri in pubUris:
-            
-            authUris = self._datasource.getPublicationAuthorshipURIs(uri)
-            
-            for auth in authUris:
-            
+            for auth in self._datasource.getPublicationAuthorshipURIs(uri):
                 personUris = self._datasource.getAllAuthorURIFromAuthorship(auth)
-                
                 if len(personUris) > 1:
+                    multiples.append((uri, auth, personUris))
+        self._prefetch(VIVOIndividualPresentQuery, [per for (uri, auth, personUris) in multiples for per in personUris])
+        
+        for (uri, auth, personUris) in multiples:
+            keepUri=""
+            exclusion_list=[]
+            keeperFound = False
+                
+            for per in personUris:
+                
+                if self._isPresent(VIVOIndividualPresentQuery, per):
+                    keeperFound=True
+                else:
+                    exclusion_list.append(per)
+            #if there are multiple linked authors in an authorship, we'd expect exactly one of these to be in Vivo.
+            #if it's not the case, then we arbitrarily pick the first one in the input model...
+            if not keeperFound:
+                keepUri=personUris[0]
+                keeperFound=True
                 
-                    for per in personUris:
-                        
-                        if VIVOIndividualPresentQuery.isPresent(per):
-                            keeperFound=True
-                        else:
-                            exclusion_list.append(per)
-                    #if there are multiple linked authors in an authorship, we'd expect exactly one of these to be in Vivo.
-                    #if it's not the case, then we arbitrarily pick the first one in the input model...
-                    if not keeperFound:
-                        keepUri=personUris[0]
-                        keeperFound=True
-                        
-                    for excluded in exclusion_list:
-                        if keeperFound and keepUri!="" and excluded==keepUri:
-                            continue
-                        else:
-                            #remove authors(s) from authorship
-                            self._datasource.removeAuthorFromAuthorship(DataSource.uri_literal_as_ref(auth), DataSource.uri_literal_as_ref(excluded))
-                            #remove the author
-                            self._datasource.removeAuthor(DataSource.uri_literal_as_ref(excluded))
-        
-        self._datasource.serialize(self._outputfilename)
+            for excluded in exclusion_list:
+                if keeperFound and keepUri!="" and excluded==keepUri:
+                    continue
+                else:
+                    #remove authors(s) from authorship, and the author
+                    self._change('dedupeAuthorsPerAuthorship', 'remove_author', pub=uri, authorship=auth, author=excluded)
+        
+        self._checkpoint()
 
     #Here I'm interested in collaborations with more than 1 collaborator per collaboration,
     #method: get unique collaborations with non-unique linkedCollaborator, and return a unique linkedCollaborator. 
@@ -350,42 +380,40 @@ class Deduper:
         
         pubUris = self._datasource.getPublicationURIs(self._keyidentifier) 
         
-
-        
+        #scan: the collaborations with more than one linked collaborator
+        multiples = []
         for uri in pubUris:
-            
-            collabUris = self._datasource.getPublicationCollaborationURIs(uri)
-            
-            for collab in collabUris:
-                keepUri=""
-                exclusion_list=[]
-                keeperFound = False            
-            
+            for collab in self._datasource.getPublicationCollaborationURIs(uri):
                 personUris = self._datasource.getAllCollaboratorURIFromCollaboration(collab)
-                
                 if len(personUris) > 1:
-                    logging.debug("This collaboration had multiple collaborators: "+collab)
-                    for per in personUris:
-                    #if there are multiple linked collaborators in a collaboration, we'd expect exactly one of these to be in Vivo.  Ordinarily that is the case.                        
-                        if VIVOIndividualPresentQuery.isPresent(per):
-                            keeperFound=True
-                        else:
-                            exclusion_list.append(per)
+                    multiples.append((uri, collab, personUris))
+        self._prefetch(VIVOIndividualPresentQuery, [per for (uri, collab, personUris) in multiples for per in personUris])
+        
+        for (uri, collab, personUris) in multiples:
+            keepUri=""
+            exclusion_list=[]
+            keeperFound = False            
+        
+            logging.debug("This collaboration had multiple collaborators: %s", collab)
+            for per in personUris:
+            #if there are multiple linked collaborators in a collaboration, we'd expect exactly one of these to be in Vivo.  Ordinarily that is the case.                        
+                if self._isPresent(VIVOIndividualPresentQuery, per):
+                    keeperFound=True
+                else:
+                    exclusion_list.append(per)
 
-                    #if it's not the case, then we arbitrarily pick the first one in the input model...
-                    if not keeperFound:
-                        keepUri=personUris[0]
-                        keeperFound=True
-                        
-                    for excluded in exclusion_list:
-                        if keeperFound and keepUri!="" and excluded==keepUri:
-                            logging.debug("will keep collaborator "+keepUri+" for collaboration "+collab)
-                        else:
-                            #remove collaborator(s) from collaboration
-                            self._datasource.removeCollaboratorFromCollaboration(DataSource.uri_literal_as_ref(collab), DataSource.uri_literal_as_ref(excluded))
-                            #remove the collaborator
-                            self._datasource.removeCollaborator(DataSource.uri_literal_as_ref(excluded))
-        self._datasource.serialize(self._outputfilename)
+            #if it's not the case, then we arbitrarily pick the first one in the input model...
+            if not keeperFound:
+                keepUri=personUris[0]
+                keeperFound=True
+                
+            for excluded in exclusion_list:
+                if keeperFound and keepUri!="" and excluded==keepUri:
+                    logging.debug("will keep collaborator %s for collaboration %s", keepUri, collab)
+                else:
+                    #remove collaborator(s) from collaboration, and the collaborator
+                    self._change('dedupeCollaboratorsPerCollaboration', 'remove_collaborator', pub=uri, collaboration=collab, collaborator=excluded)
+        self._checkpoint()
 
         
         
@@ -416,55 +444,14 @@ class Deduper:
             theData[uid].append(uri)
 
                 
+        if self._plan is not None:
+            duplicated = [uid for uid in theData if len(theData[uid])>1 and self._resume.decision('dedupePubsPerAuthorship', uid) is None]
+            self._prefetch(self._uidQuery(), duplicated)
+            self._prefetch(VIVOIndividualPresentQuery, [uri for uid in duplicated if self._isPresent(self._uidQuery(), uid) for uri in theData[uid]])
+                
         for uid in theData:
-
-            keeperFound=False
-            uidFound = False
-            numberOfAuthorships=0
-            keepUri=""
-            runnerUpUri=""
-        
             if len(theData[uid])>1:
-            
-                for uri in theData[uid]:
-                    if self._keyidentifier=="bibo:pmid":
-                        uidFound=VIVOPMIDPresentQuery().isPresent(uid)
-                    elif self._keyidentifier=="bibo:doi":
-                        uidFound=VIVODOIPresentQuery().isPresent(uid)
-                    
-                    if not uidFound:
-                        logging.error("couldn't find publication "+uid+" in Vivo, yet it is duplicated in the Input.  Will pick one in the Input...")
-                        if not keeperFound:
-                            keeper_list.append(uri)
-                            keeperFound=True
-                    else:
-                        #TODO: pick uri with greater authorship count for uid
-                        logging.info("found pub "+uid+" in Vivo, examining individual "+VivoUri.extractNfromUri(uri)+" in the input...")
-                        
-                        results = self._datasource.getPublicationAuthorshipURIs(uri)
-                        collabs = self._datasource.getPublicationCollaborationURIs(uri)
-                        logging.info("pub uri: "+uri+" has "+str(len(results))+" authorships and "+str(len(collabs))+" collaborations...")
-                        
-                        #we always want the pub uri with the greater number of authorships...
-                        if len(results) > numberOfAuthorships:
-                           numberOfAuthorships = len(results)
-                           keepUri = uri
-                        elif len(results) and len(results)==numberOfAuthorships:
-                            runnerUpUri = uri
-                        
-                        
-                
-                if keeperFound==False:
-                    for uri in theData[uid]:
-                        if  keepUri != "" and uri==keepUri:
-                            logging.debug("keepUri: "+keepUri+" has "+str(numberOfAuthorships)+" authorships")
-                            if not VIVOIndividualPresentQuery().isPresent(uri):
-                                if VivoUri.hasHttpPrefix(runnerUpUri) and not VIVOIndividualPresentQuery().isPresent(runnerUpUri):
-                                    raise DeduperException("SEVERE:  pub uri "+uri+" and pub uri "+runnerUpUri+" both had the largest number of authorships for that uid, so we can't pick only one uri for uid "+uid+", but neither was found in Vivo.  Perhaps you should check the data in Vivo to see if it has changed, or re-run Harvester...")
-                                elif VivoUri.hasHttpPrefix(runnerUpUri):
-                                    uri=runnerUpUri
-                            keeper_list.append(uri)
-            
+                keeper_list.extend(self._pickKeepers(uid, theData[uid], self._countAuthorships))
             elif len(theData[uid])==1:
                 #always keep the pub uri if there is no duplication
                 keeper_list.append(theData[uid][0])   
@@ -472,35 +459,116 @@ class Deduper:
         if len(keeper_list)==len(pubUris):
             logging.info("***Keeping all publications found in the input file...")
         else:
+            keepers = set(keeper_list)
             for uri in pubUris:
+
+                if uri in keepers:
+                    self._tracer.trace('dedupePubsPerAuthorship.keep', 'keeper_list:  will not remove pub uri: %s', uri)
+                else:
+                    logging.info("removing pub uri: %s ...", uri)
+                    self._change('dedupePubsPerAuthorship', 'remove_publication', pub=uri)
+
+        logging.info("All Done!")
+        self._checkpoint()
+
+    #the number of authorships of pub uri in the input
+    def _countAuthorships(self, uri):
+        results = self._datasource.getPublicationAuthorshipURIs(uri)
+        collabs = self._datasource.getPublicationCollaborationURIs(uri)
+        logging.info("pub uri: %s has %d authorships and %d collaborations...", uri, len(results), len(collabs))
+        return len(results)
+
+    #Pick the pubs to keep of uris, the duplicate pubs with uid in the input; authorships(uri) is the number of authorships
+    #of a pub.  If uid isn't in Vivo, the first pub is kept; otherwise the pub with the most authorships, or if it isn't in
+    #Vivo, a runner-up with as many that is.  The keepers are recorded in the checkpoint, and an interrupted run's kept.
+    def _pickKeepers(self, uid, uris, authorships):
+        kept = self._resume.decision('dedupePubsPerAuthorship', uid)
+        if kept is not None:
+            return kept
+        keeper_list = []
+        keeperFound=False
+        uidFound = False
+        numberOfAuthorships=0
+        keepUri=""
+        runnerUpUri=""
+    
+        for uri in sorted(uris):
+            if self._keyidentifier=="bibo:pmid":
+                uidFound=self._isPresent(VIVOPMIDPresentQuery, uid)
+            elif self._keyidentifier=="bibo:doi":
+                uidFound=self._isPresent(VIVODOIPresentQuery, uid)
             
-                if uri in keeper_list:
-                    logging.info("keeper_list:  will not remove pub uri: "+uri)
+            if not uidFound:
+                logging.error("couldn't find publication "+uid+" in Vivo, yet it is duplicated in the Input.  Will pick one in the Input...")
+                if not keeperFound:
+                    keeper_list.append(uri)
+                    keeperFound=True
+            else:
+                logging.info("found pub %s in Vivo, examining individual %s in the input...", uid, uri)
+                count = authorships(uri)
+                
+                #we always want the pub uri with the greater number of authorships...
+                if count > numberOfAuthorships:
+                   numberOfAuthorships = count
+                   keepUri = uri
+                elif count and count==numberOfAuthorships:
+                    runnerUpUri = uri
+        
+        if keeperFound==False:
+            for uri in uris:
+                if  keepUri != "" and uri==keepUri:
+                    logging.debug("keepUri: %s has %d authorships", keepUri, numberOfAuthorships)
+                    if not self._isPresent(VIVOIndividualPresentQuery, uri):
+                        if VivoUri.hasHttpPrefix(runnerUpUri) and not self._isPresent(VIVOIndividualPresentQuery, runnerUpUri):
+                            raise DeduperException("SEVERE:  pub uri "+uri+" and pub uri "+runnerUpUri+" both had the largest number of authorships for that uid, so we can't pick only one uri for uid "+uid+", but neither was found in Vivo.  Perhaps you should check the data in Vivo to see if it has changed, or re-run Harvester...")
+                        elif VivoUri.hasHttpPrefix(runnerUpUri):
+                            uri=runnerUpUri
+                    keeper_list.append(uri)
+        self._resume.decide('dedupePubsPerAuthorship', uid, keeper_list)
+        return keeper_list
+
+    #dedupePubsPerAuthorship() on the duplicates found by DataSource.stream_duplicates(), which already counted the
+    #authorships of each pub, so the graph is never grouped or queried: only the removals are planned.
+    def dedupeStreamedPubs(self, duplicates):
+        removed = 0
+        for uid, pubs in duplicates:
+            counts = dict(pubs)
+            keepers = set(self._pickKeepers(uid, [pub for (pub, count) in pubs], counts.get))
+            for (pub, count) in pubs:
+                if pub in keepers:
+                    self._tracer.trace('dedupePubsPerAuthorship.keep', 'keeper_list:  will not remove pub uri: %s', pub)
                 else:
-                    logging.info("removing pub uri: "+uri+" ...")            
-                    self._datasource.removePublication(DataSource.uri_literal_as_ref(uri))
-                        
+                    logging.info("removing pub uri: %s ...", pub)
+                    self._change('dedupePubsPerAuthorship', 'remove_publication', pub=pub)
+                    removed += 1
+        if not removed:
+            logging.info("***Keeping all publications found in the input file...")
         logging.info("All Done!")
-        self._datasource.serialize(self._outputfilename)
+        self._checkpoint()
 
     def removePubFoundInVivo(self):
         pubUris = self._datasource.getPublicationURIs(self._keyidentifier)
         
-        #for each pubUri, do a Vivo lookup on PMID
+        uids = {}
         for uri in pubUris:
                 if self._keyidentifier=="bibo:pmid":
-                    uid = self._datasource.getPublicationPMID(uri)
+                    uids[uri] = self._datasource.getPublicationPMID(uri)
                 elif self._keyidentifier=="bibo:doi":
-                    uid = self._datasource.getPublicationDOI(uri)
+                    uids[uri] = self._datasource.getPublicationDOI(uri)
+        self._prefetch(self._uidQuery(), uids.values())
+        
+        #for each pubUri, do a Vivo lookup on PMID
+        for uri in pubUris:
+                uid = uids.get(uri)
                 uidFound=False
                 if self._keyidentifier=="bibo:pmid":
-                    uidFound=VIVOPMIDPresentQuery().isPresent(uid)
+                    uidFound=self._isPresent(VIVOPMIDPresentQuery, uid)
                 elif self._keyidentifier=="bibo:doi":
-                    uidFound=VIVODOIPresentQuery().isPresent(uid)
+                    uidFound=self._isPresent(VIVODOIPresentQuery, uid)
                 if (uidFound):
-                    logging.info("found in Vivo, removing pub uri from in vivo-additions.rdf.xml: "+uri+" ...")            
-                    self._datasource.removePublication(DataSource.uri_literal_as_ref(uri))
-                    self._datasource.serialize(self._outputfilename)
+                    logging.info("found in Vivo, removing pub uri from in vivo-additions.rdf.xml: %s ...", uri)
+                    self._change('removePubFoundInVivo', 'remove_publication', pub=uri)
+        self._checkpoint()
     
         
     #TODO: insert the rules for collaborations here...
@@ -512,123 +580,146 @@ class Deduper:
         pass
       
         
+    #pick the one venue uri that pub_uri should keep out of its venues in the input: the venue already in Vivo (found by ISSN),
+    #the first input venue if Vivo has none, or one picked by _pickVivoVenue() if Vivo has several.  Returns "" if the user
+    #declines, and None if the pub is left for review.
+    #vivo_venues are those of venues that Vivo has under their ISSN (see VenueMap); venue_issns is venue -> ISSN.
+    def _pickVenue(self, pub_uri, venues, vivo_venues, venue_issns):
+        #Begin a command line dialogue
+        print("The input file says that publication "+pub_uri+" has these venues:")  
+        for venue in venues:
+            print(venue)
+            if venue in vivo_venues:
+                logging.info('Pub %s published in ISSN %s',pub_uri,venue_issns[venue])
+            elif len(self._venuemap.venues(venue_issns[venue])):
+                #the ISSN is in Vivo, but under another uri: we'd want a new pub to have the link to the pub venue already in vivo,
+                #so this one is excluded.
+                logging.debug('venue %s has ISSN %s, which Vivo has for %s', venue, venue_issns[venue], ", ".join(self._venuemap.venues(venue_issns[venue])))
+       
+        print("venues in vivo related to pub "+pub_uri +":")
+        for known_venue in vivo_venues:
+            print(known_venue)
+      
+        #change pub venues to the existing vivo uri, or, if none exists, print a warning.
+        if len(vivo_venues)==0:
+            print ("this publication venue wasn't found by ISSN query in Vivo.  this util will pick one uri conveniently and rewrite all the others")
+            #the lowest uri, so that the pick doesn't depend on the order of the graph
+            return sorted(venues)[0]
+        elif len(vivo_venues)>1:
+            #TODO: this condition is never met, although we could return multiple 
+            #Vivo venues for pub_uri. Besides that, this is really a problem with Vivo itself.
+            print("multiple publication venue uris were already found in Vivo.  Please resolve this problem (i.e. pick one uri already in Vivo for this resource) before adding the new data")
+            return self._pickVivoVenue(pub_uri, venues, vivo_venues, venue_issns)
+        else:
+            return vivo_venues[0]
+
+    #pick one of the several venues Vivo has for pub_uri.  A venue given in the venue choices file (for the pub, one of its
+    #ISSNs or one of the Vivo venues) comes first; then, by venue policy, 'prompt' asks the user for an n-number, 'most' takes
+    #the venue with the most publications in Vivo unless there's a tie, and 'queue' takes none.
+    #Returns None when the pub is left for review (see _queueVenue()).
+    def _pickVivoVenue(self, pub_uri, venues, vivo_venues, venue_issns):
+        for key in [pub_uri] + [venue_issns[venue] for venue in venues] + vivo_venues:
+            if key in self._venuechoices:
+                new_venue_uri = self._venuechoices[key]
+                if not self._isPresent(VIVOIndividualPresentQuery, new_venue_uri):
+                    return self._queueVenue(pub_uri, venues, vivo_venues, venue_issns, "the venue chosen for "+key+", "+new_venue_uri+", isn't in Vivo")
+                logging.info("pub %s: venue %s chosen for %s", pub_uri, new_venue_uri, key)
+                return new_venue_uri
+        if self._venuepolicy == 'most':
+            pubs = dict((venue, self._venuemap.venues(venue_issns[venue]).get(venue, 0)) for venue in vivo_venues)
+            most = [venue for venue in vivo_venues if pubs[venue] == max(pubs.values())]
+            if len(most) > 1:
+                return self._queueVenue(pub_uri, venues, vivo_venues, venue_issns, "%d venues have the most publications in Vivo" % len(most))
+            logging.info("pub %s: venue %s has the most publications in Vivo (%d)", pub_uri, most[0], pubs[most[0]])
+            return most[0]
+        elif self._venuepolicy == 'queue':
+            return self._queueVenue(pub_uri, venues, vivo_venues, venue_issns, "more than one venue in Vivo")
+
+        while True:
+            user_n_input=raw_input("\nEnter an n##### string you have found in Vivo to create a single uri in the input file:")
+            user_decision=raw_input('You entered %s. Hit <Enter> to rewrite the input file so it maps onto this uri, otherwise type <n><Enter>' % user_n_input)
+            if user_decision=='n' or user_decision=='N':
+                return ""
+            new_venue_uri=VivoUri.encodeNasUri("http://vivo.health.unm.edu/", user_n_input)
+            if not self._isPresent(VIVOIndividualPresentQuery, new_venue_uri):
+                print "\n\n***ERROR: I couldn't find uri %s in Vivo!\n\n" % new_venue_uri
+            else:
+                return new_venue_uri
+
+    #leave pub_uri's venues as they are, and add it to the review file, with why and what to choose from
+    def _queueVenue(self, pub_uri, venues, vivo_venues, venue_issns, reason):
+        logging.warning("pub %s left for review: %s", pub_uri, reason)
+        vivo_pubs = ["%s=%d" % (venue, self._venuemap.venues(venue_issns[venue]).get(venue, 0)) for venue in vivo_venues]
+        issns = sorted(set(venue_issns[venue] for venue in venues))
+        self._venuereview.append([pub_uri, "", reason, " ".join(issns), " ".join(venues), " ".join(vivo_pubs)])
+        return None
+
+    #write the pubs left for review to the review file, as a venue choices file (see VenueMap.read_choices()) with the
+    #venue column left blank.  Written whenever the venue policy isn't 'prompt', even if it's empty, so that an unattended
+    #run always leaves one behind.
+    def _writeVenueReview(self):
+        if self._venuepolicy == 'prompt' and not self._venuereview:
+            return
+        Deduper.write_venue_review(self._reviewfile if self._reviewfile is not None else self._outputfilename+".review.tsv", self._venuereview)
+
+    @staticmethod
+    def write_venue_review(reviewfile, rows):
+        with open(reviewfile, "wb") as f:
+            f.write("#pub\tvenue\treason\tissns\tinput venues\tvivo venues=publications\n")
+            for row in sorted(rows):
+                f.write("\t".join(row)+"\n")
+        logging.info("%d publications left for venue review in %s", len(rows), reviewfile)
+
+    #resolve issns against Vivo all at once, unless the venue map already has them
+    def _resolveIssns(self, issns):
+        try:
+            self._venuemap.resolve(issns)
+        except VIVOQueryException as e:
+            self._resume.save()
+            logging.error("VIVOIssnVenueQuery failed: %s", e)
+            raise
+
     #query publications with (venues Per publication > 1) and do something about it...  
     def dedupeVenuesPerPub(self):
     
-        #Unfortunately, self._datasource.getPubsWithDuplicateVenues()
-        #sends a query that returns everything (though the query *does* work on fuseki).  Maybe someday this can be made to work?
-        #pubs = self._datasource.getPubsWithDuplicateVenues()
-        
         #get all pub uris in the input file.        
         all_pub_uris = self._datasource.getPublicationURIs(self._keyidentifier)        
         logging.info(str(len(all_pub_uris))+" publications found in the file")
         
-        #we'll keep a dictionary of venues keyed on pub uri
+        #one scan of the input finds the venues (with an ISSN) of every pub, and the ISSN of every venue.
+        #only publications with more than one venue need any work.
+        pub_venues, venue_issns, issn_venues = self._datasource.venue_index()
         input_venues = {}
-        
         for pub_uri in all_pub_uris:
-            #must extract the unicode string as the uri because pub_uri is a Python list element which is a URI ref, not a URI literal (string).
-            #TODO: figure out why rdflib doesn't provide a way to get the string from the pub uri?
-            #pub_string = VivoUri.extractUnicodeString(str(pub_uri))
-            
-            logging.debug('reading venues for pub %s (%s) from input %s', str(pub_uri), pub_uri, self._datasource._filename) 
-            
-            if string.strip(pub_uri)=="":
-                    continue
-            else:
-                #get the multiple venue uris for the pub...
-                venue_uris = self._datasource.getPublicationVenueURIs(pub_uri)
-            
-                if not len(venue_uris):
-                    logging.warning("No venue found in the input file for pub "+pub_uri)
-                    continue
-                else:
-                    #update a pub uri in the venues dict with information on its venue uris, found in the input file... 
-                    input_venues[pub_uri] = []
-                    for venue_uri in venue_uris:
-                        input_venues[pub_uri].append(venue_uri)
-        
-        #create an exclusion list for venues, adding a venue uri to the list if its issn was found in vivo.
-        #TODO: if it seems slow to check exclusion_list for an element, use a hash rather than an array...
-        #NOTE: vivo_venues is a counterpart to input_venues which helps us decide which venue uris get excluded.
-        exclude_list = []
-        vivo_venues = {}
-        
-        
-        logging.debug("processing venues dictionary, checking for each publication's venues in Vivo...")
+            if string.strip(pub_uri)!="" and len(pub_venues.get(pub_uri, []))>1:
+                input_venues[pub_uri] = pub_venues[pub_uri]
+        logging.info(str(len(input_venues))+" publications found with more than one venue")
+        
+        #every distinct ISSN of those pubs' venues is then looked up in Vivo at once, rather than once per venue per pub.
+        #a venue already chosen for a pub (by a run that was interrupted) is applied without asking Vivo or the user again.
+        self._venuereview = []
+        undecided = [pub_uri for pub_uri in input_venues if self._resume.decision('dedupeVenuesPerPub', pub_uri) is None]
+        issns = set(venue_issns[venue] for pub_uri in undecided for venue in input_venues[pub_uri])
+        logging.debug("resolving %d ISSNs of %d venues in Vivo...", len(issns), len(issn_venues))
+        self._resolveIssns(issns)
         
         for pub_uri in input_venues:
-            #give me another publication with a problem, and do the whole loop again...        
-            logging.debug("publication:"+pub_uri)
-            if pub_uri not in vivo_venues:
-                vivo_venues[pub_uri]=[]
-            
-            if len(input_venues[pub_uri])==0:
-                logging.warn("publication "+pub_uri+" had no venues.")
-            elif len(input_venues[pub_uri]) == 1:
-                logging.debug("publication "+pub_uri+" had one venue: "+str(input_venues[pub_uri]))
-            else:
-                #Begin a command line dialogue
-                print("The input file says that publication "+pub_uri+" has these venues:")  
-                for venue in input_venues[pub_uri]:
-                    print(venue)
-                    #this comparison between the data source (input) and the live vivo
-                    #should be here, not in vivodata.py
-                    issn=self._datasource.getPublicationVenueISSN(venue)
-                    if issn=='':
-                        continue
-                    if VIVOIssnQuery.isPresent(issn):
-                        if not VIVOIndividualPresentQuery.isPresent(venue):
-                            exclude_list.append(venue)
-                        else:
-                            logging.info('Pub %s published in ISSN %s',pub_uri,issn)
-                            if venue not in vivo_venues[pub_uri]:
-                                vivo_venues[pub_uri].append(venue)
-                        #what does this mean?  obviously we'd want a new pub to have the link
-                        #to the pub venue already in vivo, given the match on issn, so we don't exclude all uri references to the vivo pub venue when we save out the input data.
-               
-                print("venues in vivo related to pub "+pub_uri +":")
-                for known_venue in vivo_venues[pub_uri]:
-                    print(known_venue)
-              
-                        #change pub venues to the existing vivo uri, or, if none exists, print a warning.
-                if len(vivo_venues[pub_uri])==0:
-                    print ("this publication venue wasn't found by ISSN query in Vivo.  this util will pick one uri conveniently and rewrite all the others")
-                    new_venue_uri = input_venues[pub_uri][0]
-                    for uri in input_venues[pub_uri]:
-                                if (new_venue_uri != uri):
-                                    self._datasource.changePublicationVenue(DataSource.uri_literal_as_ref(pub_uri), DataSource.uri_literal_as_ref(uri), DataSource.uri_literal_as_ref(new_venue_uri))
-                                    
-                elif len(vivo_venues[pub_uri])>1:
-                    #TODO: this condition is never met, although we could return multiple 
-                    #Vivo venues for pub_uri. Besides that, this is really a problem with Vivo itself.
-                    print("multiple publication venue uris were already found in Vivo.  Please resolve this problem (i.e. pick one uri already in Vivo for this resource) before adding the new data")
-                    
-                    got_input=False
-                    
-                    while not got_input:
-                        user_n_input=raw_input("\nEnter an n##### string you have found in Vivo to create a single uri in the input file:")
-                        user_decision=raw_input('You entered %s. Hit <Enter> to rewrite the input file so it maps onto this uri, otherwise type <n><Enter>' % user_n_input)
-                        if user_decision=='n' or user_decision=='N':
-                            got_input=True
-                            continue
-                        new_venue_uri=VivoUri.encodeNasUri("http://vivo.health.unm.edu/", user_n_input)
-                        if not VIVOIndividualPresentQuery.isPresent(new_venue_uri):
-                            print "\n\n***ERROR: I couldn't find uri %s in Vivo!\n\n" % new_venue_uri
-                        else:
-                            got_input=True
-                            for uri in venues[pub_uri]:
-                                if (new_venue_uri != uri):
-                                    self._datasource.changePublicationVenue(DataSource.uri_literal_as_ref(pub_uri), DataSource.uri_literal_as_ref(uri), DataSource.uri_literal_as_ref(new_venue_uri))
-                                    
-                else:
-                    new_venue_uri = vivo_venues[pub_uri][0]
-                    
-                    for uri in input_venues[pub_uri]:
-                    
-                        if (new_venue_uri != uri):
-                            self._datasource.changePublicationVenue(DataSource.uri_literal_as_ref(pub_uri), DataSource.uri_literal_as_ref(uri), DataSource.uri_literal_as_ref(new_venue_uri))  
-        
+            self._tracer.trace('dedupeVenuesPerPub', 'publication: %s', pub_uri)
+            new_venue_uri = self._resume.decision('dedupeVenuesPerPub', pub_uri)
+            if new_venue_uri is None:
+                vivo_venues = [venue for venue in input_venues[pub_uri] if venue in self._venuemap.venues(venue_issns[venue])]
+                new_venue_uri = self._pickVenue(pub_uri, input_venues[pub_uri], vivo_venues, venue_issns)
+                #a pub left for review isn't decided, so that it's picked up again once the review is done
+                if new_venue_uri is None:
+                    continue
+                self._resume.decide('dedupeVenuesPerPub', pub_uri, new_venue_uri)
+            if new_venue_uri == "":
+                continue
+            new_venue_uri = DataSource.uri_literal_as_ref(new_venue_uri)
+            for uri in input_venues[pub_uri]:
+                if (new_venue_uri != uri):
+                    self._change('dedupeVenuesPerPub', 'change_venue', pub=pub_uri, venue=uri, new_venue=new_venue_uri)
+
         logging.info("All Done!")
         print "\n\nHere are the unique identifiers of publications, found in the file:"
         count=0
@@ -641,8 +732,8 @@ class Deduper:
             elif self._keyidentifier=="bibo:doi":
                 print str(self._datasource.getPublicationDOI(DataSource.uri_literal_as_ref(pub)))
         
-        
-        self._datasource.serialize(self._outputfilename)    
+        self._writeVenueReview()
+        self._checkpoint()    
 
         
     def removeAllOtherCollaborations(self, collaboratorUriToKeep):
@@ -651,14 +742,13 @@ class Deduper:
             collaborations = self._datasource.getPublicationCollaborationURIs(uri)
             for collaboration in collaborations:
                 collaborator = self._datasource.getCollaboratorURIFromCollaboration(collaboration)
-                logging.debug("collaborator examined: "+str(collaborator))
-                logging.debug("collaborator to keep: "+str(collaboratorUriToKeep))
+                self._tracer.trace('removeAllOtherCollaborations', 'collaborator examined: %s, collaborator to keep: %s', collaborator, collaboratorUriToKeep)
                 if str(collaborator) == str(collaboratorUriToKeep):
-                    logging.debug("keeping collaboration "+str(collaboration)+" for collaborator URI "+str(collaborator))
+                    logging.debug("keeping collaboration %s for collaborator URI %s", collaboration, collaborator)
                     continue
                 else:
-                    self._datasource.removeCollaboration(DataSource.uri_literal_as_ref(collaboration))
-                    self._datasource.serialize(self._outputfilename)
+                    self._change('removeAllOtherCollaborations', 'remove_collaboration', pub=uri, collaboration=collaboration)
+        self._checkpoint()
         
         
         
@@ -669,12 +759,12 @@ class Deduper:
             for authorship in authorships:
                 author = self._datasource.getAuthorURIFromAuthorship(authorship)
                 if str(author) == str(authorUriToKeep):
-                    logging.debug("keeping authorship "+str(authorship)+" for author URI "+str(author))
+                    logging.debug("keeping authorship %s for author URI %s", authorship, author)
                     continue
                 else:
                     #logging.debug("removing authorship "+str(authorship)+".  author URI "+str(author)+" !== "+str(authorUriToKeep))
-                    self._datasource.removeAuthorship(DataSource.uri_literal_as_ref(authorship))
-                    self._datasource.serialize(self._outputfilename)
+                    self._change('removeAllOtherAuthorships', 'remove_authorship', pub=uri, authorship=authorship)
+        self._checkpoint()
 
 
         
@@ -682,26 +772,308 @@ class Deduper:
         pass
         #self._datasource.close()
         
+#Run the deduper stages pd0-pd5 on inputfile.  By default, each stage re-reads the previous stage's output file, as the
+#intermediate files are meant for review.  With pipeline=True, the graph is parsed once and every stage runs on the same
+#DataSource; intermediate pd files are then only written if checkpoint is True.  The final output is always written.
+#Returns the name of the final output file.
+#resumefile names the Checkpoint file that keeps Vivo lookups and decisions, so that an interrupted run can be resumed,
+#and venuemapfile the VenueMap file that keeps the Vivo venues of ISSNs across runs.
+#venuepolicy, venuechoicefile and reviewfile say how venues already in Vivo more than once are picked (see Deduper.__init__()).
+def run_pipeline(inputfile, keyidentifier, pipeline=False, checkpoint=True, resumefile=None, venuemapfile=None,
+        venuepolicy='prompt', venuechoicefile=None, reviewfile=None):
+    resume = Checkpoint(resumefile)
+    venues = _venue_options(venuemapfile, venuepolicy, venuechoicefile, reviewfile)
+    dd = None
+    outfile = inputfile
+    for (workflowcode, description, calls) in Deduper.STAGES:
+        logging.info('-'*65)
+        logging.info("%s.  %s", workflowcode, description)
+        if dd is None or not pipeline:
+            dd = Deduper(outfile, keyidentifier, workflowcode, checkpoint=(checkpoint or not pipeline), resume=resume, **venues)
+        else:
+            dd.next_stage(workflowcode)
+        outfile = dd._outputfilename
+        dd.run_stage(calls)
+    #otherwise every stage, the last one included, has already written its output
+    if pipeline and not checkpoint:
+        dd._datasource.serialize(outfile)
+    return outfile
+
+#the Deduper arguments for dedupeVenuesPerPub(), shared by all stages of a run
+def _venue_options(venuemapfile, venuepolicy, venuechoicefile, reviewfile):
+    choices = VenueMap.read_choices(venuechoicefile) if venuechoicefile is not None else {}
+    return dict(venuemap=VenueMap(venuemapfile), venuepolicy=venuepolicy, venuechoices=choices, reviewfile=reviewfile)
+
+#Out-of-core run, for harvests too big to group in memory: pd0 is decided before the graph is loaded, from the duplicate
+#pubs DataSource.stream_duplicates() finds in a streaming pass over inputfile, holding at most budget records in memory
+#(the rest is spilled to tmpdir, by default the system's temporary directory).  The graph is then loaded once, the pd0
+#removals applied to it, and the other stages run on it as with run_pipeline(pipeline=True); with checkpoint=True every
+#stage's output is written too.  Returns the name of the final output file.
+def stream_pipeline(inputfile, keyidentifier, budget=ExternalSorter.BUDGET, tmpdir=None, checkpoint=False, resumefile=None, venuemapfile=None,
+        venuepolicy='prompt', venuechoicefile=None, reviewfile=None):
+    resume = Checkpoint(resumefile)
+    venues = _venue_options(venuemapfile, venuepolicy, venuechoicefile, reviewfile)
+    (workflowcode, description, calls) = Deduper.STAGES[0]
+    logging.info('-'*65)
+    logging.info("%s.  %s (streamed, %d records in memory)", workflowcode, description, budget)
+    plan = ChangePlan()
+    stats = {}
+    scout = Deduper(inputfile, keyidentifier, workflowcode, datasource=DataSource(), checkpoint=False, resume=resume, plan=plan, **venues)
+    scout.dedupeStreamedPubs(DataSource.stream_duplicates(inputfile, keyidentifier, budget, tmpdir, stats))
+    logging.info("%d of %d publications in %s to remove", len(plan), stats.get('pubs', 0), inputfile)
+
+    datasource = DataSource(inputfile)
+    plan.apply(datasource)
+    dd = Deduper(inputfile, keyidentifier, workflowcode, datasource=datasource, checkpoint=checkpoint, resume=resume, **venues)
+    if checkpoint:
+        datasource.serialize(dd._outputfilename)
+    for (workflowcode, description, calls) in Deduper.STAGES[1:]:
+        logging.info('-'*65)
+        logging.info("%s.  %s", workflowcode, description)
+        dd.next_stage(workflowcode)
+        dd.run_stage(calls)
+    if not checkpoint:
+        datasource.serialize(dd._outputfilename)
+    return dd._outputfilename
+
+#plan-then-apply, first half: run every stage on one in-memory graph, with Vivo lookups in batches, and write the changes
+#they decide on to planfile (JSON) for review, instead of writing any output.  Returns the plan.
+def plan_pipeline(inputfile, keyidentifier, planfile, resumefile=None, venuemapfile=None,
+        venuepolicy='prompt', venuechoicefile=None, reviewfile=None):
+    plan = ChangePlan()
+    venues = _venue_options(venuemapfile, venuepolicy, venuechoicefile, reviewfile)
+    dd = None
+    for (workflowcode, description, calls) in Deduper.STAGES:
+        logging.info('-'*65)
+        logging.info("%s.  %s (planning)", workflowcode, description)
+        if dd is None:
+            dd = Deduper(inputfile, keyidentifier, workflowcode, checkpoint=False, resume=Checkpoint(resumefile), plan=plan, **venues)
+        else:
+            dd.next_stage(workflowcode)
+        dd.run_stage(calls)
+    for (stage, op), count in sorted(plan.summary().items()):
+        logging.info("%s: %d x %s", stage, count, op)
+    plan.dump(planfile)
+    return plan
+
+#Incremental dedupe of a new harvest, given prioroutput, the final output of the previous run, and its Checkpoint
+#(resumefile), which keeps the signature of every publication uid harvested then (see DataSource.pub_signatures()).
+#Only uids that are new, or whose publications, authorships, persons or venues changed, go through the stages, on the input
+#minus what only unchanged publications are made of; their earlier decisions are forgotten so they are made again.
+#The unchanged publications are carried forward as prioroutput has them, with the decisions made for them then.
+#Without prioroutput (or signatures), every uid counts as new.  Returns the name of the final output file.
+def delta_pipeline(inputfile, keyidentifier, prioroutput, resumefile, venuemapfile=None,
+        venuepolicy='prompt', venuechoicefile=None, reviewfile=None):
+    resume = Checkpoint(resumefile)
+    datasource = DataSource(inputfile)
+    pubs = datasource.pubs_by_uid(keyidentifier)
+    signatures = datasource.pub_signatures(keyidentifier)
+    previous = resume.decisions.get('signatures', {}) if os.path.exists(prioroutput) else {}
+    changed = set(uid for uid in signatures if previous.get(uid) != signatures[uid])
+    unchanged = set(signatures) - changed
+    logging.info("%d publication uids in %s: %d new or changed, %d carried forward from %s", len(signatures), inputfile, len(changed), len(unchanged), prioroutput)
+
+    #the uids a run that was interrupted was working on are 'pending': a resumed run keeps the decisions it made for them,
+    #but a new run makes them all again, with what Vivo says now.
+    pending = resume.decisions.get('pending', {})
+    if not pending:
+        resume.forget_lookups()
+    for uid in changed:
+        if pending.get(uid) != signatures[uid]:
+            resume.forget([uid] + pubs[uid], keep=('signatures', 'pending'))
+    resume.record('pending', dict((uid, signatures[uid]) for uid in changed))
+    resume.save()
+
+    delta = datasource.closure_triples(datasource.pub_nodes([pub for uid in changed for pub in pubs[uid]]))
+    datasource.remove_triples(datasource.closure_triples(datasource.pub_nodes([pub for uid in unchanged for pub in pubs[uid]])) - delta)
+    carried = set()
+    if unchanged:
+        prior = DataSource(prioroutput)
+        priorpubs = prior.pubs_by_uid(keyidentifier)
+        carried = prior.closure_triples(prior.pub_nodes([pub for uid in unchanged for pub in priorpubs.get(uid, [])]))
+
+    venues = _venue_options(venuemapfile, venuepolicy, venuechoicefile, reviewfile)
+    dd = None
+    outfile = inputfile
+    for (workflowcode, description, calls) in Deduper.STAGES:
+        outfile = VivoUri.createOutputFileName(outfile, workflowcode)
+        if not changed:
+            continue
+        logging.info('-'*65)
+        logging.info("%s.  %s (%d uids)", workflowcode, description, len(changed))
+        if dd is None:
+            dd = Deduper(inputfile, keyidentifier, workflowcode, datasource=datasource, checkpoint=False, resume=resume, **venues)
+        else:
+            dd.next_stage(workflowcode)
+        dd.run_stage(calls)
+    datasource.add_triples(carried)
+    datasource.serialize(outfile)
+    resume.record('signatures', signatures)
+    resume.record('pending', {})
+    resume.save()
+    return outfile
+
+#Sharded run: split inputfile into shards that can be deduped independently (DataSource.partition(): connected components,
+#or with components=False, pubs per uid), run all the stages on each shard in a pool of processes (one per core by default),
+#and merge the shards back into one graph.  The shards share their Vivo lookups (and the venue map) through a Manager,
+#and their decisions are merged into resumefile.  Processes can't prompt, so the venue policy must be 'most' or 'queue';
+#the pubs left for review are written to one review file.  Only the deduper stages run sharded: coreffer and refsplitter
+#compare names across the whole graph.  Returns the name of the final output file.
+def run_sharded(inputfile, keyidentifier, processes=None, components=True, resumefile=None, venuemapfile=None,
+        venuepolicy='queue', venuechoicefile=None, reviewfile=None):
+    if venuepolicy == 'prompt':
+        raise DeduperException("a sharded run can't prompt for venues, use the venue policy 'most' or 'queue'")
+    processes = processes or multiprocessing.cpu_count()
+    resume = Checkpoint(resumefile)
+    venues = _venue_options(venuemapfile, venuepolicy, venuechoicefile, reviewfile)
+    datasource = DataSource(inputfile)
+    shards, rest = datasource.partition(processes, keyidentifier, components)
+    logging.info("%s split into %d shards of %s triples (%d triples not part of any publication)", inputfile, len(shards), ", ".join(str(len(shard)) for shard in shards), len(rest))
+
+    manager = multiprocessing.Manager()
+    lookups = manager.dict(resume.lookups)
+    issns = manager.dict(venues['venuemap'].issns)
+    jobs = [(inputfile, keyidentifier, shard, lookups, issns, resume.decisions, venuepolicy, venues['venuechoices']) for shard in shards]
+    pool = multiprocessing.Pool(min(processes, len(shards) or 1))
+    try:
+        #map_async().get() with a timeout, rather than map(), so that Ctrl-C reaches the pool
+        results = pool.map_async(_run_shard, jobs, chunksize=1).get(365*24*3600)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    merged = DataSource.from_triples(rest, datasource.namespaces())
+    review = []
+    failed = [error for (triples, decisions, rows, error) in results if error is not None]
+    if failed:
+        raise DeduperException("%d of %d shards failed, the first with:\n%s" % (len(failed), len(results), failed[0]))
+    for (triples, decisions, rows, error) in results:
+        merged.add_triples(triples)
+        resume.merge({}, decisions)
+        review.extend(rows)
+    resume.merge(dict(lookups.items()), {})
+    resume.save()
+    venues['venuemap'].merge(dict(issns.items()))
+    venues['venuemap'].save()
+    outfile = inputfile
+    for (workflowcode, description, calls) in Deduper.STAGES:
+        outfile = VivoUri.createOutputFileName(outfile, workflowcode)
+        if workflowcode == 'pd3':
+            Deduper.write_venue_review(reviewfile if reviewfile is not None else outfile+".review.tsv", review)
+    merged.serialize(outfile)
+    return outfile
+
+#run all the stages on one shard, in a worker process of run_sharded(): returns the shard's triples, decisions and
+#pubs left for venue review, and the traceback (None if all went well).  Exceptions are passed back as text, as in batch.py:
+#the exceptions of these modules can't be unpickled in the parent, which would leave the pool waiting.
+def _run_shard(job):
+    try:
+        return _dedupe_shard(*job) + (None,)
+    except Exception:
+        logging.exception("a shard of %s failed", job[0])
+        return ([], {}, [], traceback.format_exc())
+
+def _dedupe_shard(inputfile, keyidentifier, shard, lookups, issns, decisions, venuepolicy, venuechoices):
+    datasource = DataSource.from_triples(shard)
+    if not datasource.pubs_by_uid(keyidentifier):
+        return (shard, {}, [])
+    resume = Checkpoint()
+    resume.lookups = lookups
+    resume.decisions = decisions
+    venuemap = VenueMap()
+    venuemap.issns = issns
+    dd = None
+    review = []
+    for (workflowcode, description, calls) in Deduper.STAGES:
+        if dd is None:
+            dd = Deduper(inputfile, keyidentifier, workflowcode, datasource=datasource, checkpoint=False, resume=resume,
+                venuemap=venuemap, venuepolicy=venuepolicy, venuechoices=venuechoices, reviewfile=os.devnull)
+        else:
+            dd.next_stage(workflowcode)
+        dd.run_stage(calls)
+        review.extend(dd._venuereview)
+        dd._venuereview = []
+    return (list(datasource._graph), resume.decisions, review)
+
+#plan-then-apply, second half: apply a (reviewed) plan to inputfile in one pass, and write the output that run_pipeline()
+#would have written.  Returns the output filename.
+def apply_plan(inputfile, planfile):
+    plan = ChangePlan.load(planfile)
+    datasource = DataSource(inputfile)
+    plan.apply(datasource)
+    outfile = inputfile
+    for (workflowcode, description, calls) in Deduper.STAGES:
+        outfile = VivoUri.createOutputFileName(outfile, workflowcode)
+    datasource.serialize(outfile)
+    return outfile
+
 def main():
     
     logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', filename='../../logs/deduper.log', filemode='w', level=logging.INFO)
     
     #The default is not to run on test data, but to run on the output of pubtool 1...
     testmode=False
+    pipeline=False
+    keep=False
     inputfile='../../rsc/rdf/unm/pt1-vivo-additions.rdf.xml'
     keyidentifier="bibo:pmid"
+    resumefile=None
+    planfile=None
+    applyfile=None
+    venuemapfile=None
+    venuepolicy='prompt'
+    venuechoicefile=None
+    reviewfile=None
+    prioroutput=None
+    shards=None
+    components=True
+    budget=None
     
     try:
-        (options, arguments) = getopt.getopt(sys.argv[1:],'i:k:t')
+        (options, arguments) = getopt.getopt(sys.argv[1:],'i:k:r:n:a:v:P:m:q:d:s:x:tpcue')
     except getopt.GetoptError as err:
         print str(err)
-        print "\n\nThere was an error in your options.\n\nusage: deduper.py -t -i <inputfile> -k {\"pmid\"|\"doi\"}\n\n\t-> use the -t option if you want to dedupe the test data instead of <inputfile>.\n\t-> <inputfile> should be an absolute or relative path with the / separator, either on Windows or Unix.\n\n"
+        print "\n\nThere was an error in your options.\n\nusage: deduper.py -t -p -c -e -r <checkpointfile> -v <venuemapfile> -P {\"prompt\"|\"most\"|\"queue\"} -m <venuechoicefile> -q <reviewfile> -d <prioroutput> -s <processes> -u -x <records> -n <planfile> -a <planfile> -i <inputfile> -k {\"pmid\"|\"doi\"}\n\n\t-> use the -t option if you want to dedupe the test data instead of <inputfile>.\n\t-> use the -p option to run all stages on one in-memory graph, writing only the final output, and add -c to also write the intermediate pd files.\n\t-> use the -e option to log the plan of every SPARQL query template, with its estimated and actual rows per triple pattern, the first time each stage runs it.\n\t-> use the -r option to save Vivo lookups and decisions to <checkpointfile> as they are made; after an interruption, run again with the same -r to resume.\n\t-> use the -v option to keep the venues Vivo has for each ISSN in <venuemapfile>, and look up only new ISSNs on the next run.\n\t-> use the -P option to say how to pick a venue for a publication when Vivo has several: prompt for one (the default), take the one with the most publications in Vivo, or queue the publication for review.  Venues given in <venuechoicefile> (-m) come first.  Publications left undecided are written to <reviewfile> (-q), which defaults to the output file name + .review.tsv.\n\t-> use the -d option, with -r, to dedupe only the publications that are new or changed since the run that wrote <prioroutput> (and <checkpointfile>), and carry the others forward from <prioroutput>.\n\t-> use the -s option to split <inputfile> into connected components of publications, people and venues, and dedupe them on <processes> processes (0: one per core), then merge them; add -u to split by publication uid instead.  The venue policy is then queue, unless -P is most.\n\t-> use the -x option to find duplicate publications in a streaming pass over <inputfile> that keeps at most <records> records in memory (0: a million) and sorts the rest on disk, before the graph is loaded once for all stages (so the graph still has to fit in memory); with -p only the final output is written.\n\t-> use the -n option to write the changes all stages would make to <planfile> for review, without writing any output, and -a to apply a reviewed <planfile> to <inputfile>.\n\t-> <inputfile> should be an absolute or relative path with the / separator, either on Windows or Unix.\n\n"
         sys.exit(2)
     for (opt, arg) in options:
         if opt in ("-i"):
             inputfile=arg
         elif opt in ("-t"):
             testmode=True
+        elif opt in ("-p"):
+            pipeline=True
+        elif opt in ("-c"):
+            keep=True
+        elif opt in ("-e"):
+            DataSource.EXPLAIN=True
+        elif opt in ("-r"):
+            resumefile=arg
+        elif opt in ("-v"):
+            venuemapfile=arg
+        elif opt in ("-P"):
+            if arg not in Deduper.VENUE_POLICIES:
+                print "\n\nthe -P option takes one of "+", ".join(Deduper.VENUE_POLICIES)+"\n\n"
+                sys.exit(2)
+            venuepolicy=arg
+        elif opt in ("-m"):
+            venuechoicefile=arg
+        elif opt in ("-q"):
+            reviewfile=arg
+        elif opt in ("-d"):
+            prioroutput=arg
+        elif opt in ("-s"):
+            shards=int(arg)
+        elif opt in ("-u"):
+            components=False
+        elif opt in ("-x"):
+            budget=int(arg) or ExternalSorter.BUDGET
+        elif opt in ("-n"):
+            planfile=arg
+        elif opt in ("-a"):
+            applyfile=arg
         elif opt in ("-k"):
             if arg not in ("pmid", "doi"):
                 print "\n\nyou must specify pmid (PubMed Identifer) or doi (Digital Object Identifier) as the unique identifier for publications, using the -k option.\nIf you omit the -k option, pmid is the default.\n\n"
@@ -711,6 +1083,8 @@ def main():
         else:
             print "unhandled option!"
             sys.exit(2)
+    #with -p only the final output is written, unless -c asks for the intermediate pd files too (in either order)
+    checkpoint = keep or not pipeline
         
     if testmode:    
         #TODO: put into a testing framework using node-counting rdflib (rather than text-counting count.py) where we get or don't get the expected node counts, and assume a particular Fuseki endpoint
@@ -776,53 +1150,21 @@ def main():
         
     else:
         #Use real data, not test data.
-        logging.info("pd0.  Dedupe Publications per Authorship")
-        dd = Deduper(inputfile, keyidentifier, 'pd0')
-        outfile = dd._outputfilename
-        dd.dedupePubsPerAuthorship()
-
-        #Deduplication order is important!  There was a case with a co-collaborator who had both
-        #duplicate collaborations and duplicate collaborators per collaboration.
-        #removeCollaborationIfExistingAuthorship() would throw a exception because the collaboration was not unique #for that person/pub pair.  Deduping collaborators per collaboration *before* deduping collaborations removed the error.
-        #TODO:  work out how to configure process order (decouple it from the script)
-        # ##
-        logging.info('-'*65)
-        logging.info("pd1.  Dedupe Authors per Authorship (and deal with Collaborators in parallel)")
-        dd = Deduper(outfile, keyidentifier, 'pd1')
-        outfile = dd._outputfilename
-        dd.dedupeAuthorsPerAuthorship()
-        dd.removeAllOtherCollaborations("http://vivo.health.unm.edu/individual/n0")
-        dd.dedupeCollaboratorsPerCollaboration()
-        
-        # ##
-        logging.info('-'*65)
-        logging.info("pd2.  Dedupe Authorships (and Collaborations)")
-        dd = Deduper(outfile, keyidentifier, 'pd2')
-        outfile = dd._outputfilename
-        dd.dedupeAuthorships()
-        dd.dedupeCollaborations()
-        
-        # ##
-        logging.info('-'*65)
-        logging.info("pd3.  Dedupe Venues per Publication")
-        dd = Deduper(outfile, keyidentifier, 'pd3')
-        outfile = dd._outputfilename
-        dd.dedupeVenuesPerPub()
-        
-        logging.info('-'*65)
-        logging.info("pd4.  Remove Collaboration if there is an Authorship")
-        dd = Deduper(outfile, keyidentifier, 'pd4')
-        outfile = dd._outputfilename
-        dd.removeCollaborationIfExistingAuthorship()
-
-        #removes a Publication (and its Authorships) from the additions file if they are already in Vivo
-        #but weren't the time the additions file was created, so there is nothing to dedupe.
-        
-        logging.info('-'*65)
-        logging.info("pd5.  Remove Publication and Authorships if they got added to Vivo after vivo-additions.rdf.xml got created.")
-        dd = Deduper(outfile, keyidentifier, 'pd5')        
-        outfile = dd._outputfilename
-        dd.removePubFoundInVivo()
+        if prioroutput is not None:
+            if resumefile is None:
+                print "\n\nthe -d option needs the checkpoint file of the run that wrote "+prioroutput+", given with -r.\n\n"
+                sys.exit(2)
+            delta_pipeline(inputfile, keyidentifier, prioroutput, resumefile, venuemapfile, venuepolicy, venuechoicefile, reviewfile)
+        elif budget is not None:
+            stream_pipeline(inputfile, keyidentifier, budget, None, checkpoint, resumefile, venuemapfile, venuepolicy, venuechoicefile, reviewfile)
+        elif shards is not None:
+            run_sharded(inputfile, keyidentifier, shards, components, resumefile, venuemapfile, venuepolicy if venuepolicy != 'prompt' else 'queue', venuechoicefile, reviewfile)
+        elif planfile is not None:
+            plan_pipeline(inputfile, keyidentifier, planfile, resumefile, venuemapfile, venuepolicy, venuechoicefile, reviewfile)
+        elif applyfile is not None:
+            apply_plan(inputfile, applyfile)
+        else:
+            run_pipeline(inputfile, keyidentifier, pipeline, checkpoint, resumefile, venuemapfile, venuepolicy, venuechoicefile, reviewfile)
         
         #Define manual edits to the RDF here, if needed.
         
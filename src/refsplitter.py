@@ -9,9 +9,9 @@ import sys
 from vivodata import DataSource
 from vivouri import VivoUri
 from vivoquery import VIVOAuthorName, VIVOAuthorNameQuery, VIVOIndividualPresentQuery
+from tracer import Tracer
 
 
-logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', filename='../../logs/refsplitter.log', filemode='w', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class RefSplitterException(Exception):
@@ -28,12 +28,16 @@ class RefSplitterException(Exception):
 #
 class RefSplitter:
 
-    def __init__(self, domain, filename, keyidentifier, workflowcode):
+    #as for Deduper, an already loaded datasource can be passed in instead of parsing filename again
+    def __init__(self, domain, filename, keyidentifier, workflowcode, datasource=None):
         self._domain = domain
-        try:
-            self._datasource = DataSource(filename)
-        except:
-            raise RefSplitterException("error: there was a problem opening "+filename+" as a data source")
+        if datasource is not None:
+            self._datasource = datasource
+        else:
+            try:
+                self._datasource = DataSource(filename)
+            except:
+                raise RefSplitterException("error: there was a problem opening "+filename+" as a data source")
         self._inputfilename = filename
         #a file of name variations that are considered aliases although one is not a prefix of the other e.g. Jenny/Jennifer
         self._blackfilename = "./BLACKLIST-refsplitter.txt"
@@ -41,6 +45,8 @@ class RefSplitter:
         print "output will be written to "+self._outputfilename+"\n"
         self._keyidentifier=keyidentifier
         
+        self._tracer = Tracer("refsplitter")
+        
         #THE CACHES
         #cache each (person) author URI for which a name template is already made. 
         self._cachedPersonURIs={}
@@ -48,6 +54,8 @@ class RefSplitter:
         self._cachedNameTemplates={}
         #cache URIs to mentions which are blacklisted
         self._blacklist={}
+        #authorships queued by applyRule() to be relinked, as (authorship, new author, label)
+        self._authorshipChanges=[]
         
         #read from csv file into blacklist (too bad blacklist cannot be an RDF graph that makes anti-statements, it would dovetail nicely with our DataSource model)
         with open(self._blackfilename, "rb") as csvfile:
@@ -166,7 +174,7 @@ class RefSplitter:
     #this function should be made generic, so either coreffer or refsplitter could use it
     def applyRule(self, uris, ruleName="NameNotInPrefixChain"):
             for uri in uris:
-                logging.debug("applying rule "+ruleName+" to URI "+uri)
+                self._tracer.trace('applyRule', 'applying rule %s to URI %s', ruleName, uri)
                 
                 authUri=self._datasource.getAuthorURIFromAuthorship(uri)
                 if authUri is None:
@@ -186,14 +194,13 @@ class RefSplitter:
                 if (len(foreName.split(" ",1))==2):
                     firstName = strings.trim(foreName.split(" ",1)[0])
                     middleName = foreName.split(" ",1)[1]
-                    logging.debug("foreName: "+foreName)
-                    logging.debug("middleName: "+middleName)
+                    self._tracer.trace('applyRule.names', 'foreName: %s, middleName: %s', foreName, middleName)
                 else:
                     firstName = foreName
                     middleName = ""
                 asListed = RefSplitter.makeNameTemplate(lastName, firstName, middleName)
                 if (asListed is None) or (len(asListed)!=3):
-                    logging.debug("couldn't include author as listed for author: "+authUri)
+                    logging.debug("couldn't include author as listed for author: %s", authUri)
                     logging.debug("an associative array of three name parts must be stored in asListed nameTemplate")
                     continue
                 
@@ -201,14 +208,14 @@ class RefSplitter:
                     nameTemplate = RefSplitter.makeNameTemplateFromDataSource(parts)
                     self._cachedPersonURIs[authUri]=nameTemplate
                 else:
-                    logging.debug("retrieving cached name for author "+authUri)
+                    self._tracer.trace('applyRule.cached', 'retrieving cached name for author %s', authUri)
                     #print "retrieving cached name for author "+authUri
                     nameTemplate = self._cachedPersonURIs[authUri]
                 
                 nameString=RefSplitter.getNameTemplateAsString(nameTemplate)
                 
                 if (nameTemplate is None) or (len(nameTemplate)!=3) or (nameString==""):
-                    logging.debug("couldn't include name for author: "+authUri)
+                    logging.debug("couldn't include name for author: %s", authUri)
                     logging.debug("an associative array of three name parts must be stored in inVivo nameTemplate")
                     continue
                  
@@ -219,9 +226,7 @@ class RefSplitter:
                         logging.info("author name as listed in the original citation: "+RefSplitter.getNameTemplateAsString(asListed))
                         logging.debug("rule returned uri <"+keyvalue+">")
                     else:
-                        logging.debug("author name proposed by Vivo Harvester or found in Vivo itself: "+nameString)
-                        logging.debug("author name as listed in the original citation: "+RefSplitter.getNameTemplateAsString(asListed))                
-                        logging.debug("rule returned uri <"+keyvalue+">")
+                        self._tracer.trace('applyRule.rule', 'author name proposed by Vivo Harvester or found in Vivo itself: %s, as listed in the original citation: %s, rule returned uri <%s>', nameString, asListed, keyvalue)
                 else:
                     continue
                 new_uri = None    
@@ -230,16 +235,16 @@ class RefSplitter:
                         new_uri=self._datasource.create_resource(self._domain, "foaf:Person", authorAsListed)
                         logging.info("delumping "+RefSplitter.getNameTemplateAsString(asListed)+" from "+authUri+", new uri: "+new_uri)
                         self._cachedNameTemplates[RefSplitter.getNameTemplateAsString(asListed)] = new_uri
-                        logging.debug("cacheNameTemplates:"+str(len(self._cachedNameTemplates))+" members")
+                        logging.debug("cacheNameTemplates: %d members", len(self._cachedNameTemplates))
                         self._datasource.add_triple(new_uri, "foaf:firstName", firstName)
                         if middleName != "":
                             self._datasource.add_triple(new_uri, "vivo:middleName", middleName)
                         self._datasource.add_triple(new_uri, "foaf:lastName", lastName)
-                        self._datasource.changeAuthorship(DataSource.uri_literal_as_ref(uri), new_uri, self._datasource.getLabel(uri))
+                        self._authorshipChanges.append((DataSource.uri_literal_as_ref(uri), new_uri, self._datasource.getLabel(uri)))
                     else:
                         new_uri=self._cachedNameTemplates[RefSplitter.getNameTemplateAsString(asListed)]
                         logging.info("delumping "+RefSplitter.getNameTemplateAsString(asListed)+" from "+authUri+", new uri: "+new_uri)
-                        self._datasource.changeAuthorship(DataSource.uri_literal_as_ref(uri), new_uri, self._datasource.getLabel(uri))
+                        self._authorshipChanges.append((DataSource.uri_literal_as_ref(uri), new_uri, self._datasource.getLabel(uri)))
                     logging.info("-"*65)
                 #since we are not really doing collisions, this is redundant
                 #if keyvalue not in self._theData:
@@ -258,16 +263,24 @@ class RefSplitter:
         pubUris = self._datasource.getPublicationURIs(self._keyidentifier)
         
         self._theData={}
+        self._authorshipChanges=[]
         
         for pubUri in pubUris:
             #Pull all authorship/coll uris as links to person uris
             shipUris = self._datasource.getPublicationAuthorshipURIs(pubUri)
             self.applyRule(shipUris, ruleName)
+        
+        #applyRule() only queues the authorships to delump, so that they are relinked in one batch
+        self._datasource.change_authorships(self._authorshipChanges)
+        self._authorshipChanges=[]
                
         theReport={}                    
         return theReport            
                     
 def main():
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', filename='../../logs/refsplitter.log', filemode='w', level=logging.INFO)
+
     domain=None
     keyidentifier="bibo:pmid"
     try:
@@ -300,6 +313,9 @@ def main():
     #        logging.info(str(collisions[uri][item]))
             
     n._datasource.serialize(outfile)    
+    n._datasource.log_query_stats()
+    n._tracer.report()
+    n._datasource._tracer.report()
 
 if __name__=='__main__':
     main()
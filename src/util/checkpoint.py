@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+#class Checkpoint keeps what a long run has learned so far, so a run killed half way (typically by a VIVOQueryException
+#when the Fuseki endpoint drops out) can pick up where it stopped instead of asking Vivo everything again:
+#    lookups    the answer to every isPresent() query, keyed on the query class and the value looked up (see also prefetch())
+#    decisions  per stage, e.g. the keeper pub uri per PubMed ID, or the venue chosen for a pub at the prompt
+#It is saved as JSON every autosave changes, when a stage ends, and when a query fails.  The file is written to a
+#temporary name first and then renamed, so a crash while saving never leaves a half-written checkpoint.
+#With no filename, a Checkpoint only caches in memory.  lookups may also be replaced by a dict shared between processes
+#(see batch.py); fetched counts the values this Checkpoint actually asked Vivo about.
+import json
+import logging
+import os
+
+
+class CheckpointException(Exception):
+    def __init__(self, message):
+        logging.error(message)
+
+
+class Checkpoint:
+
+    def __init__(self, filename=None, autosave=25):
+        self.filename = filename
+        self.autosave = autosave
+        self.lookups = {}
+        self.decisions = {}
+        self.fetched = 0
+        self._dirty = 0
+        if filename is not None and os.path.exists(filename):
+            try:
+                with open(filename, "rb") as f:
+                    saved = json.load(f)
+            except (IOError, ValueError) as e:
+                raise CheckpointException("there was a problem reading checkpoint "+filename+": "+str(e))
+            self.lookups = saved.get('lookups', {})
+            self.decisions = saved.get('decisions', {})
+            logging.info("resuming from checkpoint %s: %d lookups, %d decisions", filename, len(self.lookups), sum(len(d) for d in self.decisions.values()))
+
+    @staticmethod
+    def _key(query, value):
+        return query.__name__+"|"+unicode(value)
+
+    #query.isPresent(value), asked of Vivo only the first time
+    def lookup(self, query, value):
+        key = Checkpoint._key(query, value)
+        if key not in self.lookups:
+            self.lookups[key] = query.isPresent(value)
+            self.fetched += 1
+            self._changed()
+        return self.lookups[key]
+
+    #look up, in batches, every one of values that hasn't been looked up yet, so that lookup() finds them all
+    def prefetch(self, query, values):
+        missing = {}
+        for value in values:
+            key = Checkpoint._key(query, value)
+            if key not in self.lookups:
+                missing[key] = value
+        if missing:
+            found = query.arePresent(missing.values())
+            for key, value in missing.items():
+                self.lookups[key] = found[value]
+            self.fetched += len(missing)
+            self._changed(len(missing))
+
+    #the decision recorded for key in stage, or default if there is none yet
+    def decision(self, stage, key, default=None):
+        return self.decisions.get(stage, {}).get(unicode(key), default)
+
+    def decide(self, stage, key, value):
+        self.decisions.setdefault(stage, {})[unicode(key)] = value
+        self._changed()
+
+    #replace every decision of stage at once, with a dict of key -> value
+    def record(self, stage, decisions):
+        self.decisions[stage] = dict((unicode(key), value) for (key, value) in decisions.items())
+        self._changed(len(decisions) or 1)
+
+    #forget the decisions made for keys, in every stage but those in keep, so that they are made again
+    def forget(self, keys, keep=()):
+        n = 0
+        for stage in self.decisions:
+            if stage in keep:
+                continue
+            for key in keys:
+                if self.decisions[stage].pop(unicode(key), None) is not None:
+                    n += 1
+        if n:
+            self._changed(n)
+        return n
+
+    #add lookups and decisions made elsewhere, e.g. by the processes of a sharded run
+    def merge(self, lookups, decisions):
+        self.lookups.update(lookups)
+        for stage, made in decisions.items():
+            self.decisions.setdefault(stage, {}).update(made)
+        self._changed(len(lookups) + sum(len(made) for made in decisions.values()))
+
+    #forget every lookup, e.g. when Vivo has changed since they were made
+    def forget_lookups(self):
+        if self.lookups:
+            self._changed(len(self.lookups))
+        self.lookups = {}
+
+    def _changed(self, n=1):
+        self._dirty += n
+        if self._dirty >= self.autosave:
+            self.save()
+
+    def save(self):
+        if self.filename is None or not self._dirty:
+            return
+        tmpname = self.filename+".tmp"
+        with open(tmpname, "wb") as f:
+            json.dump({'lookups': self.lookups, 'decisions': self.decisions}, f)
+        #os.rename won't replace an existing file on Windows
+        if os.name == 'nt' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpname, self.filename)
+        self._dirty = 0
+        logging.debug("checkpoint saved to %s", self.filename)
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+#class ColumnTable holds a query result column by column rather than row by row, so that analysis over large results
+#(counts per author-publication pair, minimum rank per publication...) can be done with NumPy instead of Python loops.
+#String-like columns (URIs, labels, identifiers) are dictionary-encoded: an int32 array of codes indexes into a list of distinct rdflib terms.
+#Rank columns are int64 arrays, date-time columns are datetime64[s] arrays.
+import logging
+import numpy
+
+
+class ColumnTableException(Exception):
+    def __init__(self, message):
+        logging.error(message)
+
+
+class DictColumn:
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    #the code for a term, or -1 if the term isn't in the column
+    def code(self, term):
+        try:
+            return self.values.index(term)
+        except ValueError:
+            return -1
+
+    def decode(self, codes):
+        return [self.values[c] for c in codes]
+
+
+class ColumnTable:
+
+    #kinds of column
+    STRING = 'string'
+    INT = 'int'
+    DATETIME = 'datetime'
+
+    #stands in for a missing or unparseable rank, and sorts after every real rank
+    MISSING_INT = numpy.iinfo(numpy.int64).max
+
+    def __init__(self, names):
+        self.names = list(names)
+        self._columns = {}
+
+    def __len__(self):
+        if not self.names:
+            return 0
+        return len(self._columns[self.names[0]])
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    #raw array for a column: the codes for a dictionary-encoded column, the values otherwise
+    def array(self, name):
+        column = self._columns[name]
+        if isinstance(column, DictColumn):
+            return column.codes
+        return column
+
+    #build a table from an iterable of rows (e.g. one of the DataSource.iter_* generators) in one pass.
+    #kinds maps a column name to ColumnTable.INT or ColumnTable.DATETIME; any other column is dictionary-encoded.
+    @staticmethod
+    def from_rows(rows, names, kinds=None):
+        kinds = kinds or {}
+        table = ColumnTable(names)
+        encoders = [{} for name in names]
+        values = [[] for name in names]
+        cells = [[] for name in names]
+        for row in rows:
+            if len(row) != len(names):
+                raise ColumnTableException("row has %d columns, expected %d" % (len(row), len(names)))
+            for i, term in enumerate(row):
+                kind = kinds.get(names[i], ColumnTable.STRING)
+                if kind == ColumnTable.STRING:
+                    code = encoders[i].get(term)
+                    if code is None:
+                        code = len(values[i])
+                        encoders[i][term] = code
+                        values[i].append(term)
+                    cells[i].append(code)
+                else:
+                    cells[i].append(term)
+        for i, name in enumerate(names):
+            kind = kinds.get(name, ColumnTable.STRING)
+            if kind == ColumnTable.INT:
+                table._columns[name] = numpy.array([ColumnTable.to_int(t) for t in cells[i]], dtype=numpy.int64)
+            elif kind == ColumnTable.DATETIME:
+                table._columns[name] = numpy.array([ColumnTable.to_datetime(t) for t in cells[i]], dtype='datetime64[s]')
+            else:
+                table._columns[name] = DictColumn(numpy.array(cells[i], dtype=numpy.int32), values[i])
+        return table
+
+    @staticmethod
+    def to_int(term):
+        try:
+            return int(unicode(term).strip())
+        except (TypeError, ValueError):
+            return ColumnTable.MISSING_INT
+
+    @staticmethod
+    def to_datetime(term):
+        if term is None:
+            return numpy.datetime64('NaT')
+        text = unicode(term).strip()
+        if text.endswith('Z'):
+            text = text[:-1]
+        try:
+            return numpy.datetime64(text, 's')
+        except ValueError:
+            return numpy.datetime64('NaT')
+
+    #group rows on the given columns.  Returns (keys, inverse): keys has one row per distinct group (as raw column values),
+    #inverse gives the group number of every row.
+    def group(self, *names):
+        if len(self) == 0:
+            return numpy.zeros((0, len(names)), dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        stacked = numpy.column_stack([self.array(name).astype(numpy.int64) for name in names])
+        return numpy.unique(stacked, axis=0, return_inverse=True)
+
+    #e.g. table.group_count('au', 'pmid') gives the number of authorships per author-publication pair
+    def group_count(self, *names):
+        keys, inverse = self.group(*names)
+        return keys, numpy.bincount(inverse, minlength=len(keys))
+
+    #the row index of the smallest value in each group, e.g. table.group_argmin('rank', 'pmid') for the top-ranked row per pub.
+    #Ties go to the first row.
+    @staticmethod
+    def argmin_by_group(groups, values):
+        if len(groups) == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+        order = numpy.lexsort((numpy.arange(len(values)), values, groups))
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = groups[order][1:] != groups[order][:-1]
+        return order[first]
+
+    def group_argmin(self, value_name, *names):
+        keys, inverse = self.group(*names)
+        return keys, ColumnTable.argmin_by_group(inverse, self.array(value_name))
+
+    def group_min(self, value_name, *names):
+        keys, rows = self.group_argmin(value_name, *names)
+        return keys, self.array(value_name)[rows]
+
+    #the rdflib terms of a dictionary-encoded column for the given raw codes (e.g. a column of the keys returned by group())
+    def decode(self, name, codes):
+        return self._columns[name].decode(codes)
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+#class ExternalSorter sorts more records than fit in memory: records (tuples of strings) are kept in memory until there
+#are budget of them, then sorted and spilled to a temporary file, one tab-separated utf-8 line per record.  Iterating
+#over the sorter merges the spilled runs (and whatever is still in memory) back into one sorted stream, so at most budget
+#records, plus one per run, are in memory at any time.  close() removes the temporary files.
+#Tabs, newlines and backslashes in the fields are escaped, so any string round-trips.
+import heapq
+import logging
+import os
+import shutil
+import tempfile
+
+
+class ExternalSorterException(Exception):
+    def __init__(self, message):
+        logging.error(message)
+
+
+class ExternalSorter:
+
+    BUDGET = 1000000
+
+    def __init__(self, budget=BUDGET, tmpdir=None):
+        if budget < 1:
+            raise ExternalSorterException("an external sort needs a budget of at least one record, not "+str(budget))
+        self.budget = budget
+        self.count = 0
+        self._tmpdir = tmpdir
+        self._dir = None
+        self._records = []
+        self._runs = []
+
+    def add(self, record):
+        self._records.append(tuple(unicode(field) for field in record))
+        self.count += 1
+        if len(self._records) >= self.budget:
+            self._spill()
+
+    #sort the records in memory and write them out as the next run
+    def _spill(self):
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix="extsort-", dir=self._tmpdir)
+        self._records.sort()
+        runname = os.path.join(self._dir, "run%d" % len(self._runs))
+        with open(runname, "wb") as f:
+            for record in self._records:
+                f.write(u"\t".join(ExternalSorter._escape(field) for field in record).encode('utf-8')+"\n")
+        self._runs.append(runname)
+        logging.debug("spilled %d records to %s", len(self._records), runname)
+        self._records = []
+
+    @staticmethod
+    def _escape(field):
+        return field.replace(u"\\", u"\\\\").replace(u"\t", u"\\t").replace(u"\n", u"\\n")
+
+    @staticmethod
+    def _unescape(field):
+        if u"\\" not in field:
+            return field
+        chars = []
+        escaped = False
+        for char in field:
+            if escaped:
+                chars.append({u"t": u"\t", u"n": u"\n"}.get(char, char))
+                escaped = False
+            elif char == u"\\":
+                escaped = True
+            else:
+                chars.append(char)
+        return u"".join(chars)
+
+    @staticmethod
+    def _read(runname):
+        with open(runname, "rb") as f:
+            for line in f:
+                yield tuple(ExternalSorter._unescape(field) for field in line[:-1].decode('utf-8').split(u"\t"))
+
+    #every record added so far, in order
+    def __iter__(self):
+        self._records.sort()
+        if not self._runs:
+            return iter(self._records)
+        logging.info("merging %d records from %d runs", self.count, len(self._runs))
+        return heapq.merge(self._records, *[ExternalSorter._read(runname) for runname in self._runs])
+
+    def close(self):
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+        self._dir = None
+        self._records = []
+        self._runs = []
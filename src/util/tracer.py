@@ -0,0 +1,41 @@
+#!/usr/bin/python
+
+#class Tracer replaces the debug strings that used to be built eagerly in hot paths (every triple added or removed,
+#every item of a dedupe loop).  Every trace point is counted, always; its message is only formatted when the tracer's
+#logger is enabled for the trace level, and then only for every sample-th call of that operation.
+#Trace output goes to the logger "trace.<name>", so one component can be traced on demand, e.g.
+#    logging.getLogger("trace.vivodata").setLevel(logging.DEBUG)
+#and report() logs the per-operation counters at the end of each stage (see Deduper._checkpoint()).
+import logging
+
+
+class Tracer:
+
+    def __init__(self, name, level=logging.DEBUG, sample=1):
+        self._logger = logging.getLogger("trace."+name)
+        self.level = level
+        self.sample = sample
+        self.counts = {}
+
+    def enabled(self):
+        return self._logger.isEnabledFor(self.level)
+
+    def count(self, op, n=1):
+        self.counts[op] = self.counts.get(op, 0) + n
+
+    #msg and args are formatted like a logging call, but only if the message is actually going to be written
+    def trace(self, op, msg, *args):
+        n = self.counts.get(op, 0) + 1
+        self.counts[op] = n
+        if (n - 1) % self.sample == 0 and self._logger.isEnabledFor(self.level):
+            self._logger.log(self.level, "%s #%d: " + msg, op, n, *args)
+
+    #log the counters; with reset, count afresh from here, so that each stage reports its own calls
+    def report(self, level=logging.INFO, reset=False):
+        for op in sorted(self.counts):
+            self._logger.log(level, "%s: %d calls", op, self.counts[op])
+        if reset:
+            self.reset()
+
+    def reset(self):
+        self.counts = {}
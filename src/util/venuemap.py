@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+#class VenueMap is the canonical map of ISSN -> the publication venues in Vivo that carry it (with the number of
+#publications each has in Vivo), as used by Deduper.dedupeVenuesPerPub().  Venues change seldom in Vivo, so given a
+#filename the map is kept as JSON across runs, and only ISSNs it hasn't seen yet are looked up, all at once, with
+#VIVOIssnVenueQuery.  Delete the file (or run without it) to look everything up again, e.g. after venues were merged in Vivo.
+#Like a Checkpoint, it is written to a temporary name first and then renamed, and issns may be a dict shared between
+#processes (see batch.py).
+import json
+import logging
+import os
+from vivoquery import VIVOIssnVenueQuery
+
+
+class VenueMapException(Exception):
+    def __init__(self, message):
+        logging.error(message)
+
+
+class VenueMap:
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.issns = {}
+        self.fetched = 0
+        self._dirty = 0
+        if filename is not None and os.path.exists(filename):
+            try:
+                with open(filename, "rb") as f:
+                    self.issns = json.load(f)
+            except (IOError, ValueError) as e:
+                raise VenueMapException("there was a problem reading venue map "+filename+": "+str(e))
+            logging.info("%d ISSNs read from venue map %s", len(self.issns), filename)
+
+    def __contains__(self, issn):
+        return unicode(issn) in self.issns
+
+    #look up every one of issns that isn't in the map yet, in batches, and save the map
+    def resolve(self, issns):
+        missing = set(unicode(issn) for issn in issns if issn != '' and unicode(issn) not in self.issns)
+        if missing:
+            logging.info("looking up %d ISSNs in Vivo (%d already in the venue map)", len(missing), len(self.issns))
+            self.issns.update(VIVOIssnVenueQuery.getVenues(sorted(missing)))
+            self.fetched += len(missing)
+            self._dirty += len(missing)
+            self.save()
+
+    #add the ISSNs of issns (a dict like self.issns) that the map doesn't have yet
+    def merge(self, issns):
+        for issn, venues in issns.items():
+            if issn not in self.issns:
+                self.issns[issn] = venues
+                self._dirty += 1
+
+    #venue uri -> number of publications in Vivo, for the venues in Vivo with issn
+    def venues(self, issn):
+        return self.issns.get(unicode(issn), {})
+
+    #Read a file of venue choices: tab-separated lines of a pub uri, an ISSN or a Vivo venue uri, and the Vivo venue uri
+    #to use for it.  Lines starting with # and lines with no venue yet are skipped, so a review file written by
+    #Deduper.dedupeVenuesPerPub() becomes a choices file once its venue column is filled in.  Returns a dict.
+    @staticmethod
+    def read_choices(filename):
+        choices = {}
+        try:
+            with open(filename, "rb") as f:
+                for line in f:
+                    if line.startswith("#"):
+                        continue
+                    fields = [field.strip() for field in line.split("\t")]
+                    if len(fields) >= 2 and fields[0] and fields[1]:
+                        choices[fields[0]] = fields[1]
+        except IOError as e:
+            raise VenueMapException("there was a problem reading venue choices "+filename+": "+str(e))
+        logging.info("%d venue choices read from %s", len(choices), filename)
+        return choices
+
+    def save(self):
+        if self.filename is None or not self._dirty:
+            return
+        tmpname = self.filename+".tmp"
+        with open(tmpname, "wb") as f:
+            json.dump(self.issns, f, indent=1, sort_keys=True)
+        #os.rename won't replace an existing file on Windows
+        if os.name == 'nt' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpname, self.filename)
+        self._dirty = 0
+        logging.debug("venue map saved to %s", self.filename)
@@ -1,5 +1,5 @@
 #!/usr/bin/python
-import json, urllib, logging
+import json, urllib, logging, re
 from strings import print_safe
 
 
@@ -19,6 +19,10 @@ class VIVOQuery:
         self._handle = None
 
     def _processQuery(self,query):
+        return self._processResult(self._fetch(query))
+
+    #the result bindings of query
+    def _fetch(self,query):
         params = urllib.urlencode({'query':query,'output':self._output})
         result = None
         try:
@@ -30,11 +34,28 @@ class VIVOQuery:
             raise VIVOQueryException(str(e))
         except Exception as f:
             raise VIVOQueryException(str(f))
-        return self._processResult(json.loads(result)['results']['bindings'])
+        return json.loads(result)['results']['bindings']
     #learn: Obviously this method must be overridden, and there's no @override decoration.
     def _processResult(self, result):   
         return None
 
+    #the batched counterpart of isPresent() for the *PresentQuery classes that define _batchQuery(): one query per BATCH values,
+    #each listing its values in a SPARQL 1.1 VALUES block and selecting those found as ?v.  Returns a dict of value -> True/False.
+    BATCH = 200
+
+    @classmethod
+    def arePresent(c, values):
+        if c.conn == None:
+            c.conn = c()
+        values = list(values)
+        found = {}
+        for i in range(0, len(values), VIVOQuery.BATCH):
+            chunk = values[i:i+VIVOQuery.BATCH]
+            hits = set(row['v']['value'] for row in c.conn._fetch(c.conn._batchQuery(chunk)))
+            for value in chunk:
+                found[value] = unicode(value) in hits
+        return found
+
 class VIVOAuthorName:
     def __init__(self, f, m, l):
         print 'first name: ',
@@ -148,6 +169,9 @@ class VIVOIndividualPresentQuery(VIVOQuery):
 
     def _query(self, uri):
         return "SELECT * WHERE {<%s> ?p ?o }" % uri
+
+    def _batchQuery(self, uris):
+        return "SELECT DISTINCT ?v WHERE { VALUES ?v { %s } ?v ?p ?o }" % " ".join("<%s>" % uri for uri in uris)
         
     @classmethod
     def isPresent(c,uri):
@@ -170,6 +194,9 @@ class VIVODOIPresentQuery(VIVOQuery):
 
     def _query(self, doi):
         return "PREFIX bibo:<http://purl.org/ontology/bibo/> SELECT DISTINCT ?individual WHERE { ?individual bibo:doi '%s' }" % doi
+
+    def _batchQuery(self, dois):
+        return "PREFIX bibo:<http://purl.org/ontology/bibo/> SELECT DISTINCT ?v WHERE { VALUES ?v { %s } ?individual bibo:doi ?v }" % " ".join("'%s'" % doi for doi in dois)
         
     @classmethod
     def isPresent(c,doi):
@@ -193,6 +220,9 @@ class VIVOPMIDPresentQuery(VIVOQuery):
     def _query(self, pmid):
         return "PREFIX bibo:<http://purl.org/ontology/bibo/> SELECT DISTINCT ?individual WHERE { ?individual bibo:pmid '%s' }" % pmid
 
+    def _batchQuery(self, pmids):
+        return "PREFIX bibo:<http://purl.org/ontology/bibo/> SELECT DISTINCT ?v WHERE { VALUES ?v { %s } ?individual bibo:pmid ?v }" % " ".join("'%s'" % pmid for pmid in pmids)
+
     #like an instance method accepts an instance as the first argument (usually 'self'), 
     #a class method accepts a class as the first argument.
     #Like a function decorated with @staticmethod (analogous to the Java static keyword), this decorated function can be called on an instance or a class.  However, a @staticmethod decorated function does *not* accept an implied first argument (the first arg in the formal parameter list is "implied" when it is omitted from the actual parameter list of the calling function).  In other words, it's often said that @staticmethod on method() tells Python not to create a bound method when you call object_instance.method().
@@ -233,8 +263,46 @@ class VIVOIssnQuery(VIVOQuery):
         if c.conn == None:
             c.conn = c()
         return c.conn._processQuery(c.conn._query(issn))
-        
-        
+
+
+#Query Vivo for the venues carrying each of a list of ISSNs, and how many publications each venue has in Vivo,
+#one query per VIVOQuery.BATCH ISSNs.
+class VIVOIssnVenueQuery(VIVOQuery):
+
+    conn = None
+
+    #four digits, an optional hyphen, three digits and a check digit or X.  Only ISSNs of this form are put in a query.
+    ISSN = re.compile(r'^\d{4}-?\d{3}[\dXx]$')
+
+    def __init__(self):
+        VIVOQuery.__init__(self)
+
+    #issn -> {venue uri: number of publications}
+    def _processResult(self, result):
+        venues = {}
+        for row in result:
+            venues.setdefault(row['issn']['value'], {})[row['venue']['value']] = int(row['pubs']['value'])
+        return venues
+
+    def _query(self, issns):
+        return "PREFIX bibo:<http://purl.org/ontology/bibo/> PREFIX vivo:<http://vivoweb.org/ontology/core#> SELECT ?issn ?venue (COUNT(DISTINCT ?pub) AS ?pubs) WHERE { VALUES ?issn { %s } ?venue bibo:issn ?issn . OPTIONAL { ?venue vivo:publicationVenueFor ?pub } } GROUP BY ?issn ?venue" % " ".join("'%s'" % issn for issn in issns)
+
+    #every one of issns -> {venue uri: number of publications}, empty for an ISSN that isn't in Vivo (or isn't an ISSN)
+    @classmethod
+    def getVenues(c, issns):
+        if c.conn == None:
+            c.conn = c()
+        issns = [unicode(issn) for issn in issns]
+        venues = dict((issn, {}) for issn in issns)
+        for issn in issns:
+            if not c.ISSN.match(issn):
+                logging.warn("%r is not an ISSN, so it isn't looked up in Vivo", issn)
+        issns = [issn for issn in issns if c.ISSN.match(issn)]
+        for i in range(0, len(issns), VIVOQuery.BATCH):
+            venues.update(c.conn._processQuery(c.conn._query(issns[i:i+VIVOQuery.BATCH])))
+        return venues
+
+
 class VIVOAuthorAsCitedQuery(VIVOQuery):
 
     #is this a class field or instance field?
@@ -1,13 +1,23 @@
 #!/usr/bin/python
+import hashlib
+import itertools
 import logging
+import re
+import time
 import rdflib
+import rdfextras.sparql.parser
 
+from collections import namedtuple
 from rdflib import plugin
 from rdflib.graph import Graph
 from rdflib.namespace import Namespace
+from rdflib.parser import create_input_source
+from rdflib.plugins.parsers.rdfxml import RDFXMLParser
 from pprint import pprint
 from vivouri import VivoUri
 from vivoquery import VIVOIndividualPresentQuery
+from tracer import Tracer
+from extsort import ExternalSorter
 
 #vivodata.py (v0.2) differs from the earlier versions not only because it can handle RDF edits involving
 #Collaborations (as vivodata.py v0.1 can), but it does not call removeCollaboration() when removePublication() is called. 
@@ -21,9 +31,23 @@ plugin.register(
     'sparql', rdflib.query.Result,
     'rdfextras.sparql.query', 'SPARQLQueryResult')
 
+#one entry of the DataSource name table; a missing name part is None
+PersonName = namedtuple('PersonName', 'fname mname lname label')
+
 class DataSourceException(Exception):
     def __init__(self, message):
         logging.error(message)
+
+#what the RDF/XML parser writes to instead of a graph in DataSource.stream(): each triple is handed on as it is parsed
+class _TripleSink:
+    def __init__(self, callback):
+        self._callback = callback
+
+    def add(self, triple):
+        self._callback(triple)
+
+    def bind(self, prefix, namespace, override=True):
+        pass
     
 class NSManager:
     ns={}
@@ -44,6 +68,9 @@ class DataSource:
     
     nsmanager = NSManager()
 
+    #the predicates of the name table, in PersonName field order
+    NAME_PREDICATES = (FOAF['firstName'], VIVO['middleName'], FOAF['lastName'], RDFS['label'])
+
     #a string uri must be converted to correct argument type for the remove* methods by calling DataSource.uri_literal_as_ref(stringUri)
     #TODO: this is very confusing. I need a doc to explain the difference between a URI string and a RDF Lib term (like a URI reference or Literal).
     @staticmethod
@@ -82,6 +109,336 @@ class DataSource:
             except:
                 logging.getLogger(__name__).exception("there was a problem opening "+inputfile+" as a datasource")
                 raise DataSourceException("there was a problem opening "+inputfile+" as a datasource")
+        self._prepared = {}
+        self._plans = {}
+        self._query_stats = {}
+        self._tracer = Tracer("vivodata")
+        self._index_graph()
+
+    #Reference counts are kept as per-node in/out-degree counters, plus the same counts broken down by predicate,
+    #so subReferenceCount(), objReferenceCount() and the *Has* checks never scan the graph.
+    #Every mutation of self._graph must go through _add_triple() or _remove_pattern() to keep the counters in sync.
+    #The same pass keeps the cardinality statistics used to order query patterns (see _plan()): triples per predicate,
+    #individuals per rdf:type, and distinct subjects and (non-literal) objects per predicate.
+    def _index_graph(self):
+        self._outdegree = {}
+        self._indegree = {}
+        self._outlinks = {}
+        self._inlinks = {}
+        self._predicates = {}
+        self._types = {}
+        self._pred_subjects = {}
+        self._pred_objects = {}
+        self._names = None
+        for triple in self._graph:
+            self._count_triple(triple, 1)
+        self._index_names()
+
+    #The name table maps every individual with a first, middle or last name or a label to a PersonName, built in one scan
+    #of each name predicate, so getAuthorName() and friends are dictionary lookups.  _count_triple() rebuilds the entry of
+    #an individual whose names change.
+    def _index_names(self):
+        parts = {}
+        for field, pred in enumerate(self.NAME_PREDICATES):
+            for subj, p, obj in self._graph.triples((None, pred, None)):
+                values = parts.setdefault(subj, [None] * len(self.NAME_PREDICATES))
+                if values[field] is None:
+                    values[field] = obj
+        self._names = dict((subj, PersonName(*values)) for subj, values in parts.items())
+
+    def _refresh_name(self, subj):
+        values = []
+        for pred in self.NAME_PREDICATES:
+            values.append(next(self._graph.objects(subj, pred), None))
+        if values == [None] * len(values):
+            self._names.pop(subj, None)
+        else:
+            self._names[subj] = PersonName(*values)
+
+    #the PersonName of an individual, or None
+    def person_name(self, uri):
+        return self._names.get(DataSource._as_ref(uri))
+
+    @staticmethod
+    def _bump(counts, key, delta):
+        n = counts.get(key, 0) + delta
+        if n > 0:
+            counts[key] = n
+        else:
+            counts.pop(key, None)
+
+    #literals are never asked for their reference count, so only resources are counted as objects
+    def _count_triple(self, triple, delta):
+        subj, pred, obj = triple
+        DataSource._bump(self._predicates, pred, delta)
+        if pred == self.RDF['type']:
+            DataSource._bump(self._types, obj, delta)
+        elif self._names is not None and pred in self.NAME_PREDICATES:
+            self._refresh_name(subj)
+        DataSource._bump(self._outdegree, subj, delta)
+        DataSource._bump_distinct(self._outlinks, (subj, pred), delta, self._pred_subjects, pred)
+        if not isinstance(obj, rdflib.term.Literal):
+            DataSource._bump(self._indegree, obj, delta)
+            DataSource._bump_distinct(self._inlinks, (obj, pred), delta, self._pred_objects, pred)
+
+    #bump counts[key], and distinct[group] when counts[key] appears or disappears
+    @staticmethod
+    def _bump_distinct(counts, key, delta, distinct, group):
+        before = counts.get(key, 0)
+        DataSource._bump(counts, key, delta)
+        after = counts.get(key, 0)
+        if before == 0 and after > 0:
+            DataSource._bump(distinct, group, 1)
+        elif before > 0 and after == 0:
+            DataSource._bump(distinct, group, -1)
+
+    def _add_triple(self, triple):
+        if triple in self._graph:
+            return
+        self._graph.add(triple)
+        self._count_triple(triple, 1)
+
+    #pattern may contain None wildcards, like Graph.remove()
+    def _remove_pattern(self, pattern):
+        for triple in list(self._graph.triples(pattern)):
+            self._graph.remove(triple)
+            self._count_triple(triple, -1)
+
+    @staticmethod
+    def _as_ref(uri):
+        if isinstance(uri, rdflib.term.Identifier):
+            return uri
+        return rdflib.term.URIRef(uri)
+
+    #Prepared SPARQL templates.  Each query template is parsed once per DataSource (once per keyidentifier, where the
+    #keyidentifier is part of the template) and URIs or literals are passed in as initBindings, never spliced into the text.
+    #Compile and exec time are recorded per template, see query_stats().
+    #rdfextras joins triple patterns in textual order, so before parsing, the patterns are reordered by estimated
+    #selectivity (see _plan()).  A template gets one plan per set of bound variables; explain() shows it, and with EXPLAIN
+    #set (deduper.py -e), every template is explained the first time it runs, or runs again after log_query_stats(reset=True).
+    EXPLAIN = False
+
+    def _prepare(self, name, text, initNs=None, bound=()):
+        key = (name, bound)
+        query = self._prepared.get(key)
+        if query is None:
+            start = time.time()
+            plan = self._plan(text, initNs, bound)
+            self._plans[key] = plan
+            query = rdfextras.sparql.parser.parse(plan['text'])
+            self._prepared[key] = query
+            self._stats_for(name)['compile'] += time.time() - start
+        return query
+
+    def _query(self, name, text, initNs=None, initBindings=None):
+        query = self._prepare(name, text, initNs, tuple(sorted(initBindings or {})))
+        bindings = {}
+        if initBindings is not None:
+            for var, value in initBindings.items():
+                bindings[rdflib.term.Variable(var)] = value
+        start = time.time()
+        result = self._graph.query(query, initNs = dict(initNs or {}), initBindings = bindings)
+        stats = self._stats_for(name)
+        stats['exec'] += time.time() - start
+        stats['calls'] += 1
+        if DataSource.EXPLAIN and stats['calls'] == 1:
+            self.explain(name, initBindings)
+        return result
+
+    def _stats_for(self, name):
+        if name not in self._query_stats:
+            self._query_stats[name] = {'compile': 0.0, 'exec': 0.0, 'calls': 0}
+        return self._query_stats[name]
+
+    #seconds spent compiling and executing each query template, keyed on template name
+    def query_stats(self):
+        return self._query_stats
+
+    #log query_stats(); with reset, count afresh from here, so that each stage logs the queries it ran
+    def log_query_stats(self, reset=False):
+        for name in sorted(self._query_stats):
+            stats = self._query_stats[name]
+            logging.info("query %s: %d calls, compile %.3fs, exec %.3fs", name, stats['calls'], stats['compile'], stats['exec'])
+        if reset:
+            self._query_stats = {}
+
+    _TOKEN = re.compile(r'<[^>]*>|"(?:[^"\\]|\\.)*"(?:@[\w-]+|\^\^[^\s{}().;,]+)?|[{}().;,]|[^\s{}().;,]+')
+
+    #Order the basic graph pattern of a query's WHERE clause: repeatedly pick the pattern with the lowest estimated
+    #row count, preferring patterns that share a variable with those already picked, so that bound variables flow into
+    #the next join.  OPTIONAL and FILTER blocks keep their order after the plain patterns.  A query the parser below
+    #doesn't understand (UNION, nested groups, blank nodes...) is left in textual order.
+    #Returns dict(text, steps, reordered), where steps lists (pattern, terms, estimate) in evaluation order.
+    def _plan(self, text, initNs=None, bound=()):
+        plan = dict(text = text, steps = [], reordered = False)
+        where = re.search(r'WHERE\s*\{', text, re.IGNORECASE)
+        if where is None:
+            return plan
+        tokens = [(m.group(0), m.start()) for m in DataSource._TOKEN.finditer(text, where.end() - 1)]
+        depth = 0
+        for end, (token, pos) in enumerate(tokens):
+            depth += {'{': 1, '}': -1}.get(token, 0)
+            if depth == 0:
+                break
+        else:
+            return plan
+        group = DataSource._parse_group([token for token, pos in tokens[1:end]])
+        if group is None:
+            return plan
+        patterns, tail = group
+        prefixes = dict(rdf = self.RDF, rdfs = self.RDFS, foaf = self.FOAF, bibo = self.BIBO, vivo = self.VIVO)
+        prefixes.update(initNs or {})
+        try:
+            resolved = [tuple(self._resolve(token, prefixes) for token in pattern) for pattern in patterns]
+        except (KeyError, ValueError):
+            return plan
+
+        known = set(rdflib.term.Variable(var) for var in bound)
+        remaining = range(len(patterns))
+        for n in range(len(patterns)):
+            def cost(i):
+                variables = [t for t in resolved[i] if isinstance(t, rdflib.term.Variable)]
+                connected = not known or not variables or any(t in known for t in variables)
+                return (not connected, self._estimate(resolved[i], known), i)
+            best = min(remaining, key=cost)
+            remaining.remove(best)
+            plan['steps'].append((" ".join(patterns[best]), resolved[best], self._estimate(resolved[best], known)))
+            known.update(t for t in resolved[best] if isinstance(t, rdflib.term.Variable))
+        for block in tail:
+            plan['steps'].append((block, None, None))
+
+        body = "".join(step[0] + (" . " if step[1] is not None else " ") for step in plan['steps'])
+        plan['text'] = text[:tokens[0][1] + 1] + " " + body + text[tokens[end][1]:]
+        plan['reordered'] = True
+        return plan
+
+    #split the tokens of a group into triple patterns (expanding ; and , abbreviations) and OPTIONAL/FILTER blocks
+    @staticmethod
+    def _parse_group(tokens):
+        patterns = []
+        tail = []
+        i = 0
+        try:
+            while i < len(tokens):
+                token = tokens[i]
+                if token == '.':
+                    i += 1
+                elif token.upper() in ('OPTIONAL', 'FILTER'):
+                    opener = tokens[i + 1] if token.upper() == 'OPTIONAL' else '('
+                    closer = {'{': '}', '(': ')'}[opener]
+                    j = tokens.index(opener, i)
+                    depth = 0
+                    while True:
+                        depth += {opener: 1, closer: -1}.get(tokens[j], 0)
+                        if depth == 0:
+                            break
+                        j += 1
+                    tail.append(" ".join(tokens[i:j + 1]))
+                    i = j + 1
+                else:
+                    subject = token
+                    i += 1
+                    while True:
+                        predicate = tokens[i]
+                        i += 1
+                        while True:
+                            patterns.append((subject, predicate, tokens[i]))
+                            i += 1
+                            if i < len(tokens) and tokens[i] == ',':
+                                i += 1
+                                continue
+                            break
+                        if i < len(tokens) and tokens[i] == ';':
+                            i += 1
+                            if i < len(tokens) and tokens[i] != '.':
+                                continue
+                        break
+        except (IndexError, KeyError, ValueError):
+            return None
+        for pattern in patterns:
+            for token in pattern:
+                if token in '{}().;,' or token.upper() in ('OPTIONAL', 'FILTER', 'UNION', 'GRAPH', 'MINUS') or token.startswith('_:') or token == '[':
+                    return None
+        return patterns, tail
+
+    def _resolve(self, token, prefixes):
+        if token[0] in '?$':
+            return rdflib.term.Variable(token[1:])
+        if token == 'a':
+            return self.RDF['type']
+        if token.startswith('<'):
+            return rdflib.term.URIRef(token[1:-1])
+        if token.startswith('"'):
+            close = token.rindex('"')
+            value = token[1:close]
+            suffix = token[close + 1:]
+            if suffix.startswith('@'):
+                return rdflib.term.Literal(value, lang=suffix[1:])
+            if suffix.startswith('^^'):
+                return rdflib.term.Literal(value, datatype=self._resolve(suffix[2:], prefixes))
+            return rdflib.term.Literal(value)
+        prefix, local = token.split(':', 1)
+        return prefixes[prefix][local]
+
+    #estimated rows produced by one pattern, for each row of the patterns before it (whose variables are known)
+    def _estimate(self, terms, known):
+        subj, pred, obj = [t if not isinstance(t, rdflib.term.Variable) or t in known else None for t in terms]
+        if pred is None:
+            n = float(len(self._graph))
+            if subj is not None:
+                n /= max(len(self._outdegree), 1)
+            if obj is not None:
+                n /= max(len(self._indegree), 1)
+            return n
+        if pred == self.RDF['type'] and obj is not None:
+            n = float(self._types.get(obj, 0))
+            if subj is not None:
+                n = min(n, 1.0)
+            return n
+        n = float(self._predicates.get(pred, 0))
+        if subj is not None:
+            n /= max(self._pred_subjects.get(pred, 0), 1)
+        if obj is not None:
+            if self._pred_objects.get(pred, 0):
+                n /= self._pred_objects[pred]
+            else:
+                n = min(n, 1.0)
+        return n
+
+    #Show the plan of a query template that has been run, with the estimated and the actual number of rows after each
+    #join (evaluated natively over the graph, with the given initBindings).  The lines are logged and returned.
+    def explain(self, name, initBindings=None):
+        bindings = initBindings or {}
+        plan = self._plans.get((name, tuple(sorted(bindings))))
+        if plan is None:
+            raise DataSourceException("no plan for query "+name+" with bindings "+str(sorted(bindings))+"; run the query first")
+        lines = ["query %s (%s)" % (name, "reordered by selectivity" if plan['reordered'] else "textual order")]
+        rows = [dict((rdflib.term.Variable(var), value) for var, value in bindings.items())]
+        for text, terms, estimate in plan['steps']:
+            if terms is None:
+                lines.append("  %s  (left to rdfextras)" % text)
+            else:
+                rows = self._join(rows, terms)
+                lines.append("  %s  est %.1f, rows %d" % (text, estimate, len(rows)))
+        if not plan['steps']:
+            lines.append("  " + " ".join(plan['text'].split()))
+        for line in lines:
+            logging.info(line)
+        return lines
+
+    def _join(self, rows, terms):
+        joined = []
+        for row in rows:
+            pattern = [row.get(t, t) if isinstance(t, rdflib.term.Variable) else t for t in terms]
+            for triple in self._graph.triples(tuple(None if isinstance(t, rdflib.term.Variable) else t for t in pattern)):
+                extended = dict(row)
+                for term, value in zip(pattern, triple):
+                    if isinstance(term, rdflib.term.Variable):
+                        if extended.setdefault(term, value) != value:
+                            break
+                else:
+                    joined.append(extended)
+        return joined
 
     def serialize(self, filename):
         try:
@@ -91,12 +448,193 @@ class DataSource:
             logging.getLogger(__name__).exception("there was a problem saving "+filename+": "+str(e))
             raise DataSourceException("there was a problem saving "+filename+": "+str(e))
 
+    #A content hash of the graph: the sha1 of its triples as sorted N-Triples lines, so it doesn't depend on how the
+    #graph was parsed or serialized.  Blank node labels are not canonicalized.
+    def digest(self):
+        return DataSource.digest_triples(self._graph)
+
+    @staticmethod
+    def digest_triples(triples):
+        sha = hashlib.sha1()
+        for line in sorted(u"%s %s %s .\n" % (subj.n3(), pred.n3(), obj.n3()) for subj, pred, obj in triples):
+            sha.update(line.encode('utf-8'))
+        return sha.hexdigest()
+
+    #uid -> [pubs] for every pub with a keyidentifier, in one scan.  Like getPublicationPMID() and stream_duplicates(), the
+    #lowest uid of a pub with several counts, whatever the order of the graph.
+    def pubs_by_uid(self, keyidentifier="bibo:pmid"):
+        uids = {}
+        for (pub, uid) in self._graph.subject_objects(self._predicate(keyidentifier)):
+            if str(pub) not in uids or str(uid) < uids[str(pub)]:
+                uids[str(pub)] = str(uid)
+        pubs = {}
+        for pub, uid in uids.items():
+            pubs.setdefault(uid, []).append(pub)
+        return pubs
+
+    #Parse inputfile (RDF/XML) and hand every triple to callback as it is parsed, without building a graph, so a harvest
+    #too big for memory can still be scanned.
+    @staticmethod
+    def stream(inputfile, callback):
+        try:
+            RDFXMLParser().parse(create_input_source(source=inputfile), _TripleSink(callback))
+        except Exception:
+            logging.getLogger(__name__).exception("there was a problem streaming "+inputfile)
+            raise DataSourceException("there was a problem streaming "+inputfile)
+
+    #The duplicate pubs of inputfile, found in one streaming pass (see stream()) and two external sorts (see extsort.py)
+    #rather than by loading the graph: at most budget records are held in memory, the rest is spilled to tmpdir.
+    #The first sort brings the uid and the authorships of each pub together, the second the pubs of each uid.
+    #Yields (uid, [(pub, number of authorships)]) for every uid with more than one pub, in order of uid and pub, and
+    #counts every pub with a uid in stats['pubs'].  Like pubs_by_uid(), only the lowest uid of a pub counts.
+    @staticmethod
+    def stream_duplicates(inputfile, keyidentifier="bibo:pmid", budget=ExternalSorter.BUDGET, tmpdir=None, stats=None):
+        keypred = DataSource()._predicate(keyidentifier)
+        shippred = DataSource.VIVO['informationResourceInAuthorship']
+        bypub = ExternalSorter(budget, tmpdir)
+        byuid = ExternalSorter(budget, tmpdir)
+        def collect((subj, pred, obj)):
+            if pred == keypred:
+                bypub.add((subj, u'0', obj))
+            elif pred == shippred:
+                bypub.add((subj, u'1', obj))
+        try:
+            DataSource.stream(inputfile, collect)
+            logging.info("%d pub records streamed from %s", bypub.count, inputfile)
+            for pub, records in itertools.groupby(bypub, lambda record: record[0]):
+                uid = None
+                authorships = set()
+                for (_, kind, value) in records:
+                    if kind == u'0':
+                        if uid is None:
+                            uid = value
+                    else:
+                        authorships.add(value)
+                if uid is not None:
+                    byuid.add((uid, pub, len(authorships)))
+            bypub.close()
+            if stats is not None:
+                stats['pubs'] = byuid.count
+            for uid, records in itertools.groupby(byuid, lambda record: record[0]):
+                pubs = [(str(pub), int(count)) for (_, pub, count) in records]
+                if len(pubs) > 1:
+                    yield (str(uid), pubs)
+        finally:
+            bypub.close()
+            byuid.close()
+
+    #the links from a person or venue back to the pubs it is part of; the closure of a pub only keeps those to its own nodes
+    BACKLINKS = (VIVO['authorInAuthorship'], VIVO['collaboratorInCollaboration'], VIVO['publicationVenueFor'])
+
+    #the individuals that make up pubs in the graph: the pubs, their date time values, authorships and collaborations, the
+    #persons linked to those, and their venues (what removePublication() removes, and the persons and venues it unlinks)
+    def pub_nodes(self, pubs):
+        nodes = set()
+        for pub in pubs:
+            pub = DataSource._as_ref(pub)
+            nodes.add(pub)
+            nodes.update(self._graph.objects(pub, self.VIVO['dateTimeValue']))
+            links = set(self._graph.objects(pub, self.VIVO['informationResourceInAuthorship']))
+            links.update(self._graph.objects(pub, self.VIVO['informationResourceInCollaboration']))
+            links.update(self._graph.subjects(self.VIVO['linkedInformationResource'], pub))
+            links.update(self._graph.subjects(self.VIVO['linkedInformationResourceForCollaboration'], pub))
+            for link in links:
+                nodes.add(link)
+                nodes.update(self._graph.objects(link, self.VIVO['linkedAuthor']))
+                nodes.update(self._graph.objects(link, self.VIVO['linkedCollaborator']))
+            nodes.update(self._graph.objects(pub, self.VIVO['hasPublicationVenue']))
+            nodes.update(self._graph.subjects(self.VIVO['publicationVenueFor'], pub))
+        return nodes
+
+    #the triples about nodes (see pub_nodes()), except the BACKLINKS of a shared person or venue to other pubs
+    def closure_triples(self, nodes):
+        triples = set()
+        for node in nodes:
+            for (subj, pred, obj) in self._graph.triples((node, None, None)):
+                if pred in DataSource.BACKLINKS and obj not in nodes:
+                    continue
+                triples.add((subj, pred, obj))
+        return triples
+
+    #uid -> digest of the closure of the pubs with that uid, so a later harvest can tell which pubs are new or changed
+    def pub_signatures(self, keyidentifier="bibo:pmid"):
+        signatures = {}
+        for uid, pubs in self.pubs_by_uid(keyidentifier).items():
+            signatures[uid] = DataSource.digest_triples(self.closure_triples(self.pub_nodes(pubs)))
+        return signatures
+
+    #The pubs of the graph, split into connected components: two pubs are connected if they share a uid, or any of their
+    #pub_nodes() (a person, a venue...).  Found by union-find, in one pass over the pubs.  Returns lists of pub uris (str),
+    #largest first.
+    def connected_components(self, keyidentifier="bibo:pmid"):
+        parent = {}
+        def find(node):
+            root = node
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            while parent[node] != root:
+                parent[node], node = root, parent[node]
+            return root
+        pubs = []
+        for uid, uidpubs in self.pubs_by_uid(keyidentifier).items():
+            for pub in uidpubs:
+                pub = DataSource._as_ref(pub)
+                pubs.append(pub)
+                for node in [('uid', uid)] + list(self.pub_nodes([pub])):
+                    (a, b) = (find(pub), find(node))
+                    if a != b:
+                        parent[a] = b
+        components = {}
+        for pub in pubs:
+            components.setdefault(find(pub), []).append(str(pub))
+        return sorted(components.values(), key=len, reverse=True)
+
+    #Split the graph into at most n shards that can be deduped independently, and merged back by adding their triples up.
+    #With components=True each shard is a set of connected_components(), so nothing a stage looks at crosses shards.
+    #With components=False pubs are only kept together per uid, which balances better when a few people or venues connect
+    #most pubs: a person or venue shared by pubs of several shards is then copied to each, with its links to that shard's
+    #pubs (see closure_triples()).  Components are dealt out largest first to the smallest shard.
+    #Returns the shards, as sets of triples, and the rest: the triples that aren't part of any pub.
+    def partition(self, n, keyidentifier="bibo:pmid", components=True):
+        if components:
+            groups = self.connected_components(keyidentifier)
+        else:
+            groups = list(self.pubs_by_uid(keyidentifier).values())
+        groups = sorted(((self.pub_nodes(group), group) for group in groups), key=lambda (nodes, group): len(nodes), reverse=True)
+        shards = [set() for i in range(n)]
+        for (nodes, group) in groups:
+            min(shards, key=len).update(nodes)
+        shards = [self.closure_triples(nodes) for nodes in shards if nodes]
+        rest = set(self._graph)
+        for shard in shards:
+            rest.difference_update(shard)
+        return shards, rest
+
+    #a new DataSource of triples, e.g. shards merged back, with the namespace prefixes of another graph
+    @staticmethod
+    def from_triples(triples, namespaces=()):
+        datasource = DataSource()
+        for (prefix, namespace) in namespaces:
+            datasource._graph.bind(prefix, namespace)
+        datasource.add_triples(triples)
+        return datasource
+
+    def namespaces(self):
+        return list(self._graph.namespaces())
+
+    def add_triples(self, triples):
+        for triple in triples:
+            self._add_triple(triple)
+
+    def remove_triples(self, triples):
+        for triple in triples:
+            self._remove_pattern(triple)
+
     def remove(self, subj, pred, obj):  
         #logging.debug('remove(): removing (%s, %s, %s)', DataSource.pretty_print_rdf_term(subj), pred, DataSource.pretty_print_rdf_term(obj))
         try:
-            logging.getLogger(__name__).debug("len graph: "+str(len(self._graph)))        
-            self._graph.remove((subj, pred, obj))
-            logging.getLogger(__name__).debug("after remove, len graph: "+str(len(self._graph)))
+            self._tracer.trace('remove', '(%s, %s, %s)', subj, pred, obj)
+            self._remove_pattern((subj, pred, obj))
         except Exception as e:
             logging.getLogger(__name__).exception("there was a problem removing. "+str(e))
             raise DataSourceException("there was a problem removing. "+str(e))
@@ -104,9 +642,8 @@ class DataSource:
     def add(self, subj, pred, obj):
         #logging.debug('add(): adding (%s, %s, %s)', DataSource.pretty_print_rdf_term(subj), pred, DataSource.pretty_print_rdf_term(obj))
         try:
-            logging.getLogger(__name__).debug("len graph: "+str(len(self._graph)))
-            self._graph.add((subj, pred, obj))
-            logging.getLogger(__name__).debug("after add, len graph: "+str(len(self._graph)))
+            self._tracer.trace('add', '(%s, %s, %s)', subj, pred, obj)
+            self._add_triple((subj, pred, obj))
         except Exception as e:
             logging.getLogger(__name__).exception("there was a problem adding. "+str(e))
             raise DataSourceException("there was a problem adding. "+str(e))
@@ -114,21 +651,19 @@ class DataSource:
     def removeItem(self, uri, force = False):
         # Make sure allowed ref count
         if (not force) and (self.objReferenceCount(uri) > 0):
-            logging.warn("removeItem(): I cannot remove "+VivoUri.extractNfromUri(uri)+" as it's referenced as an object in some triple...")
+            logging.warn("removeItem(): I cannot remove %s as it's referenced as an object in some triple...", uri)
             return
 
-        logging.info('removeItem(): removing item ' + VivoUri.extractNfromUri(uri) + ' with obj ref count '+ str(self.objReferenceCount(uri)) + ', subj ref count '+str(self.subReferenceCount(uri))) 
-        self._graph.remove((uri,None,None))
-        self._graph.remove((None, None, uri))
+        self._tracer.trace('removeItem', 'removing item %s with obj ref count %d, subj ref count %d', uri, self.objReferenceCount(uri), self.subReferenceCount(uri))
+        self._remove_pattern((uri,None,None))
+        self._remove_pattern((None, None, uri))
         
         
     def subReferenceCount(self, uri):
-        result = len(list(self._graph.objects(uri,None)))
-        return result
+        return self._outdegree.get(DataSource._as_ref(uri), 0)
 
     def objReferenceCount(self, uri):
-        result = len(list(self._graph.subjects(None, uri)))
-        return result
+        return self._indegree.get(DataSource._as_ref(uri), 0)
         
 #the following few methods have a different naming convention (lower case underscore) because I'd like vivodata to follow their example.
 #vivodata should work at a higher level of abstraction, that is, not have several add and remove methods for each Vivo Class URI
@@ -181,7 +716,7 @@ class DataSource:
             return
         logging.debug("original graph: "+str(len(self._graph)))
         for trip in g:
-            self._graph.remove(trip)
+            self._remove_pattern(trip)
         logging.debug("after removes, graph: "+str(len(self._graph)))
     
     
@@ -190,25 +725,30 @@ class DataSource:
             return self._graph
         else:
             logging.debug("trying to select statements about "+str(len(dict_of_individuals))+" individuals from graph")
-        g= Graph()
-        for individual in dict_of_individuals:
-            q ="""CONSTRUCT {{
-                <{0}> ?p ?o .
-                ?a ?b <{0}> .
-            }}
-            WHERE {{
-                <{0}> ?p ?o .
-                ?a ?b <{0}> .
-            }}
-            """.format(VivoUri.encodeNasUri(domain, individual))        
-            try:
-                results = self._graph.query(q)
-            except Exception as e:
-                logging.error("there was a problem with the SPARQL query "+q+": "+str(e))
-                return self._graph
-            #learn: note use of graph union operator
-            g = g + results.graph
-        return g
+        uris = [VivoUri.encodeNasUri(domain, individual) for individual in dict_of_individuals]
+        return self.extract_subgraph(uris)
+
+    #Collect every inbound and outbound triple of the individuals in one pass over the graph indexes.
+    #The triples are added to target (a new Graph if none is passed in), or, if stream is an open file, written to it as N-Triples
+    #so the subgraph is never held in memory.  A triple linking two of the individuals is emitted once.
+    def extract_subgraph(self, uris, target=None, stream=None):
+        refs = set(DataSource._as_ref(uri) for uri in uris)
+        if stream is None and target is None:
+            target = Graph()
+        for ref in refs:
+            for triple in self._graph.triples((ref, None, None)):
+                self._emit_triple(triple, target, stream)
+            for triple in self._graph.triples((None, None, ref)):
+                if triple[0] not in refs:
+                    self._emit_triple(triple, target, stream)
+        return target
+
+    @staticmethod
+    def _emit_triple(triple, target, stream):
+        if stream is not None:
+            stream.write((u"%s %s %s .\n" % (triple[0].n3(), triple[1].n3(), triple[2].n3())).encode("utf-8"))
+        else:
+            target.add(triple)
     
     #todo:  make this work.  I.e., figure out why the sparqlqueryresult can't be iterated over / what use the describe query is
     def describe_individuals(self, dict_of_individuals, domain):
@@ -235,12 +775,12 @@ class DataSource:
         if indiv_uri_string=="":
             return False
         q ="""SELECT *
-        WHERE {{
-            <{0}> ?p ?o .
-        }}
-        """.format(indiv_uri_string)
+        WHERE {
+            ?indiv ?p ?o .
+        }
+        """
         try:
-            results = self._graph.query(q)
+            results = self._query("individual_is_present", q, initBindings = dict(indiv = rdflib.term.URIRef(indiv_uri_string)))
             #print "graph has "+str(len(self._graph))+" elements"
             #print "subgraph has "+str(len(results))+" elements"
         except Exception as e:
@@ -263,11 +803,11 @@ class DataSource:
                 raise DataSourceException("couldn't assign a unique id to "+label)
         #assign a label and class URI to this resource within this DataSource, return the indiv URI...
         #todo: don't encapsulate URIRef and Literal datatypes using vivodata, in all cases just use the rdflib ones
-        self._graph.add((rdflib.term.URIRef(indiv_uri_string), self.RDFS['label'], rdflib.term.Literal(label)))
+        self._add_triple((rdflib.term.URIRef(indiv_uri_string), self.RDFS['label'], rdflib.term.Literal(label)))
         prefix = class_uri.rsplit(":",1)[0].lower()
         type = class_uri.rsplit(":",1)[1]
         #print self.nsmanager.ns[prefix]+type
-        self._graph.add((rdflib.term.URIRef(indiv_uri_string), self.RDF['type'], rdflib.term.URIRef(self.nsmanager.ns[prefix]+type)))
+        self._add_triple((rdflib.term.URIRef(indiv_uri_string), self.RDF['type'], rdflib.term.URIRef(self.nsmanager.ns[prefix]+type)))
         return rdflib.term.URIRef(indiv_uri_string)
     
     #learn: is there any point to having the domain as a param?  should the method add statements about individuals in arbitrary domains to THIS graph?
@@ -280,7 +820,7 @@ class DataSource:
             if len(predparts) != 2:
                 logging.debug("object ok, but predicate string ill formed: "+predicate)
             else:
-                self._graph.add((rdflib.term.URIRef(indiv_uri_string),rdflib.term.URIRef(self.nsmanager.ns[predparts[0].lower()]+predparts[1]), rdflib.term.URIRef(object)))
+                self._add_triple((rdflib.term.URIRef(indiv_uri_string),rdflib.term.URIRef(self.nsmanager.ns[predparts[0].lower()]+predparts[1]), rdflib.term.URIRef(object)))
                 return
         objparts = object.rsplit(":",1)
         if len(objparts)!=2:
@@ -288,13 +828,13 @@ class DataSource:
             if len(predparts) != 2:
                 logging.debug("predicate string ill formed: "+predicate+" obj string ill formed: "+object)
             else:
-                self._graph.add((rdflib.term.URIRef(indiv_uri_string),rdflib.term.URIRef(self.nsmanager.ns[predparts[0].lower()]+predparts[1]), rdflib.term.Literal(unicode(object).encode("utf-8"))))
+                self._add_triple((rdflib.term.URIRef(indiv_uri_string),rdflib.term.URIRef(self.nsmanager.ns[predparts[0].lower()]+predparts[1]), rdflib.term.Literal(unicode(object).encode("utf-8"))))
         else:
             predparts = predicate.rsplit(":",1)
             if len(predparts) != 2:
                 logging.debug("abbreviated object ok, but predicate string ill formed: "+predicate)
             else:
-                self._graph.add((rdflib.term.URIRef(indiv_uri_string),rdflib.term.URIRef(self.nsmanager.ns[predparts[0].lower()]+predparts[1]), rdflib.term.URIRef(self.nsmanager.ns[objparts[0].lower()]+objparts[1])))            
+                self._add_triple((rdflib.term.URIRef(indiv_uri_string),rdflib.term.URIRef(self.nsmanager.ns[predparts[0].lower()]+predparts[1]), rdflib.term.URIRef(self.nsmanager.ns[objparts[0].lower()]+objparts[1])))            
         
     #Some remove methods for different kinds of individuals 
     #The uri argument must be a string that is converted to the correct argument type by calling DataSource.uri_literal_as_ref(stringUri)
@@ -345,10 +885,10 @@ class DataSource:
     def removePublication(self, pub):
     
         if (type(pub) is not rdflib.term.URIRef):
-            logging.warn("warning: uri "+pub+" must be type rdflib.term.URIRef, trying to convert...")
+            logging.warn("warning: uri %s must be type rdflib.term.URIRef, trying to convert...", pub)
             pub = rdflib.term.URIRef(pub)
     
-        logging.debug('removing pub '+pub)
+        self._tracer.trace('removePublication', '%s', pub)
         
         
         # Retrieve Date Time & Wipe it
@@ -381,11 +921,85 @@ class DataSource:
         logging.debug('pub %s removed.  it''s subject reference count is %d', pub, self.subReferenceCount(pub))     
 
     def removePublications(self, pubs):
+        self.remove_publications(pubs)
+
+    #bulk version of removePublication().  One traversal collects every triple to drop for the whole batch of pubs,
+    #the orphan check runs once per candidate node (date-time, venue, author, collaborator), then the graph is edited in one pass.
+    def remove_publications(self, pubs):
+        doomed = set()
+        candidates = set()
         for pub in pubs:
-            self.removePublication(pub)
-            
+            if (type(pub) is not rdflib.term.URIRef):
+                pub = rdflib.term.URIRef(pub)
+            self._collect_item_triples(pub, doomed)
+            candidates.update(self._graph.objects(pub, self.VIVO['dateTimeValue']))
+            candidates.update(self._graph.objects(pub, self.VIVO['hasPublicationVenue']))
+            for ship in self._graph.objects(pub, self.VIVO['informationResourceInAuthorship']):
+                self._collect_link_triples(ship, 'linkedInformationResource', 'linkedAuthor', doomed, candidates)
+            for tion in self._graph.objects(pub, self.VIVO['informationResourceInCollaboration']):
+                self._collect_link_triples(tion, 'linkedInformationResourceForCollaboration', 'linkedCollaborator', doomed, candidates)
+        self._collect_orphan_triples(candidates, doomed)
+        self._remove_triples(doomed)
+
+    #bulk versions of removeAuthorship() and removeCollaboration(), on the same collect-then-remove plan as remove_publications()
+    def remove_authorships(self, uris):
+        self._remove_links(uris, 'linkedInformationResource', 'linkedAuthor')
+
+    def remove_collaborations(self, uris):
+        self._remove_links(uris, 'linkedInformationResourceForCollaboration', 'linkedCollaborator')
+
+    def _remove_links(self, uris, pubField, personField):
+        doomed = set()
+        candidates = set()
+        for uri in uris:
+            self._collect_link_triples(DataSource._as_ref(uri), pubField, personField, doomed, candidates)
+        self._collect_orphan_triples(candidates, doomed)
+        self._remove_triples(doomed)
+
+    #all triples in which uri is the subject or the object
+    def _collect_item_triples(self, uri, doomed):
+        doomed.update(self._graph.triples((uri, None, None)))
+        doomed.update(self._graph.triples((None, None, uri)))
+
+    #collect an authorship (or collaboration) with its links.  Its pubs and persons become candidates for the orphan check, as in removeAuthorship()
+    def _collect_link_triples(self, uri, pubField, personField, doomed, candidates):
+        self._collect_item_triples(uri, doomed)
+        candidates.update(self._graph.objects(uri, self.VIVO[pubField]))
+        candidates.update(self._graph.objects(uri, self.VIVO[personField]))
+
+    #a candidate is an orphan if every triple referencing it as an object is already doomed (the removeItem() rule)
+    def _collect_orphan_triples(self, candidates, doomed):
+        for uri in candidates:
+            if not isinstance(uri, rdflib.term.URIRef):
+                continue
+            referenced = False
+            for triple in self._graph.triples((None, None, uri)):
+                if triple not in doomed:
+                    referenced = True
+                    break
+            if not referenced:
+                self._collect_item_triples(uri, doomed)
+
+    def _remove_triples(self, triples):
+        self._tracer.trace('remove_triples', 'removing %d triples', len(triples))
+        for triple in triples:
+            self._remove_pattern(triple)
+
+    #The iter_* methods are generator versions of the query* methods of the same name: rows are yielded one at a time, as lists,
+    #instead of being copied into a table first.  columns optionally projects each row onto some of the selected variables,
+    #given by name (without the ?) or by position, e.g. ds.iter_authorships(columns=('au', 'ship')).
+    @staticmethod
+    def _iter_rows(result, names, columns=None):
+        if columns is None:
+            for row in result:
+                yield list(row)
+        else:
+            positions = [col if isinstance(col, int) else names.index(col) for col in columns]
+            for row in result:
+                yield [row[pos] for pos in positions]
+
     def linkedAuthors(self):
-        result = self._graph.query(
+        result = self._query("linkedAuthors",
             """SELECT DISTINCT ?linkedAuthor
                WHERE {
                 ?linkedAuthor vivo:authorInAuthorship ?authorship .
@@ -402,7 +1016,7 @@ class DataSource:
     
         
     def linkedCollaborators(self):
-        result = self._graph.query(
+        result = self._query("linkedCollaborators",
             """SELECT DISTINCT ?linkedCollaborator
                WHERE {
                 ?linkedCollaborator vivo:collaboratorInCollaboration ?pub .
@@ -419,7 +1033,7 @@ class DataSource:
         
     
     def labeledItems(self):
-        result = self._graph.query(
+        result = self._query("labeledItems",
             """SELECT DISTINCT ?label
                WHERE {
                 ?item rdfs:label ?label
@@ -433,44 +1047,66 @@ class DataSource:
             items.append(str[row[0]])   
         return items
 
+    #(person, pub) -> [authorships] for the pubs given, from one scan of the informationResourceInAuthorship and linkedAuthor edges,
+    #and authorship -> [persons].  An authorship with no linked author is grouped under the person ''.
+    def group_authorships(self, pubs):
+        return self._group_links(pubs, 'informationResourceInAuthorship', 'linkedAuthor')
+
+    def group_collaborations(self, pubs):
+        return self._group_links(pubs, 'informationResourceInCollaboration', 'linkedCollaborator')
+
+    def _group_links(self, pubs, linkField, personField):
+        pubs = set(str(pub) for pub in pubs)
+        persons = {}
+        for (link, person) in self._graph.subject_objects(self.VIVO[personField]):
+            persons.setdefault(str(link), []).append(str(person))
+        groups = {}
+        for (pub, link) in self._graph.subject_objects(self.VIVO[linkField]):
+            pub = str(pub)
+            if pub not in pubs:
+                continue
+            link = str(link)
+            linked = persons.get(link)
+            groups.setdefault((linked[0] if linked else '', pub), []).append(link)
+        return groups, persons
+
     #This sparql works at the endpoint, but not with rdflib!
     def queryAuthorships(self, keyidentifier="bibo:pmid"):
+        return list(self.iter_authorships(keyidentifier))
+
+    def iter_authorships(self, keyidentifier="bibo:pmid", columns=None):
         try:
             sparqlquery = "SELECT ?pmid ?au ?ship WHERE {?pub %s ?pmid . ?pub vivo:informationResourceInAuthorship ?ship . ?ship rdf:type vivo:Authorship . ?ship vivo:linkedAuthor ?au .}" % keyidentifier
-            result = self._graph.query(
+            result = self._query("queryAuthorships:"+keyidentifier,
                 sparqlquery,
-
                 initNs = dict(
                     rdf = self.RDF,
-                    vivo = self.VIVO
+                    vivo = self.VIVO,
+                    bibo = self.BIBO
                 )
             )
         except Exception as e:
             raise DataSourceException (str(e)+": I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
-        ships = []
-        
-        for row in result:
-            cols = []
-            for col in row:
-                cols.append(col)
-            ships.append(cols)
-            
-        return ships
+        return DataSource._iter_rows(result, ('pmid', 'au', 'ship'), columns)
     
     #try to return authorship URIs that relate authorURI to information resource key (a DOI or a PMID)
     def getAuthorToInformationResource(self, authorURI, key, keyidentifier="bibo:pmid"):
         try:
-            sparqlquery = "SELECT ?ship WHERE {?pub %s \"%s\" . ?pub vivo:informationResourceInAuthorship ?ship . ?ship rdf:type vivo:Authorship . ?ship vivo:linkedAuthor <%s> .}" % (keyidentifier, key, authorURI)
-            result = self._graph.query(
+            sparqlquery = "SELECT ?ship WHERE {?pub %s ?key . ?pub vivo:informationResourceInAuthorship ?ship . ?ship rdf:type vivo:Authorship . ?ship vivo:linkedAuthor ?author .}" % keyidentifier
+            result = self._query("getAuthorToInformationResource:"+keyidentifier,
                 sparqlquery,
                 initNs = dict(
                     rdf = self.RDF,
                     vivo = self.VIVO,
                     bibo = self.BIBO
+                ),
+                initBindings = dict(
+                    key = rdflib.term.Literal(key),
+                    author = rdflib.term.URIRef(authorURI)
                 )
             )
         except Exception as e:
-            raise DataSourceException (e+": I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
+            raise DataSourceException (str(e)+": I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
         ships = []
 
         for row in result:
@@ -483,9 +1119,12 @@ class DataSource:
         
   
     def queryCollaborations(self, keyidentifier="bibo:pmid"):
+        return list(self.iter_collaborations(keyidentifier))
+
+    def iter_collaborations(self, keyidentifier="bibo:pmid", columns=None):
         sparqlquery = "SELECT DISTINCT ?pmid ?co ?tion ?rank WHERE {  ?pub %s ?pmid .  ?pub vivo:informationResourceInCollaboration ?tion .  ?tion rdf:type vivo:Collaboration .  ?tion vivo:linkedCollaborator ?co .  ?tion vivo:collaboratorRank ?rank . OPTIONAL {?pub rdf:type bibo:AcademicArticle }  }  ORDER BY ?rank  " % keyidentifier        
         try:
-            result = self._graph.query(
+            result = self._query("queryCollaborations:"+keyidentifier,
                 sparqlquery,
                 initNs = dict(
                     rdf = self.RDF,
@@ -496,20 +1135,15 @@ class DataSource:
         except:
             raise DataSourceException ("I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
         
-        collabs = []
-        
-        for row in result:
-            cols = []
-            for col in row:
-                cols.append(col)
-            collabs.append(cols)
-            
-        return collabs
+        return DataSource._iter_rows(result, ('pmid', 'co', 'tion', 'rank'), columns)
         
     #Unfortunately RdfLib doesn't support BIND(REPLACE(STR(?authorship_label), "Authorship for ", "") AS ?author_as_listed)
     def queryAuthorsAsCited(self):
+        return list(self.iter_authors_as_cited())
+
+    def iter_authors_as_cited(self, columns=None):
         try:
-            result = self._graph.query(
+            result = self._query("queryAuthorsAsCited",
             """SELECT ?author ?author_label ?authorship ?author_as_listed
                 WHERE{
                     ?authorship rdf:type vivo:Authorship .
@@ -528,21 +1162,16 @@ class DataSource:
         except:
             raise DataSourceException ("I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
             
-        authors_as_listed = []
-        
-        for row in result:
-            cols = []
-            for col in row:
-                cols.append(col)
-            authors_as_listed.append(cols)
-            
-        return authors_as_listed
+        return DataSource._iter_rows(result, ('author', 'author_label', 'authorship', 'author_as_listed'), columns)
 
     #return canonical names of faculty, as found in Vivo
     #todo: rename as queryUrisOfType and parameterize on rdf:type e.g. vivo:FacultyMember, foaf:Person
     def queryFacultyNames(self):
+        return list(self.iter_faculty_names())
+
+    def iter_faculty_names(self, columns=None):
         try:
-            result = self._graph.query(
+            result = self._query("queryFacultyNames",
             """SELECT ?author ?author_label
                 WHERE{
                     ?author rdfs:label ?author_label .
@@ -559,20 +1188,15 @@ class DataSource:
         except:
             raise DataSourceException ("I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
             
-        faculty = []
-        
-        for row in result:
-            cols = []
-            for col in row:
-                cols.append(col)
-            faculty.append(cols)
-            
-        return faculty
+        return DataSource._iter_rows(result, ('author', 'author_label'), columns)
 
     #return canonical names of any persons, as found in Vivo
     def queryPersonNames(self):
+        return list(self.iter_person_names())
+
+    def iter_person_names(self, columns=None):
         try:
-            result = self._graph.query(
+            result = self._query("queryPersonNames",
             """SELECT ?author ?author_label
                 WHERE{
                     ?author rdfs:label ?author_label .
@@ -589,24 +1213,19 @@ class DataSource:
         except:
             raise DataSourceException ("I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
             
-        persons = []
-        
-        for row in result:
-            cols = []
-            for col in row:
-                cols.append(col)
-            persons.append(cols)
-            
-        return persons
+        return DataSource._iter_rows(result, ('author', 'author_label'), columns)
         
     #Why have a set of query* functions?  Fulfill supporting roles?  does only reporter.py use them?
     #The function stores a canned query and returns a two-dimensional array (row by column) that 
     #could be rendered as a csv (by reporter.py).  The headers of the data returned are publication,issn,publication venue
     #TODO: think about whether the query* functions could be encapsulated as VivoQuery objects and the header string could then be get/set  
     def queryPublicationsForVenues(self):
+        return list(self.iter_publications_for_venues())
+
+    def iter_publications_for_venues(self, columns=None):
                 
         try:
-            result = self._graph.query(
+            result = self._query("queryPublicationsForVenues",
             """SELECT ?pub ?pvid ?pv
                 WHERE{
                     ?pv bibo:issn ?pvid .
@@ -623,20 +1242,15 @@ class DataSource:
         except:
             raise DataSourceException ("I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
         
-        pubs = []
-       
-        for row in result:
-            cols = []
-            for col in row:
-                cols.append(col)
-            pubs.append(cols)
-            
-        return pubs
+        return DataSource._iter_rows(result, ('pub', 'pvid', 'pv'), columns)
 
     def queryPublicationsForDateTimes(self):
+        return list(self.iter_publications_for_datetimes())
+
+    def iter_publications_for_datetimes(self, columns=None):
                 
         try:
-            result = self._graph.query(
+            result = self._query("queryPublicationsForDateTimes",
             """SELECT ?pub ?pmid ?dt
                 WHERE{
                     ?pub vivo:dateTimeValue ?dte .
@@ -654,81 +1268,24 @@ class DataSource:
         except:
             raise DataSourceException ("I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
         
-        pubs = []
-       
-        for row in result:
-            cols = []
-            for col in row:
-                cols.append(col)
-            pubs.append(cols)
-            
-        return pubs
-        
-        
-        
-    #find publication with more than one venue per publication, and return publications.  For example, used by deduper.py.  This query only works at the fuseki endpoint, otherwise rdflib ignores the filter and the function returns the same results as queryVenues()... 
-    def getPubsWithDuplicateVenues(self):
-                
-        try:
-            result = self._graph.query(
-            """SELECT DISTINCT ?pub
-                WHERE{
-                    ?pv bibo:issn ?pvid .
-                    ?pv vivo:publicationVenueFor ?pub . 
-                    OPTIONAL {?pub rdf:type bibo:AcademicArticle }
-                }
-                GROUP BY ?pub
-                HAVING (COUNT(?pv) > 1)
-                """,
-                initNs = dict(
-                    rdf = self.RDF,
-                    bibo = self.BIBO,
-                    vivo = self.VIVO,
-                    foaf = self.FOAF
-                )
-            )
-        except:
-            raise DataSourceException ("I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
-        
-        pubs = []
-        
-        for row in result:
-            pubs.append(str(row[0]))
-            
-        return pubs   
+        return DataSource._iter_rows(result, ('pub', 'pmid', 'dt'), columns)
 
-     
         
-    def getAuthorPubsWithDuplicateAuthorships(self, keyidentifier="bibo:pmid"):
-        sparqlquery = "SELECT ?au ?pub  WHERE{  ?pub %s ?pmid ;  vivo:informationResourceInAuthorship ?ship .  ?ship rdf:type vivo:Authorship ;  vivo:linkedAuthor ?au .  OPTIONAL {?au rdf:type foaf:Agent} .  OPTIONAL {?pub rdf:type bibo:AcademicArticle }  }  GROUP BY ?au ?pub  HAVING (COUNT(?ship)  > 1)  " % keyidentifier        
-        try:
-            result = self._graph.query(
-            sparqlquery,
-                initNs = dict(
-                    rdf = self.RDF,
-                    bibo = self.BIBO,
-                    vivo = self.VIVO,
-                    foaf = self.FOAF
-                )
-            )
-        except:
-            raise DataSourceException ("I couldn't parse this SPARQL query.  You could try to get more information on the problem by querying against a live Vivo endpoint.")
         
-        authorpubs = []
-        
-        for row in result:
-            cols = []
-            for col in row:
-                cols.append(col)
-            authorpubs.append(cols)
-            
-        return authorpubs    
-        
-    
         
+    #expand a qname such as "bibo:pmid" (the form keyidentifier takes) with the namespaces declared above
+    def _predicate(self, predicate):
+        if isinstance(predicate, rdflib.term.URIRef):
+            return predicate
+        prefix, local = predicate.split(':', 1)
+        namespaces = dict(rdf = self.RDF, rdfs = self.RDFS, foaf = self.FOAF, bibo = self.BIBO, vivo = self.VIVO)
+        if prefix not in namespaces:
+            raise DataSourceException("unknown prefix in "+predicate)
+        return namespaces[prefix][local]
+
     def getPublicationURIs(self, keyidentifier="bibo:pmid"):
         sparqlquery = "SELECT ?pub WHERE {  ?pub %s ?uid . OPTIONAL { ?pub rdf:type bibo:AcademicArticle } } ORDER BY ?uid " % keyidentifier
-        result = self._graph.query(
+        result = self._query("getPublicationURIs:"+keyidentifier,
                 sparqlquery,
                 initNs = dict(
                     bibo = self.BIBO,
@@ -742,13 +1299,14 @@ class DataSource:
         
     #doesn't assume exactly one VIVO URI per publication UID.
     def getPublicationURI(self, key, keyidentifier="bibo:pmid"):
-        sparqlquery = "SELECT ?pub WHERE {  ?pub %s \"%s\" . OPTIONAL { ?pub rdf:type bibo:AcademicArticle } } " % (keyidentifier, key)
-        result = self._graph.query(
+        sparqlquery = "SELECT ?pub WHERE {  ?pub %s ?key . OPTIONAL { ?pub rdf:type bibo:AcademicArticle } } " % keyidentifier
+        result = self._query("getPublicationURI:"+keyidentifier,
                 sparqlquery,
                 initNs = dict(
                     bibo = self.BIBO,
                     rdf = self.RDF 
-                )
+                ),
+                initBindings = dict(key = rdflib.term.Literal(key))
             )
         uris = []
 
@@ -798,6 +1356,38 @@ class DataSource:
             logging.debug('no change to current collaborator')
     
     
+    #Bulk versions of changeAuthorship() and changeCollaboration(): changes is a sequence of (authorshipUri, newAuthorUri, label)
+    #(or collaboration, collaborator, label) tuples.  All the links are rewritten first, then each previous author
+    #(collaborator) that is no longer referenced is removed, in one orphan check at the end.  Returns the number relinked.
+    def change_authorships(self, changes):
+        return self._change_links(changes, self.VIVO['linkedAuthor'], self.VIVO['authorInAuthorship'])
+
+    def change_collaborations(self, changes):
+        return self._change_links(changes, self.VIVO['linkedCollaborator'], self.VIVO['collaboratorInCollaboration'])
+
+    def _change_links(self, changes, linkPred, inversePred):
+        previous = set()
+        changed = 0
+        for uri, newUri, label in changes:
+            uri = DataSource._as_ref(uri)
+            newUri = DataSource._as_ref(newUri)
+            current = next(self._graph.objects(uri, linkPred), None)
+            if current == newUri:
+                continue
+            self._add_triple((uri, self.RDFS['label'], label if label is not None else rdflib.term.Literal('')))
+            self._add_triple((uri, linkPred, newUri))
+            self._add_triple((newUri, inversePred, uri))
+            if current is not None:
+                self._remove_pattern((uri, linkPred, current))
+                self._remove_pattern((current, inversePred, uri))
+                previous.add(current)
+            changed += 1
+        logging.info("relinked %d %s links, checking %d previous persons for orphans", changed, linkPred, len(previous))
+        for person in previous:
+            if self.objReferenceCount(person) == 0:
+                self.removeItem(person)
+        return changed
+
     #this differs from changeCollaboration because the current uri to be changed is passed in  
     def changePublicationVenue(self, publicationUri, currentPubVenueUri, newPubVenueUri):
         logging.debug('changing venue for publication... ')
@@ -892,7 +1482,7 @@ class DataSource:
     
 
     def removeAuthorFromAuthorship(self, authorshipUri, authorUri):
-        logging.debug('removing author ('+VivoUri.extractNfromUri(authorUri)+') from authorship('+VivoUri.extractNfromUri(authorshipUri)+')')
+        self._tracer.trace('unlink', 'removing author (%s) from authorship (%s)', authorUri, authorshipUri)
         self.remove(
             authorshipUri,
             self.VIVO['linkedAuthor'],
@@ -900,7 +1490,7 @@ class DataSource:
         )
 
     def removeAuthorshipFromAuthor(self, authorUri, authorshipUri):
-        logging.debug('removing authorship ('+VivoUri.extractNfromUri(authorshipUri)+') from author('+VivoUri.extractNfromUri(authorUri)+')')
+        self._tracer.trace('unlink', 'removing authorship (%s) from author (%s)', authorshipUri, authorUri)
         self.remove(
             authorUri,
             self.VIVO['authorInAuthorship'],
@@ -908,7 +1498,7 @@ class DataSource:
         )    
         
     def removeCollaboratorFromCollaboration(self, collaborationUri, collaboratorUri):
-        logging.debug('removing collaborator ('+VivoUri.extractNfromUri(collaboratorUri)+') from collaboration('+VivoUri.extractNfromUri(collaborationUri)+')')
+        self._tracer.trace('unlink', 'removing collaborator (%s) from collaboration (%s)', collaboratorUri, collaborationUri)
         self.remove(
             collaborationUri,
             self.VIVO['linkedCollaborator'],
@@ -916,7 +1506,7 @@ class DataSource:
         )
         
     def removeCollaborationFromCollaborator(self, collaboratorUri, collaborationUri):
-        logging.debug('removing collaboration('+VivoUri.extractNfromUri(collaborationUri)+') from collaborator ('+VivoUri.extractNfromUri(collaboratorUri)+ ')')
+        self._tracer.trace('unlink', 'removing collaboration (%s) from collaborator (%s)', collaborationUri, collaboratorUri)
         self.remove(
             collaboratorUri,
             self.VIVO['collaboratorInCollaboration'],
@@ -924,7 +1514,7 @@ class DataSource:
         )
         
     def removeVenueFromPublication(self, pubUri, venueUri):
-        logging.debug('removing venue ('+VivoUri.extractNfromUri(venueUri)+') from pub ('+VivoUri.extractNfromUri(pubUri)+')')        
+        self._tracer.trace('unlink', 'removing venue (%s) from pub (%s)', venueUri, pubUri)
         self.remove(
             pubUri,
             self.VIVO['hasPublicationVenue'],
@@ -933,7 +1523,7 @@ class DataSource:
 
     
     def removePublicationFromVenue(self, venueUri, pubUri):
-        logging.debug('removing pub ('+VivoUri.extractNfromUri(pubUri)+') from venue ('+VivoUri.extractNfromUri(venueUri)+')') 
+        self._tracer.trace('unlink', 'removing pub (%s) from venue (%s)', pubUri, venueUri)
         self.remove(
             venueUri,
             self.VIVO['publicationVenueFor'],
@@ -941,7 +1531,7 @@ class DataSource:
         )   
 
     def removePubFromCollaboration(self, collabUri, pubUri):
-        logging.debug("removing pub ("+VivoUri.extractNfromUri(pubUri)+") from collaboration ("+VivoUri.extractNfromUri(collabUri)+")") 
+        self._tracer.trace('unlink', 'removing pub (%s) from collaboration (%s)', pubUri, collabUri)
         self.remove(
             collabUri,
             self.VIVO['linkedInformationResourceForCollaboration'],
@@ -949,7 +1539,7 @@ class DataSource:
         )
         
     def removeCollaborationFromPub(self, pubUri, collabUri):
-        logging.debug('removing collaboration ('+VivoUri.extractNfromUri(collabUri)+') from publication ('+VivoUri.extractNfromUri(pubUri)+')') 
+        self._tracer.trace('unlink', 'removing collaboration (%s) from publication (%s)', collabUri, pubUri)
         self.remove(
             pubUri,
             self.VIVO['informationResourceInCollaboration'],
@@ -959,27 +1549,15 @@ class DataSource:
     
     
     def authorHasAuthorships(self, authorUri):
-        gen = self._graph.objects(
-            rdflib.term.URIRef(authorUri),
-            self.VIVO['linkedAuthor']
-        )
-        return len(list(gen)) > 0
+        return self._outlinks.get((rdflib.term.URIRef(authorUri), self.VIVO['linkedAuthor']), 0) > 0
 
         
     def collaboratorHasCollaborations(self, collaboratorUri):
-        gen = self._graph.objects(
-            rdflib.term.URIRef(collaboratorUri),
-            self.VIVO['linkedCollaborator']
-        )
-        return len(list(gen)) > 0       
+        return self._outlinks.get((rdflib.term.URIRef(collaboratorUri), self.VIVO['linkedCollaborator']), 0) > 0       
 
     
     def venueHasPublications(self, venueUri):
-        gen = self._graph.objects(
-            rdflib.term.URIRef(venueUri),
-            self.VIVO['publicationVenueFor']
-        )
-        return len(list(gen)) > 0
+        return self._outlinks.get((rdflib.term.URIRef(venueUri), self.VIVO['publicationVenueFor']), 0) > 0
         
         
     
@@ -992,7 +1570,7 @@ class DataSource:
             raise DataSourceException('Author to delete has authorships')
         logging.debug('firing remove command')
         self.removeItem(authorUri)
-        logging.debug('subject count: '+str(self.subReferenceCount(authorUri)))
+        self._tracer.trace('subReferenceCount', '%s: %d', authorUri, self.subReferenceCount(authorUri))
         
         
     def removeCollaborator(self, collaboratorUri):
@@ -1004,7 +1582,7 @@ class DataSource:
             raise DataSourceException ('Collaborator to delete has collaborations')
         logging.debug('firing remove command')
         self.removeItem(collaboratorUri)
-        logging.debug('subject count: '+str(self.subReferenceCount(collaboratorUri)))
+        self._tracer.trace('subReferenceCount', '%s: %d', collaboratorUri, self.subReferenceCount(collaboratorUri))
         
         
     def removeVenue(self, venueUri):
@@ -1017,17 +1595,13 @@ class DataSource:
             raise DataSourceException ('venue to delete has publications')
         logging.debug('firing remove command')
         self.removeItem(venueUri)
-        logging.debug('subject count:' + str(self.subReferenceCount(venueUri)))
+        self._tracer.trace('subReferenceCount', '%s: %d', venueUri, self.subReferenceCount(venueUri))
     
     def getLabel(self, uri):
-        gen = self._graph.objects(
-            rdflib.term.URIRef(uri),
-            self.RDFS['label']
-        )
-        objs = list(gen)
-        if len(objs) == 0:
+        name = self.person_name(uri)
+        if name is None or name.label is None:
             return ''
-        return (objs[0])        
+        return name.label
     
                         
     def getAuthorURIFromAuthorship(self, authorshipUri):
@@ -1085,6 +1659,19 @@ class DataSource:
         return (objs[0])
         
         
+    #uri -> rank for every authorship or collaboration with a rank in field (authorRank or collaboratorRank), in one scan,
+    #made an int once (None where the rank isn't a number).  Like getRank(), the first rank of a uri counts.
+    def ranks(self, field='collaboratorRank'):
+        ranks = {}
+        for (uri, rank) in self._graph.subject_objects(self.VIVO[field]):
+            uri = str(uri)
+            if uri not in ranks:
+                try:
+                    ranks[uri] = int(unicode(rank).strip())
+                except ValueError:
+                    ranks[uri] = None
+        return ranks
+
     def getPublicationPMID(self, uri):
         gen = self._graph.objects(
             rdflib.term.URIRef(uri),
@@ -1093,7 +1680,7 @@ class DataSource:
         objs = list(gen)
         if len(objs) == 0:
             return ''
-        return str(objs[0])
+        return min(str(obj) for obj in objs)
 
     def getPublicationDOI(self, uri):
         gen = self._graph.objects(
@@ -1103,7 +1690,7 @@ class DataSource:
         objs = list(gen)
         if len(objs) == 0:
             return ''
-        return str(objs[0])
+        return min(str(obj) for obj in objs)
     
         
     def getPublicationTitle(self, uri):
@@ -1121,7 +1708,7 @@ class DataSource:
     
         queryText = "SELECT ?pv WHERE{?pv vivo:publicationVenueFor ?ir .}"
         
-        result = self._graph.query(
+        result = self._query("getAllPublicationVenueURIs",
                 queryText,
                 initNs = dict(
                     rdf = self.RDF,
@@ -1138,15 +1725,16 @@ class DataSource:
     #can't this be done like getPublicationPMID (e.g. using self._graph), instead of appending strings?
     def getPublicationVenueURIs(self, uri):
     
-        queryText = "SELECT DISTINCT ?pv WHERE{?pv bibo:issn ?pvid . ?pv vivo:publicationVenueFor <%s> .}"
+        queryText = "SELECT DISTINCT ?pv WHERE{?pv bibo:issn ?pvid . ?pv vivo:publicationVenueFor ?pub .}"
         
-        result = self._graph.query(
-                queryText % (uri),
+        result = self._query("getPublicationVenueURIs",
+                queryText,
                 initNs = dict(
                     bibo = self.BIBO,
                     rdf = self.RDF,
                     vivo = self.VIVO
-                )
+                ),
+                initBindings = dict(pub = rdflib.term.URIRef(uri))
             )   
         venues = []
         for row in result:
@@ -1168,21 +1756,45 @@ class DataSource:
         if len(objs) == 0:
             return ''
         return str(objs[0])
-  
 
-    
+    #the venues of every pub, from one scan of publicationVenueFor and bibo:issn, as dicts of str:
+    #pub -> [venues], venue -> issn and issn -> [venues].  Like getPublicationVenueURIs(), only venues with an ISSN count,
+    #and like getPublicationVenueISSN(), the first ISSN of a venue does.
+    def venue_index(self):
+        venue_issns = {}
+        for (venue, issn) in self._graph.subject_objects(self.BIBO['issn']):
+            venue = str(venue)
+            if venue not in venue_issns:
+                venue_issns[venue] = str(issn)
+        pub_venues = {}
+        issn_venues = {}
+        for (venue, pub) in self._graph.subject_objects(self.VIVO['publicationVenueFor']):
+            venue = str(venue)
+            if venue not in venue_issns:
+                continue
+            venues = pub_venues.setdefault(str(pub), [])
+            if venue not in venues:
+                venues.append(venue)
+            venues = issn_venues.setdefault(venue_issns[venue], [])
+            if venue not in venues:
+                venues.append(venue)
+        return pub_venues, venue_issns, issn_venues
+
+
+
     def getPublicationAuthorURIs(self, uri):
         queryText = """SELECT DISTINCT ?author
                    WHERE {
-                    <%s> vivo:informationResourceInAuthorship ?authorship .
+                    ?pub vivo:informationResourceInAuthorship ?authorship .
                     ?authorship vivo:linkedAuthor ?author .
                    }"""
-        result = self._graph.query(
-                queryText % (uri),
+        result = self._query("getPublicationAuthorURIs",
+                queryText,
                 initNs = dict(
                     bibo = self.BIBO,
                     vivo = self.VIVO
-                )
+                ),
+                initBindings = dict(pub = rdflib.term.URIRef(uri))
             )
         authors = []
         for row in result:
@@ -1196,15 +1808,16 @@ class DataSource:
     def getPublicationCollaboratorURIs(self, uri):
         queryText = """SELECT DISTINCT ?collaborator
                    WHERE {
-                    <%s> vivo:informationResourceInCollaboration ?collaboration .
+                    ?pub vivo:informationResourceInCollaboration ?collaboration .
                     ?collaboration vivo:linkedCollaborator ?collaborator .
                    }"""
-        result = self._graph.query(
-                queryText % (uri),
+        result = self._query("getPublicationCollaboratorURIs",
+                queryText,
                 initNs = dict(
                     bibo = self.BIBO,
                     vivo = self.VIVO
-                )
+                ),
+                initBindings = dict(pub = rdflib.term.URIRef(uri))
             )
         authors = []
         for row in result:
@@ -1214,13 +1827,14 @@ class DataSource:
     def getPublicationAuthorshipURIs(self, uri):
         queryText = """SELECT DISTINCT ?authorship
                    WHERE {
-                    <%s> vivo:informationResourceInAuthorship ?authorship .
+                    ?pub vivo:informationResourceInAuthorship ?authorship .
                    }"""
-        result = self._graph.query(
-                queryText % (uri),
+        result = self._query("getPublicationAuthorshipURIs",
+                queryText,
                 initNs = dict(
                     vivo = self.VIVO
-                )
+                ),
+                initBindings = dict(pub = rdflib.term.URIRef(uri))
             )
         authorships = []
         for row in result:
@@ -1230,13 +1844,14 @@ class DataSource:
     def getPublicationCollaborationURIs(self, uri):
         queryText = """SELECT DISTINCT ?collaboration
                    WHERE {
-                    <%s> vivo:informationResourceInCollaboration ?collaboration .
+                    ?pub vivo:informationResourceInCollaboration ?collaboration .
                    }"""
-        result = self._graph.query(
-                queryText % (uri),
+        result = self._query("getPublicationCollaborationURIs",
+                queryText,
                 initNs = dict(
                     vivo = self.VIVO
-                )
+                ),
+                initBindings = dict(pub = rdflib.term.URIRef(uri))
             )
         collaborations = []
         for row in result:
@@ -1249,7 +1864,7 @@ class DataSource:
     
         queryText = "SELECT DISTINCT ?authorship WHERE {?authorship rdf:type vivo:Authorship .}"
         #print queryText % (authorUri)       
-        result = self._graph.query(
+        result = self._query("getAllAuthorshipURIs",
             queryText,
             initNs = dict(
                 vivo = self.VIVO
@@ -1266,42 +1881,27 @@ class DataSource:
     #get authorship nodes for an author (perhaps for a publication)
     def getAuthorshipURIs(self, authorUri, pubUri=None):
     
+        queryText = "SELECT DISTINCT ?authorship WHERE {?authorship rdf:type vivo:Authorship . ?authorship vivo:linkedInformationResource ?pub . ?authorship vivo:linkedAuthor ?author }"
+        bindings = dict(author = rdflib.term.URIRef(authorUri))
         if pubUri is not None:
-            queryText = "SELECT DISTINCT ?authorship WHERE {?authorship rdf:type vivo:Authorship . ?authorship vivo:linkedInformationResource <%s> . ?authorship vivo:linkedAuthor <%s> }"
-            # queryText = """SELECT DISTINCT ?authorship
-                       # WHERE {
-                    # ?authorship rdf:type vivo:Authorship .
-                    # ?authorship vivo:linkedInformationResource <%s> .
-                    # ?authorship vivo:linkedAuthor <%s> 
-                   # }"""
-            #print queryText % (pubUri, authorUri)       
-            result = self._graph.query(
-                queryText % (authorUri, pubUri),
-                initNs = dict(
-                    vivo = self.VIVO
-                    )
-                )
-        else:
-            queryText = "SELECT DISTINCT ?authorship WHERE {?authorship rdf:type vivo:Authorship . ?authorship vivo:linkedInformationResource ?pub . ?authorship vivo:linkedAuthor <%s> }"
-            #print queryText % (authorUri)       
-            result = self._graph.query(
-                queryText % (authorUri),
-                initNs = dict(
-                    vivo = self.VIVO
-                )
-            )
+            bindings['pub'] = rdflib.term.URIRef(pubUri)
+        result = self._query("getAuthorshipURIs",
+            queryText,
+            initNs = dict(
+                vivo = self.VIVO
+            ),
+            initBindings = bindings
+        )
         
         authorships = []
         for row in result:
-        #    print "result row:"+row
             authorships.append(str(row[0]))
-        #print "I found "+str(len(authorships))+" authorships"   
         return authorships      
 
     def getAllCollaborationURIs(self):
     
         queryText = "SELECT DISTINCT ?collaboration WHERE {?collaboration rdf:type vivo:Collaboration .}"
-        result = self._graph.query(
+        result = self._query("getAllCollaborationURIs",
             queryText,
             initNs = dict(
                 vivo = self.VIVO
@@ -1315,22 +1915,17 @@ class DataSource:
 
     def getCollaborationURIs(self, collabUri, pubUri=None):
     
+        queryText = "SELECT DISTINCT ?collaboration WHERE {?collaboration rdf:type vivo:Collaboration . ?collaboration vivo:linkedInformationResourceForCollaboration ?pub . ?collaboration vivo:linkedCollaborator ?collaborator }"
+        bindings = dict(collaborator = rdflib.term.URIRef(collabUri))
         if pubUri is not None:
-            queryText = "SELECT DISTINCT ?collaboration WHERE {?collaboration rdf:type vivo:Collaboration . ?collaboration vivo:linkedInformationResourceForCollaboration <%s> . ?collaboration vivo:linkedCollaborator <%s> }"
-            result = self._graph.query(
-                queryText % (pubUri, collabUri),
-                initNs = dict(
-                    vivo = self.VIVO
-                    )
-                )
-        else:
-            queryText = "SELECT DISTINCT ?collaboration WHERE {?collaboration rdf:type vivo:Collaboration . ?collaboration vivo:linkedInformationResourceForCollaboration ?pub . ?collaboration vivo:linkedCollaborator <%s> }"
-            result = self._graph.query(
-                queryText % (collabUri),
-                initNs = dict(
-                    vivo = self.VIVO
-                )
-            )
+            bindings['pub'] = rdflib.term.URIRef(pubUri)
+        result = self._query("getCollaborationURIs",
+            queryText,
+            initNs = dict(
+                vivo = self.VIVO
+            ),
+            initBindings = bindings
+        )
         
         collaborations = []
         for row in result:
@@ -1340,71 +1935,27 @@ class DataSource:
     #TODO: currently generates an object that is actually given a name in vivoquery.py.  Better way?
     #Returns an RDFLib Term/Dict.  To access Person name parts more easily, use getLastName() et al.
     def getAuthorName(self, uri):
-        
-        gen = self._graph.objects(
-            rdflib.term.URIRef(uri),
-            self.FOAF['firstName']
-        )
-        objs = list(gen)
-        if len(objs) == 0:
+        name = self.person_name(uri)
+        if name is None or name.fname is None or name.lname is None:
             return uri
-        firstName = objs[0]
-        
-        gen = self._graph.objects(
-            rdflib.term.URIRef(uri),
-            self.VIVO['middleName']
-        )   
-        objs = list(gen)
-        if len(objs) == 0:
-            middleName=''
-        else:   
-            middleName = objs[0]
-        
-        
-        gen = self._graph.objects(
-            rdflib.term.URIRef(uri),
-            self.FOAF['lastName']
-        )
-        objs = list(gen)
-        if len(objs) == 0:
-            return uri
-        lastName = objs[0]
-        return {'fname' : firstName, 'mname': middleName, 'lname' : lastName}        
+        return {'fname' : name.fname, 'mname': name.mname if name.mname is not None else '', 'lname' : name.lname}
 #        return {'fname' : unicode(firstName).encode("utf-8"), 'mname': unicode(middleName).encode("utf-8"), 'lname' : unicode(lastName).encode("utf-8")}
     
     
     def getFirstName(self, personUri):
-        gen = self._graph.objects(
-            rdflib.term.URIRef(personUri),
-            self.FOAF['firstName']
-        )
-        objs = list(gen)
-        if len(objs) == 0:
-            return ""
-        firstName = objs[0]
-        return unicode(firstName).encode("utf-8")
+        return self._name_part(personUri, 'fname')
         
     def getMiddleName(self, personUri):
-        gen = self._graph.objects(
-            rdflib.term.URIRef(personUri),
-            self.VIVO['middleName']
-        )
-        objs = list(gen)
-        if len(objs) == 0:
-            return ""
-        middleName = objs[0]
-        return unicode(middleName).encode("utf-8")
+        return self._name_part(personUri, 'mname')
         
     def getLastName(self, personUri):
-        gen = self._graph.objects(
-            rdflib.term.URIRef(personUri),
-            self.FOAF['lastName']
-        )
-        objs = list(gen)
-        if len(objs) == 0:
+        return self._name_part(personUri, 'lname')
+
+    def _name_part(self, personUri, field):
+        name = self.person_name(personUri)
+        if name is None or getattr(name, field) is None:
             return ""
-        lastName = objs[0]
-        return unicode(lastName).encode("utf-8")        
+        return unicode(getattr(name, field)).encode("utf-8")
     
     #TODO: why is this defined if it's not needed for persistence?    
     def commit(self):
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+import errno
+import getopt
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+from vivodata import DataSource
+from vivouri import VivoUri
+from deduper import Deduper
+from coreffer import Coreffer
+from refsplitter import RefSplitter
+
+
+#workflow.py runs the stages of deduper.py, coreffer.py and refsplitter.py in the order given by a workflow file
+#(see workflow.json) rather than the order hardcoded in their main() functions.  A workflow file is JSON:
+#    {"keyidentifier": "bibo:pmid", "domain": <vivo domain URI, for refsplitter>, "cache": <directory>,
+#     "stages": [{"code": "pd0", "tool": "deduper", "calls": [["dedupePubsPerAuthorship"]]}, ...]}
+#where each call is a method name of the tool's class followed by its arguments.
+#
+#Each stage's output is cached under a key made from the digest of its input graph (DataSource.digest()) and the stage
+#parameters: tool, calls, keyidentifier, domain and the content of the tool's blacklist.  The digest of the output is
+#saved next to the cached file, so a cached stage is skipped without parsing anything, and the graph is only loaded again
+#for the first stage that has to run.  Stages also depend on what is in Vivo when they run: use -f to ignore the cache
+#after Vivo has changed.
+#
+#A Workflow can also be given the Checkpoint whose lookups the deduper stages share, and the venue options (venuemap,
+#venuepolicy, venuechoices, reviewfile) of their Deduper, as batch.py does.  After run(), report has what it did.
+
+class WorkflowException(Exception):
+    def __init__(self, message):
+        logging.error(message)
+
+
+class Workflow:
+
+    TOOLS = {'deduper': Deduper, 'coreffer': Coreffer, 'refsplitter': RefSplitter}
+    BLACKLISTS = {'coreffer': "./BLACKLIST-coreffer.txt", 'refsplitter': "./BLACKLIST-refsplitter.txt"}
+
+    def __init__(self, filename, resume=None, venues=None):
+        self._resume = resume
+        self._venues = venues
+        self.report = {}
+        try:
+            with open(filename, "rb") as workflowfile:
+                spec = json.load(workflowfile)
+        except (IOError, ValueError) as e:
+            raise WorkflowException("there was a problem reading "+filename+" as a workflow: "+str(e))
+        self._keyidentifier = spec.get('keyidentifier', "bibo:pmid")
+        self._domain = spec.get('domain')
+        self._cachedir = spec.get('cache', "./workflow-cache")
+        self._stages = spec.get('stages', [])
+        for stage in self._stages:
+            tool = Workflow.TOOLS.get(stage.get('tool'))
+            if tool is None:
+                raise WorkflowException("unknown tool "+str(stage.get('tool'))+" in workflow stage "+str(stage.get('code')))
+            if 'code' not in stage or not stage.get('calls'):
+                raise WorkflowException("a workflow stage needs a code and a list of calls: "+json.dumps(stage))
+            for call in stage['calls']:
+                if not hasattr(tool, call[0]):
+                    raise WorkflowException(stage['tool']+" has no method "+call[0]+" (workflow stage "+stage['code']+")")
+            if stage['tool'] == 'refsplitter' and not self._domain:
+                raise WorkflowException("the workflow needs a domain for the refsplitter stage "+stage['code'])
+
+    #the cache key for running stage on a graph whose digest is inputDigest
+    def _stage_key(self, stage, inputDigest):
+        params = {'tool': stage['tool'], 'calls': stage['calls'], 'keyidentifier': self._keyidentifier}
+        if stage['tool'] == 'refsplitter':
+            params['domain'] = self._domain
+        if stage['tool'] == 'deduper' and self._venues is not None:
+            params['venuepolicy'] = self._venues.get('venuepolicy', 'prompt')
+            params['venuechoices'] = hashlib.sha1(json.dumps(self._venues.get('venuechoices', {}), sort_keys=True)).hexdigest()
+        blacklist = Workflow.BLACKLISTS.get(stage['tool'])
+        if blacklist is not None and os.path.exists(blacklist):
+            with open(blacklist, "rb") as blackfile:
+                params['blacklist'] = hashlib.sha1(blackfile.read()).hexdigest()
+        return hashlib.sha1(inputDigest + json.dumps(params, sort_keys=True)).hexdigest()
+
+    def _make_tool(self, stage, filename, datasource):
+        if stage['tool'] == 'deduper':
+            return Deduper(filename, self._keyidentifier, stage['code'], datasource=datasource, checkpoint=False, resume=self._resume, **(self._venues or {}))
+        elif stage['tool'] == 'coreffer':
+            return Coreffer(filename, self._keyidentifier, stage['code'], datasource=datasource, checkpoint=False)
+        else:
+            return RefSplitter(self._domain, filename, self._keyidentifier, stage['code'], datasource=datasource)
+
+    #Run the workflow on inputfile and write the last stage's output, named like the scripts name theirs
+    #(e.g. pn0-pd5-...-pd0-<inputfile>).  With force=True, every stage runs, and the cache is refreshed.
+    #Returns the name of the output file.
+    def run(self, inputfile, force=False):
+        #batch.py runs several workflows at once on the same cache, so another one may make it first
+        try:
+            os.makedirs(self._cachedir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        datasource = DataSource(inputfile)
+        digest = datasource.digest()
+        counts = (len(datasource._graph), len(datasource.pubs_by_uid(self._keyidentifier)))
+        self.report = {'triples_in': counts[0], 'pubs_in': counts[1], 'stages_run': 0, 'stages_cached': 0, 'review': 0}
+        current = inputfile
+        outfile = inputfile
+        for stage in self._stages:
+            key = self._stage_key(stage, digest)
+            cachefile = os.path.join(self._cachedir, key+".rdf.xml")
+            sidecar = os.path.join(self._cachedir, key+".json")
+            namefile = outfile
+            outfile = VivoUri.createOutputFileName(outfile, stage['code'])
+            logging.info('-'*65)
+            if not force and os.path.exists(cachefile) and os.path.exists(sidecar):
+                with open(sidecar, "rb") as sidefile:
+                    cached = json.load(sidefile)
+                digest = cached['digest']
+                counts = (cached.get('triples'), cached.get('pubs'))
+                logging.info("%s: unchanged input and parameters, using cached output %s", stage['code'], cachefile)
+                datasource = None
+                current = cachefile
+                self.report['stages_cached'] += 1
+                continue
+            logging.info("%s: running %s %s", stage['code'], stage['tool'], json.dumps(stage['calls']))
+            if datasource is None:
+                datasource = DataSource(current)
+            tool = self._make_tool(stage, namefile, datasource)
+            for call in stage['calls']:
+                getattr(tool, call[0])(*call[1:])
+            self.report['stages_run'] += 1
+            self.report['review'] += len(getattr(tool, '_venuereview', []))
+            inputDigest = digest
+            datasource.serialize(cachefile)
+            digest = datasource.digest()
+            counts = (len(datasource._graph), len(datasource.pubs_by_uid(self._keyidentifier)))
+            #the sidecar is written last, so an interrupted stage is never mistaken for a cached one
+            with open(sidecar, "wb") as sidefile:
+                json.dump({'code': stage['code'], 'tool': stage['tool'], 'calls': stage['calls'], 'input': inputDigest, 'digest': digest,
+                    'triples': counts[0], 'pubs': counts[1]}, sidefile)
+            current = cachefile
+        if datasource is not None:
+            datasource.serialize(outfile)
+        else:
+            shutil.copyfile(current, outfile)
+        self.report.update(output=outfile, triples_out=counts[0], pubs_out=counts[1])
+        logging.info("workflow output written to %s", outfile)
+        return outfile
+
+
+def main():
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', filename='../../logs/workflow.log', filemode='w', level=logging.INFO)
+
+    workflowfile='./workflow.json'
+    inputfile=None
+    force=False
+
+    try:
+        (options, arguments) = getopt.getopt(sys.argv[1:],'w:i:f')
+    except getopt.GetoptError as err:
+        print str(err)
+        print "\n\nThere was an error in your options.\n\nusage: workflow.py -w <workflowfile> -i <inputfile> -f\n\n\t-> <workflowfile> defaults to ./workflow.json.\n\t-> use the -f option to run every stage even if its output is cached.\n\t-> <inputfile> should be an absolute or relative path with the / separator, either on Windows or Unix.\n\n"
+        sys.exit(2)
+    for (opt, arg) in options:
+        if opt in ("-w"):
+            workflowfile=arg
+        elif opt in ("-i"):
+            inputfile=arg
+        elif opt in ("-f"):
+            force=True
+    if inputfile is None:
+        print "\n\nyou must specify an input file with the -i option.\n\n"
+        sys.exit(2)
+
+    outfile = Workflow(workflowfile).run(inputfile, force)
+    print "output written to "+outfile+"\n"
+
+if __name__=='__main__':
+    main()